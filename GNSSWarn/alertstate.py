@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""Alert state store, deduplicate alerts and batch them into digests."""
+
+import os
+import time
+import json
+import hashlib
+import sqlite3
+from collections import namedtuple
+
+Condition = namedtuple('Condition', ('fields', 'text'))
+
+
+def fingerprint(fields):
+    """Return fingerprint of condition fields.
+
+    Arg:
+        fields:condition fields, e.g. (metric, system, type, station).
+    """
+    return hashlib.sha1('/'.join(map(str, fields)).encode('utf-8')).hexdigest()
+
+
+class AlertState(object):
+    """Alert state store.
+
+    Every condition is stored by fingerprint, a condition is new if it was
+    never notified or last notified before suppress seconds. New conditions
+    and their messages wait in pending table until a digest is due, then
+    they wait in unconfirmed table until the digest email is sent. Only a
+    sent digest updates last_sent, so a failed or dropped email does not
+    suppress its conditions.
+
+    Attributes:
+        path:sqlite database path.
+        suppress:seconds of suppress window.
+        digest:seconds between digests, 0 is send at every check.
+    """
+
+    def __init__(self, path, suppress=86400, digest=0):
+        """Initialize AlertState."""
+        self.path = path
+        self.suppress = suppress
+        self.digest = digest
+        self.connection = sqlite3.connect(path)
+        cur = self.connection.cursor()
+        cur.execute('''CREATE TABLE IF NOT EXISTS Alert(fingerprint TEXT
+            PRIMARY KEY, fields TEXT NOT NULL, text TEXT, first_seen DOUBLE,
+            last_seen DOUBLE, last_sent DOUBLE, count INTEGER)''')
+        cur.execute('''CREATE TABLE IF NOT EXISTS Pending(id INTEGER PRIMARY
+            KEY AUTOINCREMENT, fingerprint TEXT, text TEXT, created DOUBLE)''')
+        cur.execute('''CREATE TABLE IF NOT EXISTS Section(id INTEGER PRIMARY
+            KEY AUTOINCREMENT, message TEXT, files TEXT, created DOUBLE)''')
+        cur.execute('''CREATE TABLE IF NOT EXISTS Unconfirmed(fingerprint TEXT
+            PRIMARY KEY, queued DOUBLE)''')
+        cur.execute('''CREATE TABLE IF NOT EXISTS Digest(id INTEGER PRIMARY
+            KEY, last_sent DOUBLE)''')
+        self.connection.commit()
+        cur.close()
+
+    def observe(self, conditions, now=None):
+        """Observe conditions and return new conditions.
+
+        Arg:
+            conditions:conditions, type:list, element type:Condition.
+
+        Return:
+            new:conditions not suppressed, they are added to pending.
+                conditions waiting in pending or unconfirmed are suppressed.
+        """
+        now = now or time.time()
+        new = list()
+        cur = self.connection.cursor()
+        for condition in conditions:
+            key = fingerprint(condition.fields)
+            cur.execute('SELECT last_sent FROM Alert WHERE fingerprint=?',
+                        (key, ))
+            row = cur.fetchone()
+            if row is None:
+                cur.execute(
+                    'INSERT INTO Alert VALUES(?, ?, ?, ?, ?, ?, ?)',
+                    (key, json.dumps(list(map(str, condition.fields))),
+                     condition.text, now, now, None, 1))
+            else:
+                cur.execute(
+                    '''UPDATE Alert SET last_seen=?, text=?, count=count+1
+                    WHERE fingerprint=?''', (now, condition.text, key))
+            if row is not None and row[0] is not None and (
+                    now - row[0] < self.suppress):
+                continue
+            cur.execute(
+                'SELECT 1 FROM Pending WHERE fingerprint=? UNION '
+                'SELECT 1 FROM Unconfirmed WHERE fingerprint=?', (key, key))
+            if cur.fetchone() is None:
+                cur.execute(
+                    'INSERT INTO Pending(fingerprint, text, created) '
+                    'VALUES(?, ?, ?)', (key, condition.text, now))
+                new.append(condition)
+        self.connection.commit()
+        cur.close()
+        return new
+
+    def addsection(self, message, files=None, now=None):
+        """Add message section and attachments to next digest."""
+        now = now or time.time()
+        cur = self.connection.cursor()
+        cur.execute('INSERT INTO Section(message, files, created) '
+                    'VALUES(?, ?, ?)', (message, json.dumps(files or []), now))
+        self.connection.commit()
+        cur.close()
+
+    def popdigest(self, now=None, force=False):
+        """Return digest if it is due, pending conditions are cleared.
+
+        Return:
+            message:digest message, if no digest is due, return None.
+            files:attachments of digest.
+            keys:fingerprints of digest conditions, they are unconfirmed
+                until confirm.
+        """
+        now = now or time.time()
+        cur = self.connection.cursor()
+        cur.execute('SELECT last_sent FROM Digest WHERE id=0')
+        row = cur.fetchone()
+        if (not force and row and row[0] is not None and
+                now - row[0] < self.digest):
+            cur.close()
+            return None, None, None
+        cur.execute('SELECT fingerprint, text FROM Pending ORDER BY id')
+        rows = cur.fetchall()
+        texts = [text for _, text in rows]
+        cur.execute('SELECT message, files FROM Section ORDER BY id')
+        sections = cur.fetchall()
+        if not texts:
+            cur.close()
+            return None, None, None
+        message = 'New alerts:\n\n%s\n\n' % '\n'.join(texts)
+        message += ''.join(section for section, _ in sections)
+        files = list()
+        for _, section_files in sections:
+            for filepath in json.loads(section_files):
+                if filepath not in files and os.path.isfile(filepath):
+                    files.append(filepath)
+        keys = [key for key, _ in rows]
+        cur.executemany(
+            'INSERT OR REPLACE INTO Unconfirmed VALUES(?, ?)',
+            [(key, now) for key in keys])
+        cur.execute('DELETE FROM Pending')
+        cur.execute('DELETE FROM Section')
+        cur.execute('INSERT OR REPLACE INTO Digest VALUES(0, ?)', (now, ))
+        self.connection.commit()
+        cur.close()
+        return message, files, keys
+
+    def confirm(self, keys, now=None):
+        """Digest email of conditions is sent, update their last_sent.
+
+        Arg:
+            keys:fingerprints returned by popdigest.
+        """
+        now = now or time.time()
+        cur = self.connection.cursor()
+        cur.executemany('UPDATE Alert SET last_sent=? WHERE fingerprint=?',
+                        [(now, key) for key in keys])
+        cur.executemany('DELETE FROM Unconfirmed WHERE fingerprint=?',
+                        [(key, ) for key in keys])
+        self.connection.commit()
+        cur.close()
+
+    def release(self, keys):
+        """Release unconfirmed conditions except keys.
+
+        Digest failed after all retries or dropped from outbox is never
+        confirmed, its conditions are new again at next observe.
+
+        Arg:
+            keys:fingerprints of digests still waiting in outbox.
+        """
+        keys = set(keys)
+        cur = self.connection.cursor()
+        cur.execute('SELECT fingerprint FROM Unconfirmed')
+        lost = [row for row in cur.fetchall() if row[0] not in keys]
+        cur.executemany('DELETE FROM Unconfirmed WHERE fingerprint=?', lost)
+        self.connection.commit()
+        cur.close()
+
+    def purge(self, now=None):
+        """Remove conditions not seen in suppress window."""
+        now = now or time.time()
+        cur = self.connection.cursor()
+        cur.execute('DELETE FROM Alert WHERE last_seen < ?',
+                    (now - self.suppress, ))
+        self.connection.commit()
+        cur.close()
+
+    def close(self):
+        self.connection.close()
@@ -5,8 +5,9 @@ import os
 import datetime
 import glob
 from .notificate.notificate import Notify
+from .notificate import notificate
+from .alertstate import AlertState, Condition
 from collections import namedtuple
-import re
 import sqlite3
 import platform
 if platform.system() == 'Linux':
@@ -16,29 +17,39 @@ import matplotlib.pyplot as plt
 import matplotlib.cm as cm
 import pandas as pd
 import numpy as np
-
-Config = namedtuple(
-    'Config',
-    ('path', 'system', 'type', 'endout', 'midout', 'evaluation', 'respath'))
+import archive
+import catalog
+import readdata
+import resultwriter
+import statistic
+from series import SeriesStore
+
+Config = namedtuple('Config',
+                    ('path', 'system', 'type', 'endout', 'midout',
+                     'evaluation', 'respath', 'suppress', 'digest', 'alertdb'))
 BadStation = namedtuple('BadStation', ('stations', 'system', 'type'))
 
 
-def plot(badstations, date, endouts, respath):
+def plot(badstations, date, endouts, respath, series=None):
     """Plot badstations.
 
+    Station series parsed by evaluation are used, coor files are only read
+    for stations not in series.
+
     Args:
         badstations:station whose une has exceeded threshold.
         date:date.
         endouts:endoutput path.
         respath:result file path.
+        series:U, N, E series of stations, type:dict,
+            key:(system, type), value:series.SeriesStore.
 
     Return:
         figpaths:figure paths.
     """
 
     figpaths = list()
-    rfname = re.compile('(\w{4})%s\.coor' %
-                        '{:0>3d}'.format(date.timetuple().tm_yday))
+    series = series or dict()
     for stations in badstations:
         # threshold
         if stations.type == 'DFPPP':
@@ -56,23 +67,21 @@ def plot(badstations, date, endouts, respath):
                 endout = endouts[1]
             elif stations.type == 'SFPPP':
                 endout = endouts[3]
-        # find files
-        sitefiles = list()
-        for ifile in os.listdir(endout):
-            if ifile[:4] in stations.stations and rfname.match(ifile):
-                sitefiles.append(os.path.join(endout, ifile))
+        sitedata = series.get((stations.system, stations.type))
 
         # plot
         plt.style.use('ggplot')
         f, axes = plt.subplots(3, sharex=True, sharey=True)
         colors = iter(cm.rainbow(np.linspace(0, 1, 5)))
-        for ifile in sitefiles:
-            sitename = rfname.findall(ifile)[0]
-            data = pd.read_table(
-                ifile, delim_whitespace=True).apply(
-                    pd.to_numeric, errors='coerce')
+        for sitename in stations.stations:
+            if sitedata is not None and sitename in sitedata:
+                data = sitedata.get(sitename)
+            else:
+                data = readsite(endout, sitename, date)
+            if data is None:
+                continue
             color = next(colors)
-            x_axis = (data.ws % 86400) / 3600.0
+            x_axis = data.time / 3600.0
             axes[0].scatter(x_axis, data.U, s=1, color=color)
             axes[1].scatter(x_axis, data.N, s=1, color=color, label=sitename)
             axes[2].scatter(x_axis, data.E, s=1, color=color)
@@ -101,17 +110,41 @@ def plot(badstations, date, endouts, respath):
                           (stations.system, stations.type, str(date)))
 
         # save fig
-        if not os.path.exists(respath):
-            os.makedirs(respath)
         figpath = os.path.join(respath, '%s-%s-%s.png' %
                                (stations.system, stations.type, str(date)))
-        f.savefig(figpath, bbox_inches='tight')
+        resultwriter.getwriter().savefig(f, figpath, bbox_inches='tight')
         figpaths.append(figpath)
         plt.clf()
         plt.close()
     return figpaths
 
 
+def readsite(endout, name, date):
+    """Read coor file of station.
+
+    Coor file is found in file catalog, so compressed coor file and member
+    of bundle are also read.
+
+    Return:
+        data:U, N, E series, type:namedtuple of series.SeriesStore, if not
+            find or read failed, return None.
+    """
+    filepath = catalog.getcatalog().find(endout, 'coor', date, station=name)
+    if filepath is None:
+        return None
+    try:
+        with archive.openfile(filepath) as f:
+            data = pd.read_table(
+                f, delim_whitespace=True).apply(
+                    pd.to_numeric, errors='coerce')
+        store = SeriesStore(capacity=len(data))
+        store.appendframe(name, data)
+    except Exception:
+        print('Read %s failed!' % filepath)
+        return None
+    return store.get(name)
+
+
 def coordinate(name):
     """Return site coordinate-(B, L)"""
     station = os.path.join(
@@ -145,6 +178,9 @@ def readconfig():
     midout = ''
     evaluation = ''
     respath = ''
+    suppress = 24
+    digest = 0
+    alertdb = os.path.join(os.path.dirname(__file__), 'alert.sqlite')
     with open(configpath) as f:
         for line in f:
             if line.startswith('path'):
@@ -161,8 +197,21 @@ def readconfig():
                 midout = line.split('=')[1].strip()
             if line.startswith('evaluation'):
                 evaluation = line.split('=')[1].strip()
-
-    config = Config(paths, systems, types, endouts, midout, evaluation, respath)
+            if line.startswith('suppress'):
+                value = line.split('=')[1].strip()
+                if value:
+                    suppress = float(value)
+            if line.startswith('digest'):
+                value = line.split('=')[1].strip()
+                if value:
+                    digest = float(value)
+            if line.startswith('alertdb'):
+                value = line.split('=')[1].strip()
+                if value:
+                    alertdb = value
+
+    config = Config(paths, systems, types, endouts, midout, evaluation,
+                    respath, suppress * 3600, digest * 60, alertdb)
     # check path, system and type
     for ipath in paths:
         if not os.path.exists(ipath):
@@ -198,7 +247,7 @@ def readconfig():
     return config
 
 
-def checksatnums(filepath, date, evaluation, respath):
+def checksatnums(filepath, date, evaluation, respath, artifacts=None):
     """read corr file and checksatnums.
 
     Args:
@@ -206,24 +255,31 @@ def checksatnums(filepath, date, evaluation, respath):
         date:date.
         evaluation:evaluation result path.
         respath:report path.
+        artifacts:result files of evaluation run, satellite nums figures
+            are taken from them, if None, found in evaluation path.
+
+    Return:
+        message:satellite nums message.
+        satfigs:satellite nums figures.
+        conditions:alert conditions, fingerprint include outage date.
     """
-    date_s = ''.join(str(date).split('-'))
-    # retrieve coorect files
-    bds_corr = ''.join(['CorrBDS', date_s, '.txt'])
-    gps_corr = ''.join(['CorrGPS', date_s, '.txt'])
-    bds_files = glob.glob(os.path.join(filepath, bds_corr))
-    gps_files = glob.glob(os.path.join(filepath, gps_corr))
     message = ''
-    if not bds_files:
-        message += 'No BDS correct file\n'
-    if not gps_files:
-        message += 'No GPS correct file\n'
-    # start read
+    conditions = list()
     sat_num = dict()
-    for path in bds_files:
-        sat_num['BDS'] = readSatNum(path, date, 'BDS')
-    for path in gps_files:
-        sat_num['GPS'] = readSatNum(path, date, 'GPS')
+    for gsystem in ['BDS', 'GPS']:
+        # correct file may be compressed or a member of bundle
+        path = catalog.getcatalog().corrfile(filepath, gsystem, date)
+        if path is None:
+            message += 'No %s correct file\n' % gsystem
+            conditions.append(Condition(('nocorr', gsystem, date),
+                                        '%s no correct file at %s' %
+                                        (gsystem, date)))
+            continue
+        try:
+            sat_num[gsystem] = list(
+                readdata.readSatNum(path, date, gsystem).values())
+        except Exception:
+            print('Read %s failed!' % path)
     # check satnums
     missbds = 0
     badbds = 0
@@ -235,50 +291,86 @@ def checksatnums(filepath, date, evaluation, respath):
     if 'GPS' in sat_num:
         missgps = 86400 - len(sat_num['GPS'])
         badgps = len([num for num in sat_num['GPS'] if num < 4])
-    if missbds > 2500:
-        message += 'BDS Sat.Num = 0: %s\n' % missbds
-    if missgps > 2500:
-        message += 'GPS Sat.Num = 0: %s\n' % missgps
-    if badbds > 100:
-        message += 'BDS Sat.Num < 4: %s\n' % badbds
-    if badgps > 100:
-        message += 'GPS Sat.Num < 4: %s\n' % badgps
+    for gsystem, miss, bad in [('BDS', missbds, badbds),
+                               ('GPS', missgps, badgps)]:
+        if miss > 2500:
+            message += '%s Sat.Num = 0: %s\n' % (gsystem, miss)
+            conditions.append(
+                Condition(('satnum0', gsystem, date), '%s Sat.Num = 0: %s at %s'
+                          % (gsystem, miss, date)))
+        if bad > 100:
+            message += '%s Sat.Num < 4: %s\n' % (gsystem, bad)
+            conditions.append(
+                Condition(('satnum4', gsystem, date), '%s Sat.Num < 4: %s at %s'
+                          % (gsystem, bad, date)))
     if not message:
-        return message, None
+        return message, None, conditions
     message = 'Report of satellite nums:\n\n%s' % message
-    if not os.path.exists(respath):
-        os.makedirs(respath)
     reportpath = os.path.join(respath, 'report-%s.txt' % str(date))
-    with open(reportpath, 'a') as f:
-        f.write(message)
-    satpath = os.path.join(evaluation, 'Correct', str(date))
-    satfigs = glob.glob(os.path.join(satpath, '*.png'))
+    resultwriter.getwriter().append(reportpath, message)
+    if artifacts is not None:
+        satfigs = [
+            path for path in artifacts
+            if path.endswith('%s-satnum.png' % str(date))
+        ]
+    else:
+        satpath = os.path.join(evaluation, 'Correct', str(date))
+        satfigs = glob.glob(os.path.join(satpath, '*.png'))
     print(message)
-    return message, satfigs
+    return message, satfigs, conditions
 
 
-def readSatNum(filepath, date, gsystem):
-    """Read satellite number of correct file.
+def checkiode(evaluation, date, respath):
+    """read iode table of all satellites and check iode updates.
 
     Args:
-        filepath:coorect filepath.
-        date:file date.
-        gsystem:GNSS system.
+        evaluation:evaluation result path.
+        date:date.
+        respath:report path.
 
     Return:
-        sat_num:satellite number, type:OrderedDict.
+        message:iode message.
+        tables:iode tables.
+        conditions:alert conditions.
     """
-    sat_num = list()
-    day_flag = (date.timetuple().tm_wday + 1) % 7
-    with open(filepath) as f:
-        for line in f:
-            if line.startswith(gsystem):
-                satnum = int(line.split()[1])
-                sattime = int(line.split()[2])
-                day = datetime.timedelta(seconds=sattime).days
-                if day == day_flag:
-                    sat_num.append(satnum)
-    return sat_num
+    message = ''
+    tables = list()
+    conditions = list()
+    for gsystem in ['BDS', 'GPS']:
+        tablepath = os.path.join(evaluation, str(date), 'Correct',
+                                 '%s-%s-iode.csv' % (gsystem, str(date)))
+        if not os.path.isfile(tablepath):
+            continue
+        badsats = list()
+        with open(tablepath) as f:
+            for line in f:
+                if line.startswith('prn'):
+                    continue
+                pieces = line.split('\t')
+                prn = pieces[0]
+                missed, duplicated = int(pieces[5]), int(pieces[6])
+                stale, max_age = float(pieces[7]), float(pieces[8])
+                if missed or duplicated or stale > 30:
+                    badsats.append('%s:%10d%10d%10.2f%10.2f' % (
+                        prn, missed, duplicated, stale, max_age))
+                    conditions.append(
+                        Condition(('iode', gsystem, prn),
+                                  '%s %s abnormal iode updates' % (gsystem,
+                                                                   prn)))
+        if badsats:
+            message += '%s %s satellites had abnormal iode updates:\n\n' % (
+                gsystem, len(badsats))
+            message += '{}{:>10}{:>10}{:>10}{:>10}\n'.format(
+                'prn', 'missed', 'dup', 'stale', 'max_age')
+            message += '\n'.join(badsats) + '\n\n'
+            tables.append(tablepath)
+    if not message:
+        return message, None, conditions
+    message = 'Report of satellite iode:\n\n%s' % message
+    reportpath = os.path.join(respath, 'report-%s.txt' % str(date))
+    resultwriter.getwriter().append(reportpath, message)
+    print(message)
+    return message, tables, conditions
 
 
 def readreport(filepath, gsystem, etype, date, respath):
@@ -294,6 +386,8 @@ def readreport(filepath, gsystem, etype, date, respath):
     Return:
         stations:bad stations.
         reportpath:report path.
+        message:report message.
+        conditions:alert conditions.
     """
     if etype == 'DFPPP':
         threshold = 1
@@ -305,24 +399,26 @@ def readreport(filepath, gsystem, etype, date, respath):
     nullstations = list()
     badstations = list()
     stations = None
-    count = 0
-    with open(filepath) as f:
-        for line in f:
-            if line.startswith('name'):
-                continue
-            count += 1
-            pieces = line.split()
-            name, data = pieces[0], list(map(float, pieces[5:8]))
-            # check if null station
-            if not all(data):
-                nullstations.append(name)
-            for value in data:
-                if value > threshold:
-                    badstations.append([name, data])
-                    break
+    # full precision columns are read if saved
+    table = statistic.loadreport(filepath)
+    count = len(table)
+    columns = [table[col].values for col in ['U_95', 'N_95', 'E_95']]
+    for name, data in zip(table['name'].values, zip(*columns)):
+        data = list(map(float, data))
+        # check if null station
+        if not all(data):
+            nullstations.append(name)
+        for value in data:
+            if value > threshold:
+                badstations.append([name, data])
+                break
     message = ''
     report = ''
+    conditions = list()
     if len(nullstations) > 5:
+        conditions.extend(
+            Condition(('empty', gsystem, etype, name), '%s-%s %s empty data' %
+                      (gsystem, etype, name)) for name in nullstations)
         message += '%s-%s, %s/%s stations had empty data:%s\n\n' % (
             gsystem, etype, len(nullstations), count, ' '.join(nullstations))
         report = message
@@ -330,11 +426,15 @@ def readreport(filepath, gsystem, etype, date, respath):
 
         message += '%s-%s, %s/%s stations 95%% UNE exceeded %sm' % (
             gsystem, etype, len(badstations), count, threshold)
+        conditions.extend(
+            Condition(('UNE95', gsystem, etype, name), '%s-%s %s 95%% UNE '
+                      'exceeded %sm' % (gsystem, etype, name, threshold))
+            for name, _ in badstations)
         report = message + ':\n\n'
         report += '{}{:>10}{:>10}{:>10}{:>10}{:>10}\n'.format('site', 'B', 'L',
                                                               'U', 'N', 'E')
 
-        badstations.sort(lambda x, y: y[1][0] > x[1][0])
+        badstations.sort(key=lambda t: t[1][0], reverse=True)
 
         def f(t):
             b, l = coordinate(t[0])
@@ -349,60 +449,101 @@ def readreport(filepath, gsystem, etype, date, respath):
 
     reportpath = None
     if report:
-        if not os.path.exists(respath):
-            os.makedirs(respath)
         reportpath = os.path.join(respath, 'report-%s.txt' % str(date))
-        if not os.path.exists(reportpath):
-            with open(reportpath, 'w') as f:
-                f.write('Report of position quality:\n\n')
-        with open(reportpath, 'a') as f:
-            f.write(report)
+        resultwriter.getwriter().append(
+            reportpath, report, header='Report of position quality:\n\n')
+
+    return stations, reportpath, message, conditions
+
+
+def flush(timeout=None):
+    """Wait until notifications are sent.
+
+    Arg:
+        timeout:seconds to wait, None is wait forever.
+    """
+    return notificate.flush(timeout)
 
-    return stations, reportpath, message
 
+def check(series=None, artifacts=None):
+    """check report.
 
-def check():
-    """check report."""
+    Args:
+        series:U, N, E series of stations parsed by evaluation of the
+            same run, type:dict, key:(system, type),
+            value:series.SeriesStore.
+        artifacts:result files of evaluation of the same run, reports are
+            taken from them, if None, reports are found in report path.
+    """
     # read configure file
     config = readconfig()
     if not config:
         print('Read configure.ini failed, program will not check!')
         return
 
+    # send emails left by last run
+    notificate.start()
     # start check
     date = datetime.datetime.now().date() - datetime.timedelta(days=1)
     respath = os.path.join(config.respath, str(date))
+    # outbox keeps alert database of digests across runs
+    alertdb = os.path.abspath(config.alertdb)
+    state = AlertState(alertdb, config.suppress, config.digest)
+    # alerts of digests failed or dropped from outbox are new again
+    state.release(notificate.pendingalerts(alertdb))
     # check position quality
     subject = 'Position report of %s' % str(date)
     message = ''
     badstations = list()
     files = list()
     for ipath, isystem, itype in zip(config.path, config.system, config.type):
-        filepath = glob.glob(os.path.join(ipath, str(date), '*.csv'))
+        if artifacts is not None:
+            fname = '-'.join([itype, isystem, str(date), 'report.csv'])
+            # report of report path first, then of other profiles
+            filepath = sorted(
+                [path for path in artifacts
+                 if os.path.basename(path) == fname],
+                key=lambda path: not path.startswith(ipath))
+        else:
+            filepath = glob.glob(os.path.join(ipath, str(date), '*.csv'))
         if not filepath:
             continue
         path = filepath[0]
-        stations, reportpath, unemsg = readreport(path, isystem, itype, date,
-                                                  respath)
+        stations, reportpath, unemsg, conditions = readreport(
+            path, isystem, itype, date, respath)
+        # only report system and type with new conditions
+        if not state.observe(conditions):
+            continue
         if unemsg:
             message += unemsg + '\n'
         if reportpath and reportpath not in files:
             files.append(reportpath)
         if stations:
             badstations.append(stations)
-    figpaths = plot(badstations, date, config.endout, respath)
+    figpaths = plot(badstations, date, config.endout, respath, series)
     if figpaths:
         files.extend(figpaths)
-        message = 'Report of position quality:\n\n' + message + '\n\n'
+    if message:
+        state.addsection('Report of position quality:\n\n' + message +
+                         '\n\n', files)
     # check satellite nums
-    satmsg, satfigs = checksatnums(config.midout, date, config.evaluation,
-                                   respath)
-    if satmsg:
-        message += satmsg
-    if satfigs:
-        files.extend(satfigs)
-
-    # notificate
+    satmsg, satfigs, conditions = checksatnums(config.midout, date,
+                                               config.evaluation, respath,
+                                               artifacts)
+    if satmsg and state.observe(conditions):
+        state.addsection(satmsg, satfigs)
+    # check satellite iode
+    iodemsg, iodetables, conditions = checkiode(config.evaluation, date,
+                                                respath)
+    if iodemsg and state.observe(conditions):
+        state.addsection(iodemsg, iodetables)
+
+    # write reports before they are attached
+    resultwriter.getwriter().flush()
+    # notificate digest
+    message, files, keys = state.popdigest()
+    state.purge()
+    state.close()
     if message:
         notify = Notify()
-        notify.notificate(subject, message, files)
+        notify.notificate(subject, message, files, alertdb, keys)
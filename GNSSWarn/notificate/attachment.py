@@ -0,0 +1,111 @@
+#!usr/bin/env python
+# coding:utf-8
+"""Attachment pipeline, compress reports and merge figures in budget."""
+
+import os
+import gzip
+import shutil
+import math
+import platform
+if platform.system() == 'Linux':
+    import matplotlib
+    matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import matplotlib.image as mpimg
+
+TEXT_EXTS = ['.txt', '.csv']
+IMAGE_EXTS = ['.png', '.jpg', '.jpeg']
+
+
+def encodedsize(filepath):
+    """Return base64 encoded size of file in email."""
+    size = os.path.getsize(filepath)
+    return int(math.ceil(size / 3.0) * 4 * 77 / 76.0)
+
+
+def compress(filepath, workdir):
+    """Compress text file by gzip, return compressed file path."""
+    gzpath = os.path.join(workdir, os.path.basename(filepath) + '.gz')
+    with open(filepath, 'rb') as fin:
+        with gzip.open(gzpath, 'wb') as fout:
+            shutil.copyfileobj(fin, fout)
+    return gzpath
+
+
+def contactsheet(figpaths, workdir, dpi=60):
+    """Merge figures into a low resolution contact sheet.
+
+    Args:
+        figpaths:figure paths.
+        workdir:directory to save contact sheet.
+        dpi:contact sheet dpi.
+
+    Return:
+        sheetpath:contact sheet path.
+    """
+    cols = int(math.ceil(math.sqrt(len(figpaths))))
+    rows = int(math.ceil(len(figpaths) / float(cols)))
+    f, axes = plt.subplots(
+        rows, cols, figsize=(6 * cols, 4 * rows), squeeze=False)
+    for ax in axes.flat:
+        ax.axis('off')
+    for ax, figpath in zip(axes.flat, figpaths):
+        try:
+            ax.imshow(mpimg.imread(figpath))
+        except Exception:
+            continue
+        ax.set_title(os.path.basename(figpath), size=10, weight='bold')
+    sheetpath = os.path.join(workdir, 'figures-%ddpi.png' % dpi)
+    f.savefig(sheetpath, dpi=dpi, bbox_inches='tight')
+    plt.clf()
+    plt.close()
+    return sheetpath
+
+
+def prepare(files, budget, workdir):
+    """Prepare attachments within byte budget.
+
+    Text reports are compressed by gzip, figures are attached as they are
+    if they fit, or merged into one contact sheet whose resolution is
+    lowered until it fits. Files out of
+    budget are not attached and returned as links.
+
+    Args:
+        files:attachment file paths.
+        budget:max encoded bytes of all attachments, 0 is unlimited.
+        workdir:directory to save prepared attachments.
+
+    Return:
+        attachments:prepared attachment paths.
+        links:file paths not attached.
+    """
+    texts = [f for f in files if os.path.splitext(f)[1].lower() in TEXT_EXTS]
+    figs = [f for f in files if os.path.splitext(f)[1].lower() in IMAGE_EXTS]
+    others = [f for f in files if f not in texts and f not in figs]
+    attachments = list()
+    links = list()
+    used = 0
+
+    def add(filepath, source):
+        size = encodedsize(filepath)
+        if budget and used + size > budget:
+            links.extend(source)
+            return 0
+        attachments.append(filepath)
+        return size
+
+    for filepath in texts:
+        used += add(compress(filepath, workdir), [filepath])
+    if not budget or used + sum(encodedsize(f) for f in figs) <= budget:
+        # original figures fit, contact sheet is only made out of budget
+        for filepath in figs:
+            used += add(filepath, [filepath])
+    elif figs:
+        for dpi in [60, 40, 25]:
+            sheetpath = contactsheet(figs, workdir, dpi)
+            if not budget or used + encodedsize(sheetpath) <= budget:
+                break
+        used += add(sheetpath, figs)
+    for filepath in others:
+        used += add(filepath, [filepath])
+    return attachments, links
@@ -0,0 +1,103 @@
+#!usr/bin/env python
+# coding:utf-8
+"""Local in-process SMTP server for testing notification.
+
+Usage:
+    server = LocalSMTPServer()
+    host, port = server.start()
+    # set email_server = host, email_port = port in notificate.ini
+    ...
+    server.messages  # received (from_addr, to_addrs, data)
+    server.stop()
+"""
+
+import socketserver
+import threading
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Handle one SMTP session, support EHLO, MAIL, RCPT, DATA, NOOP."""
+
+    def reply(self, line):
+        self.wfile.write((line + '\r\n').encode('utf-8'))
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        self.reply('220 localhost LocalSMTPServer')
+        from_addr = None
+        to_addrs = list()
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            line = line.decode('utf-8').rstrip('\r\n')
+            command = line[:4].upper()
+            if server.fail:
+                server.fail -= 1
+                self.reply('451 Temporary failure')
+            elif command == 'EHLO':
+                self.reply('250-localhost')
+                self.reply('250 8BITMIME')
+            elif command == 'HELO':
+                self.reply('250 localhost')
+            elif command == 'MAIL':
+                from_addr = line.split(':', 1)[1].strip().strip('<>')
+                to_addrs = list()
+                self.reply('250 OK')
+            elif command == 'RCPT':
+                to_addrs.append(line.split(':', 1)[1].strip().strip('<>'))
+                self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = list()
+                while True:
+                    line = self.rfile.readline().decode('utf-8')
+                    if line.rstrip('\r\n') == '.':
+                        break
+                    if line.startswith('..'):
+                        line = line[1:]
+                    data.append(line)
+                with server.lock:
+                    server.messages.append((from_addr, to_addrs,
+                                            ''.join(data)))
+                self.reply('250 OK')
+            elif command in ['NOOP', 'RSET']:
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class LocalSMTPServer(socketserver.ThreadingTCPServer):
+    """Local SMTP server which stores received messages in memory.
+
+    Attributes:
+        messages:received messages, element:(from_addr, to_addrs, data).
+        connections:number of SMTP sessions.
+        fail:number of next commands answered with temporary failure.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), _Handler)
+        self.messages = list()
+        self.connections = 0
+        self.fail = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        """Serve in background thread and return (host, port)."""
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self.server_address
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -10,6 +10,25 @@ from email import encoders
 import smtplib
 import datetime
 import time
+import json
+import uuid
+import threading
+import tempfile
+import shutil
+import sqlite3
+import contextlib
+from . import attachment
+from ..alertstate import AlertState
+try:
+    # profiling of the evaluation run, GNSSWarn also runs without it
+    import profiling
+except ImportError:
+    profiling = None
+
+_config = None
+_config_mtime = None
+_sender = None
+_lock = threading.Lock()
 
 
 class Config(object):
@@ -20,6 +39,12 @@ class Config(object):
         self.email_password = None
         self.email_server = None
         self.email_port = None
+        self.outbox = os.path.join(os.path.dirname(__file__), 'outbox')
+        self.retry = 5
+        self.retry_delay = 60
+        self.timeout = 60
+        self.attachment_budget = 5 * 1024 * 1024
+        self.allow_plain_login = False
         self.addr = addr
         self.name = name
 
@@ -27,13 +52,19 @@ class Config(object):
 def readconfig():
     """Read configure file.
 
+    Configure is cached and only read again when notificate.ini changed.
+
     Return:
         config, type:Config.
     """
+    global _config, _config_mtime
     configpath = os.path.join(os.path.dirname(__file__), 'notificate.ini')
     if not os.path.isfile(configpath):
         print('Not find notificate.ini\n')
         return None
+    mtime = os.path.getmtime(configpath)
+    if _config and mtime == _config_mtime:
+        return _config
     config = Config(list(), list())
     with open(configpath) as f:
         for line in f:
@@ -69,9 +100,34 @@ def readconfig():
                 email_port = line.split('=')[1].strip()
                 if email_port:
                     config.email_port = int(email_port)
+            if line.startswith('outbox'):
+                outbox = line.split('=')[1].strip()
+                if outbox:
+                    config.outbox = outbox
+            if line.startswith('retry_delay'):
+                retry_delay = line.split('=')[1].strip()
+                if retry_delay:
+                    config.retry_delay = int(retry_delay)
+            elif line.startswith('retry'):
+                retry = line.split('=')[1].strip()
+                if retry:
+                    config.retry = int(retry)
+            if line.startswith('attachment_budget'):
+                budget = line.split('=')[1].strip()
+                if budget:
+                    config.attachment_budget = int(float(budget) * 1024 * 1024)
+            if line.startswith('allow_plain_login'):
+                allow = line.split('=')[1].strip().lower()
+                config.allow_plain_login = allow in ['yes', 'true', '1']
+            if line.startswith('timeout'):
+                timeout = line.split('=')[1].strip()
+                if timeout:
+                    config.timeout = int(timeout)
     if not config.addr or not config.name:
         print('Not find valid email or name information\n')
         return None
+    _config = config
+    _config_mtime = mtime
     return config
 
 
@@ -80,14 +136,269 @@ def _format_addr(s):
     return formataddr((Header(name, 'utf-8').encode(), addr))
 
 
+class Outbox(object):
+    """Durable outbox, every pending email is a json file.
+
+    Emails left in outbox are sent again when sender starts, emails failed
+    after all retries are moved to failed directory. An email of alert
+    digest keeps alert database and fingerprints, they are confirmed when
+    the email is sent.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.failedpath = os.path.join(path, 'failed')
+        if not os.path.exists(self.failedpath):
+            os.makedirs(self.failedpath)
+
+    def put(self, from_addr, to_addrs, msg, alertdb=None, keys=None):
+        """Store email and return its name."""
+        name = '%s-%s.json' % (
+            datetime.datetime.now().strftime('%Y%m%d%H%M%S'), uuid.uuid4().hex)
+        self.write(name, {
+            'from_addr': from_addr,
+            'to_addrs': to_addrs,
+            'msg': msg,
+            'attempts': 0,
+            'next_try': 0,
+            'alertdb': alertdb,
+            'keys': keys or []
+        })
+        return name
+
+    def write(self, name, item):
+        """Write email atomically."""
+        filepath = os.path.join(self.path, name)
+        with open(filepath + '.tmp', 'w') as f:
+            json.dump(item, f)
+        os.replace(filepath + '.tmp', filepath)
+
+    def read(self, name):
+        """Read email, if not exists, return None."""
+        try:
+            with open(os.path.join(self.path, name)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def pending(self):
+        """Return names of pending emails ordered by create time."""
+        return sorted(name for name in os.listdir(self.path)
+                      if name.endswith('.json'))
+
+    def alertkeys(self, alertdb):
+        """Return fingerprints of pending emails of alert database."""
+        keys = list()
+        for name in self.pending():
+            item = self.read(name)
+            if item and item.get('alertdb') == alertdb:
+                keys.extend(item.get('keys', []))
+        return keys
+
+    def remove(self, name):
+        os.remove(os.path.join(self.path, name))
+
+    def fail(self, name):
+        os.replace(
+            os.path.join(self.path, name), os.path.join(self.failedpath, name))
+
+
+class Mailer(object):
+    """Persistent SMTP session which is reused by all emails."""
+
+    def __init__(self, config):
+        self.config = config
+        self.server = None
+
+    def connect(self):
+        config = self.config
+        server = smtplib.SMTP(
+            config.email_server, config.email_port, timeout=config.timeout)
+        server.ehlo()
+        if server.has_extn('starttls'):
+            server.starttls()
+            server.ehlo()
+        elif config.email_user and not config.allow_plain_login:
+            # STARTTLS may be stripped in the middle, password is not sent
+            # in cleartext unless allowed
+            server.close()
+            raise smtplib.SMTPNotSupportedError(
+                'STARTTLS is not supported by %s, login refused' %
+                config.email_server)
+        if config.email_user:
+            server.login(config.email_user, config.email_password)
+        self.server = server
+
+    def alive(self):
+        if not self.server:
+            return False
+        try:
+            return self.server.noop()[0] == 250
+        except (smtplib.SMTPException, IOError, OSError):
+            return False
+
+    def send(self, from_addr, to_addrs, msg):
+        if not self.alive():
+            self.close()
+            self.connect()
+        self.server.sendmail(from_addr, to_addrs, msg)
+
+    def close(self):
+        if self.server:
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, IOError, OSError):
+                pass
+        self.server = None
+
+
+class Sender(threading.Thread):
+    """Background sender of outbox.
+
+    Failed email is retried with exponential backoff, retry_delay * 2^n
+    seconds, until retry attempts.
+    """
+
+    def __init__(self, config):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.config = config
+        self.outbox = Outbox(config.outbox)
+        self.mailer = Mailer(config)
+        self.wakeup = threading.Event()
+        self.idle = threading.Event()
+        self.state = threading.Lock()
+
+    def notify(self):
+        with self.state:
+            self.idle.clear()
+            self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.clear()
+            if profiling and profiling.enabled():
+                stage = profiling.stage('notificate')
+            else:
+                stage = contextlib.nullcontext()
+            with stage:
+                wait = self.sendpending()
+            if wait is None:
+                self.mailer.close()
+            with self.state:
+                if not self.wakeup.is_set():
+                    self.idle.set()
+            self.wakeup.wait(wait)
+
+    def sendpending(self):
+        """Send due emails, return seconds to next retry or None."""
+        wait = None
+        now = time.time()
+        for name in self.outbox.pending():
+            item = self.outbox.read(name)
+            if item is None:
+                continue
+            if item['next_try'] > now:
+                delay = item['next_try'] - now
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            try:
+                self.mailer.send(item['from_addr'], item['to_addrs'],
+                                 item['msg'])
+            except Exception as e:
+                self.mailer.close()
+                item['attempts'] += 1
+                if item['attempts'] >= self.config.retry:
+                    print('Send email %s failed: %s\n' % (name, e))
+                    self.outbox.fail(name)
+                    continue
+                delay = self.config.retry_delay * 2**(item['attempts'] - 1)
+                item['next_try'] = time.time() + delay
+                self.outbox.write(name, item)
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            if item.get('alertdb'):
+                confirm(item['alertdb'], item['keys'])
+            self.outbox.remove(name)
+            sent = str(
+                datetime.datetime.now().replace(second=0, microsecond=0))
+            for to_addr in item['to_addrs']:
+                print('%s: Send email to %s successfully!\n' % (sent, to_addr))
+        return wait
+
+
+def confirm(alertdb, keys):
+    """Confirm alerts of sent email in alert database."""
+    try:
+        state = AlertState(alertdb)
+        try:
+            state.confirm(keys)
+        finally:
+            state.close()
+    except sqlite3.Error as e:
+        print('Confirm alerts in %s failed: %s\n' % (alertdb, e))
+
+
+def pendingalerts(alertdb):
+    """Return fingerprints of alerts waiting in outbox.
+
+    Arg:
+        alertdb:alert database path.
+    """
+    config = readconfig()
+    if not config or not os.path.isdir(config.outbox):
+        return []
+    return Outbox(config.outbox).alertkeys(alertdb)
+
+
+def getsender(config):
+    """Return the running sender, start it if needed."""
+    global _sender
+    with _lock:
+        if _sender is None or not _sender.is_alive():
+            _sender = Sender(config)
+            _sender.start()
+        _sender.config = config
+        _sender.mailer.config = config
+        return _sender
+
+
+def start():
+    """Start sender if outbox has emails left by last run."""
+    config = readconfig()
+    if not config or not os.path.isdir(config.outbox):
+        return
+    if Outbox(config.outbox).pending():
+        getsender(config).notify()
+
+
+def flush(timeout=None):
+    """Wait until outbox is empty or emails are waiting for retry.
+
+    Arg:
+        timeout:seconds to wait, None is wait forever.
+
+    Return:
+        True if sender is idle.
+    """
+    if _sender is None:
+        return True
+    return _sender.idle.wait(timeout)
+
+
 class Notify(object):
-    def notificate(self, subject, message=None, files=None):
+    def notificate(self, subject, message=None, files=None, alertdb=None,
+                   keys=None):
         """notificate.
 
+        Email is stored in outbox and sent by background sender.
+
         Args:
             subject:subject of email.
             message:message of email.
             files:file attacment.
+            alertdb:alert database, keys are confirmed in it when sent.
+            keys:fingerprints of alerts in message.
         """
         # read to_addr  and to_name from notificate.ini
         config = readconfig()
@@ -97,10 +408,6 @@ class Notify(object):
 
         from_addr = config.from_addr
         from_name = config.from_name
-        user = config.email_user
-        password = config.email_password
-        smtp_server = config.email_server
-        smtp_port = config.email_port
         msg = MIMEMultipart()
         msg['From'] = _format_addr('%s <%s>' % (from_name, from_addr))
         msg['To'] = ', '.join([
@@ -108,32 +415,32 @@ class Notify(object):
             for to_addr, to_name in zip(config.addr, config.name)
         ])
         msg['Subject'] = Header(subject, 'utf-8').encode()
-        if message:
-            msg.attach(MIMEText('%s' % message, 'plain', 'utf-8'))
-        if files:
-            for filepath in files:
-                with open(filepath, 'rb') as f:
-                    part = MIMEBase('application', 'octet-stream')
-                    part.add_header(
-                        'Content-Disposition',
-                        'attacment',
-                        filename=os.path.basename(filepath))
-                    part.set_payload(f.read())
-                    encoders.encode_base64(part)
-                    msg.attach(part)
+        workdir = tempfile.mkdtemp()
+        try:
+            if files:
+                files, links = attachment.prepare(
+                    files, config.attachment_budget, workdir)
+                if links:
+                    message = '%s\n\nFiles not attached:\n%s\n' % (
+                        message or '', '\n'.join(links))
+            if message:
+                msg.attach(MIMEText('%s' % message, 'plain', 'utf-8'))
+            if files:
+                for filepath in files:
+                    with open(filepath, 'rb') as f:
+                        part = MIMEBase('application', 'octet-stream')
+                        part.add_header(
+                            'Content-Disposition',
+                            'attacment',
+                            filename=os.path.basename(filepath))
+                        part.set_payload(f.read())
+                        encoders.encode_base64(part)
+                        msg.attach(part)
+            msg = msg.as_string()
+        finally:
+            # prepared attachments are removed, also if message fails
+            shutil.rmtree(workdir, ignore_errors=True)
 
-        while True:
-            try:
-                server = smtplib.SMTP(smtp_server, smtp_port)
-                server.starttls()
-                server.login(user, password)
-                server.sendmail(from_addr, config.addr, msg.as_string())
-                server.quit()
-                now = str(datetime.datetime.now().replace(second=0, microsecond=0))
-                for to_addr in config.addr:
-                    print('%s: Send email to %s successfully!\n' % (now, to_addr))
-            except:
-                raise
-                time.sleep(300)
-            else:
-                break
+        sender = getsender(config)
+        sender.outbox.put(from_addr, config.addr, msg, alertdb, keys)
+        sender.notify()
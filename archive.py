@@ -0,0 +1,244 @@
+# coding:utf-8
+"""Archive input, stream compressed files and members of tar, zip bundles."""
+
+import io
+import os
+import bz2
+import gzip
+import lzma
+import queue
+import tarfile
+import threading
+import zipfile
+
+SEPARATOR = '::'
+BLOCKSIZE = 1024 * 1024
+COMPRESSIONS = {'.gz': gzip.open, '.xz': lzma.open, '.bz2': bz2.open}
+BUNDLES = ['.tar', '.tar.gz', '.tgz', '.tar.xz', '.tar.bz2', '.zip']
+
+_bundle = None  # _SharedTar of the last read tar bundle
+_bundlelock = threading.Lock()
+
+
+def stripsuffix(name):
+    """Return file name without compression suffix."""
+    for suffix in COMPRESSIONS:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def isbundle(name):
+    """Return True if file is tar or zip bundle."""
+    return any(name.endswith(suffix) for suffix in BUNDLES)
+
+
+def members(filepath):
+    """Return member names of tar or zip bundle."""
+    try:
+        if filepath.endswith('.zip'):
+            with zipfile.ZipFile(filepath) as bundle:
+                return [
+                    info.filename for info in bundle.infolist()
+                    if not info.is_dir()
+                ]
+        with tarfile.open(filepath) as bundle:
+            return [info.name for info in bundle if info.isfile()]
+    except (IOError, OSError, tarfile.TarError, zipfile.BadZipfile):
+        print('Read bundle %s failed!' % filepath)
+        return list()
+
+
+def memberpath(filepath, member):
+    """Return path of bundle member used by catalog and openfile."""
+    return SEPARATOR.join([filepath, member])
+
+
+class PrefetchReader(io.RawIOBase):
+    """Read decompressed blocks in background thread.
+
+    Decompression runs in a thread and fills a bounded queue, so it works
+    in parallel with parsing and no temporary file is written.
+    """
+
+    def __init__(self, opener, blocksize=BLOCKSIZE, depth=8):
+        io.RawIOBase.__init__(self)
+        self.blocks = queue.Queue(depth)
+        self.buffer = b''
+        self.error = None
+        self.closing = False
+        self.thread = threading.Thread(
+            target=self._produce, args=(opener, blocksize))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _produce(self, opener, blocksize):
+        try:
+            with opener() as f:
+                while not self.closing:
+                    block = f.read(blocksize)
+                    self.blocks.put(block)
+                    if not block:
+                        break
+        except Exception as e:
+            self.error = e
+            self.blocks.put(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if not self.buffer:
+            self.buffer = self.blocks.get()
+            if not self.buffer:
+                self.blocks.put(b'')
+                if self.error:
+                    raise IOError(self.error)
+                return 0
+        size = min(len(b), len(self.buffer))
+        b[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+    def close(self):
+        self.closing = True
+        # unblock producer waiting for free queue
+        while self.thread.is_alive():
+            try:
+                self.blocks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        io.RawIOBase.close(self)
+
+
+def _opener(filepath):
+    """Return function which opens binary stream of path."""
+    if SEPARATOR in filepath:
+        bundlepath, member = filepath.split(SEPARATOR, 1)
+        if bundlepath.endswith('.zip'):
+
+            def openzip():
+                bundle = zipfile.ZipFile(bundlepath)
+                return _Closing(bundle.open(member), bundle)
+
+            return openzip
+
+        return lambda: _opentar(bundlepath, member)
+    for suffix, opener in COMPRESSIONS.items():
+        if filepath.endswith(suffix):
+            return lambda: opener(filepath, 'rb')
+    return None
+
+
+def _opentar(bundlepath, member):
+    """Open member of tar bundle, the bundle is kept open for next member.
+
+    Member of compressed tar is found by decompressing from the start, so
+    members are read from one open bundle, members read in turn decompress
+    the bundle once instead of once for every member. If the open bundle
+    is read by other stream, a new bundle is opened.
+    """
+    global _bundle
+    mtime = os.path.getmtime(bundlepath)
+    with _bundlelock:
+        if _bundle is None or (_bundle.path, _bundle.mtime) != (bundlepath,
+                                                                mtime):
+            if _bundle is not None:
+                _bundle.retire()
+            _bundle = _SharedTar(bundlepath, mtime)
+        shared = _bundle
+        acquired = shared.acquire()
+    if not acquired:
+        bundle = tarfile.open(bundlepath)
+        return _Closing(bundle.extractfile(member), bundle)
+    try:
+        return _Closing(shared.tar.extractfile(member), shared=shared)
+    except BaseException:
+        shared.release()
+        raise
+
+
+class _SharedTar(object):
+    """Tar bundle kept open for member streams read in turn.
+
+    A retired bundle is replaced by other bundle, it is closed when its
+    reader releases it, or at once if it is not read.
+
+    Attributes:
+        path:bundle path.
+        mtime:modification time of bundle when opened.
+        tar:open bundle, type:tarfile.TarFile.
+        busy:True if a member stream reads the bundle.
+        retired:True if the bundle is replaced.
+    """
+
+    def __init__(self, path, mtime):
+        """Initialize _SharedTar."""
+        self.path = path
+        self.mtime = mtime
+        self.tar = tarfile.open(path)
+        self.busy = False
+        self.retired = False
+
+    def acquire(self):
+        """Acquire bundle for a reader, called with _bundlelock held."""
+        if self.busy:
+            return False
+        self.busy = True
+        return True
+
+    def release(self):
+        with _bundlelock:
+            self.busy = False
+            if self.retired:
+                self.tar.close()
+
+    def retire(self):
+        """Retire bundle, called with _bundlelock held."""
+        self.retired = True
+        if not self.busy:
+            self.tar.close()
+
+
+class _Closing(object):
+    """Close bundle with its member stream, or release shared bundle."""
+
+    def __init__(self, stream, bundle=None, shared=None):
+        self.stream = stream
+        self.bundle = bundle
+        self.shared = shared
+
+    def read(self, size):
+        return self.stream.read(size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.stream.close()
+        if self.bundle is not None:
+            self.bundle.close()
+        if self.shared is not None:
+            self.shared.release()
+
+
+def openfile(filepath):
+    """Open plain, compressed or bundle member file as text stream.
+
+    Arg:
+        filepath:file path, bundle member path is 'bundle::member'.
+
+    Return:
+        stream:text stream, type:file object.
+    """
+    opener = _opener(filepath)
+    if opener is None:
+        return open(filepath)
+    return io.TextIOWrapper(io.BufferedReader(PrefetchReader(opener)))
+
+
+def exists(filepath):
+    """Return True if plain, compressed or bundle member file exists."""
+    if SEPARATOR in filepath:
+        return os.path.isfile(filepath.split(SEPARATOR, 1)[0])
+    return os.path.isfile(filepath)
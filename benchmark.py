@@ -0,0 +1,398 @@
+# coding:utf-8
+"""Benchmark scenarios on synthetic data and performance regression gate.
+
+Coor and Corr files of a day are synthesized, every scenario runs a
+number of times, each time in a forked process without file catalog and
+epoch index caches, so every run reads files and has its own peak RSS.
+Throughput is input rows per second.
+
+Results are compared with a baseline by median of repeats. A metric
+regresses if it is worse than baseline by more than threshold and more
+than noise of repeats, twice the relative median absolute deviation of
+baseline and current run combined.
+"""
+
+import os
+import copy
+import json
+import time
+import platform
+import datetime
+import multiprocessing
+import numpy as np
+import pandas as pd
+from collections import OrderedDict, namedtuple
+import catalog
+import epochindex
+import memory
+import statistic
+import profiles
+
+DATE = datetime.date(2019, 1, 2)
+SYSTEMS = OrderedDict([('BDS', 'C'), ('GPS', 'G')])
+SATELLITES = 14  # satellites of every system
+PRN = ['C01']
+
+Scenario = namedtuple('Scenario', ('name', 'inputs', 'setup', 'run'))
+
+
+class Config(object):
+    """Benchmark configure.
+
+    Attributes:
+        repeat:times every scenario runs.
+        stations:synthetic stations.
+        interval:seconds between synthetic epochs.
+        threshold:throughput drop regarded as regression, type:float.
+        memory_threshold:peak memory growth regarded as regression,
+            type:float.
+        baseline:baseline file path.
+        scenarios:names of scenarios to run, empty is all.
+    """
+
+    def __init__(self):
+        """Initialize Config."""
+        self.repeat = 5
+        self.stations = 6
+        self.interval = 5
+        self.threshold = 0.1
+        self.memory_threshold = 0.1
+        self.baseline = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            'benchmark-baseline.json')
+        self.scenarios = list()
+
+
+def readconfig(fname='benchmark.ini'):
+    """Read benchmark configure file of program directory.
+
+    If configure file not exists, defaults are used.
+    """
+    config = Config()
+    configure_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  fname)
+    if not os.path.isfile(configure_path):
+        return config
+    with open(configure_path) as f:
+        for line in f:
+            if line.startswith(';') or '=' not in line:
+                continue
+            value = line.split('=')[1].strip()
+            if not value:
+                continue
+            if line.startswith('repeat'):
+                config.repeat = max(1, int(value))
+            if line.startswith('stations'):
+                config.stations = max(1, int(value))
+            if line.startswith('interval'):
+                config.interval = max(1, int(value))
+            if line.startswith('threshold'):
+                config.threshold = float(value) / 100
+            if line.startswith('memory_threshold'):
+                config.memory_threshold = float(value) / 100
+            if line.startswith('baseline'):
+                config.baseline = os.path.abspath(os.path.expanduser(value))
+            if line.startswith('scenario'):
+                config.scenarios.append(value)
+    return config
+
+
+def synthesize(path, stations, interval, date=DATE, seed=0):
+    """Write synthetic coor and Corr files of date and autorun profile.
+
+    Stations converge in half an hour and lose 10 minutes of epochs, Corr
+    files have SATELLITES satellites of every system, some not tracked at
+    every epoch, iode changes every hour.
+
+    Args:
+        path:directory of synthetic data.
+        stations:number of stations.
+        interval:seconds between epochs.
+        date:date of files.
+        seed:random seed, same seed writes same files.
+
+    Return:
+        profile:autorun configure file of synthetic data.
+        rows:input rows, type:dict, key:'coor', 'corr' and 'all'.
+    """
+    rng = np.random.RandomState(seed)
+    coordir = os.path.join(path, 'coor')
+    corrdir = os.path.join(path, 'corr')
+    for dirname in [coordir, corrdir]:
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+    day_flag = (date.timetuple().tm_wday + 1) % 7
+    seconds = np.arange(0, 86400, interval)
+    weeksec = seconds + day_flag * 86400
+    rows = {'coor': 0, 'corr': 0}
+    lines = list()
+    for i in range(stations):
+        name = 'bm%02d' % i
+        errors = rng.normal(0, [0.03, 0.01, 0.01], (len(seconds), 3))
+        errors += np.exp(-seconds / 1800.)[:, None] * [1.0, 0.5, 0.5]
+        start = rng.randint(0, 86400 - 600)
+        keep = (seconds < start) | (seconds >= start + 600)
+        data = pd.DataFrame(
+            OrderedDict([('ws', weeksec[keep]), ('U', errors[keep, 0]),
+                         ('N', errors[keep, 1]), ('E', errors[keep, 2]),
+                         ('trop', 2.3)]))
+        data.to_csv(os.path.join(
+            coordir, '%s%03d.%02dcoor' % (name, date.timetuple().tm_yday,
+                                          date.year % 100)),
+                    sep=' ',
+                    index=False,
+                    float_format='%.4f')
+        rows['coor'] += len(data)
+        lines.append('%s %.3f %.3f 20\n' %
+                     (name, 30 + rng.uniform(0, 10), 110 + rng.uniform(0, 10)))
+    with open(os.path.join(path, 'stations.txt'), 'w') as f:
+        f.write(''.join(lines))
+    for gsystem, letter in SYSTEMS.items():
+        prns = ['%s%02d' % (letter, i + 1) for i in range(SATELLITES)]
+        tracked = rng.uniform(size=(len(seconds), SATELLITES)) < 0.85
+        values = rng.normal(0, 0.1, (len(seconds), SATELLITES, 4))
+        lines = list()
+        for j, ws in enumerate(weeksec):
+            index = np.flatnonzero(tracked[j])
+            lines.append('%s %d %d\n' % (gsystem, len(index), ws))
+            iode = seconds[j] // 3600
+            for k in index:
+                lines.append('%s %d %.4f %.4f %.4f %.4f\n' %
+                             ((prns[k], (iode + k) % 256) +
+                              tuple(values[j, k])))
+        with open(os.path.join(
+                corrdir, 'Corr%s%s.txt' % (gsystem, date.strftime('%Y%m%d'))),
+                  'w') as f:
+            f.write(''.join(lines))
+        rows['corr'] += len(lines)
+    rows['all'] = rows['coor'] + rows['corr']
+    profile = os.path.join(path, 'benchmark.ini')
+    with open(profile, 'w') as f:
+        f.write('[path]\nendoutput = %s\nmidoutput = %s\nstationlist = %s\n'
+                'resultpath = %s\n[system]\nsystem = BDS\n[type]\n'
+                'type = DFPPP\n' % (coordir, corrdir,
+                                    os.path.join(path, 'stations.txt'),
+                                    os.path.join(path, 'result')))
+    return profile, rows
+
+
+def _coorparse(run, state):
+    run.reader().readseries(run.endoutput[0], DATE)
+
+
+def _corrparse(run, state):
+    for gsystem in SYSTEMS:
+        run.reader().readcorr(run.midoutput[0], DATE, gsystem)
+
+
+def _readstations(run):
+    store = run.reader().readseries(run.endoutput[0], DATE)
+    return [store.get(name) for name in store.keys()]
+
+
+def _stats(run, state):
+    for data in state:
+        stats = statistic.UNEHStats()
+        stats.update(data)
+        stats.result(86400)
+
+
+def _autorun(run, state):
+    profiles.execute([run])
+
+
+def _module(name):
+    """Return scenario running module of run, e.g. 'enu'."""
+    return lambda run, state: getattr(run, name)()
+
+
+SCENARIOS = [
+    Scenario('coor_parse', 'coor', None, _coorparse),
+    Scenario('corr_parse', 'corr', None, _corrparse),
+    Scenario('stats', 'coor', _readstations, _stats),
+    Scenario('plot_enu', 'coor', None, _module('enu')),
+    Scenario('plot_uh', 'coor', None, _module('uh')),
+    Scenario('plot_heatmap', 'coor', None, _module('heatmap')),
+    Scenario('plot_satnum', 'corr', None, _module('satnum')),
+    Scenario('plot_iode', 'corr', None, _module('satiode')),
+    Scenario('plot_orbitc', 'corr', None, _module('satorbitc')),
+    Scenario('autorun', 'all', None, _autorun),
+]
+
+
+def _measure(scenario, run, state, connection):
+    """Run scenario once in child process, send seconds and peak RSS."""
+    # caches of parent are not used, every run reads files
+    catalog._catalog = catalog.Catalog()
+    epochindex._index = epochindex.EpochIndex()
+    memory.resetpeak()
+    start = time.time()
+    scenario.run(run, state)
+    seconds = time.time() - start
+    # processes started by scenario, e.g. autorun jobs
+    connection.send((seconds, max(memory.peakrss() or 0,
+                                  memory.childrenpeakrss())))
+    connection.close()
+
+
+def execute(run, rows, repeat, names=None):
+    """Run scenarios and return results.
+
+    Args:
+        run:run configured by synthetic profile, type:Dataprocess.
+        rows:input rows of synthetic data, see synthesize.
+        repeat:times every scenario runs.
+        names:names of scenarios to run, None or empty is all.
+
+    Return:
+        result:machine, time and results of scenarios, type:OrderedDict.
+    """
+    result = OrderedDict()
+    result['machine'] = machine()
+    result['created'] = datetime.datetime.now().isoformat()
+    result['repeat'] = repeat
+    result['scenarios'] = OrderedDict()
+    # plot modules are imported once, not in every run
+    run.plotter()
+    for scenario in SCENARIOS:
+        if names and scenario.name not in names:
+            continue
+        state = scenario.setup(run) if scenario.setup else None
+        seconds = list()
+        peaks = list()
+        for i in range(repeat):
+            single = copy.copy(run)
+            single.respath = os.path.join(run.respath,
+                                          '%s-%d' % (scenario.name, i))
+            receiver, sender = multiprocessing.Pipe(False)
+            process = multiprocessing.Process(
+                target=_measure, args=(scenario, single, state, sender))
+            process.start()
+            sender.close()
+            try:
+                second, peak = receiver.recv()
+            except EOFError:
+                process.join()
+                print('Benchmark %s failed!' % scenario.name)
+                break
+            process.join()
+            seconds.append(second)
+            peaks.append(peak / float(memory.MB))
+        if not seconds:
+            continue
+        result['scenarios'][scenario.name] = OrderedDict([
+            ('rows', rows[scenario.inputs]), ('seconds', seconds),
+            ('peak_MB', peaks)
+        ])
+        print('%s: %.2fs, %.0f rows/s, %.1fMB' %
+              (scenario.name, np.median(seconds),
+               rows[scenario.inputs] / np.median(seconds), np.median(peaks)))
+    return result
+
+
+def machine():
+    """Return metadata of machine, results of other machine differ."""
+    meta = OrderedDict()
+    meta['node'] = platform.node()
+    meta['platform'] = platform.platform()
+    meta['processor'] = platform.processor() or platform.machine()
+    meta['cpus'] = os.cpu_count()
+    meta['python'] = platform.python_version()
+    meta['numpy'] = np.__version__
+    meta['pandas'] = pd.__version__
+    try:
+        import matplotlib
+        meta['matplotlib'] = matplotlib.__version__
+    except ImportError:
+        meta['matplotlib'] = None
+    return meta
+
+
+def save(result, filepath):
+    """Save result as json file, replaced atomically."""
+    dirname = os.path.dirname(os.path.abspath(filepath))
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(filepath + '.tmp', 'w') as f:
+        json.dump(result, f, indent=1)
+    os.replace(filepath + '.tmp', filepath)
+
+
+def load(filepath):
+    """Load result json file, if not exists, return None."""
+    if not os.path.isfile(filepath):
+        return None
+    with open(filepath) as f:
+        return json.load(f, object_pairs_hook=OrderedDict)
+
+
+def _spread(values):
+    """Return relative median absolute deviation of values."""
+    values = np.asarray(values, dtype=np.float64)
+    median = np.median(values)
+    if len(values) < 2 or median == 0:
+        return 0.0
+    return 1.4826 * np.median(np.abs(values - median)) / median
+
+
+def _metrics(result):
+    """Return throughput and peak memory samples of scenario result."""
+    return [('throughput', [result['rows'] / s for s in result['seconds']],
+             True), ('peak_MB', result['peak_MB'], False)]
+
+
+def compare(baseline, current, threshold, memory_threshold):
+    """Compare current results with baseline.
+
+    Args:
+        baseline:baseline results, see execute.
+        current:current results, see execute.
+        threshold:throughput drop regarded as regression.
+        memory_threshold:peak memory growth regarded as regression.
+
+    Return:
+        rows:scenario, metric, baseline median, current median, change,
+            tolerance and status, status is ok, regressed, improved, new or
+            missing, type:list.
+        regressed:True if a metric regressed.
+    """
+    rows = list()
+    regressed = False
+    scenarios = baseline['scenarios']
+    for name, result in current['scenarios'].items():
+        for metric, values, higher in _metrics(result):
+            if name not in scenarios:
+                rows.append((name, metric, np.nan, np.median(values), np.nan,
+                             np.nan, 'new'))
+                continue
+            base = dict((key, value) for key, value, _ in _metrics(
+                scenarios[name]))[metric]
+            limit = threshold if higher else memory_threshold
+            tolerance = max(limit, 2 * np.hypot(_spread(base),
+                                                _spread(values)))
+            change = np.median(values) / np.median(base) - 1
+            worse = -change if higher else change
+            if worse > tolerance:
+                status = 'regressed'
+                regressed = True
+            elif -worse > tolerance:
+                status = 'improved'
+            else:
+                status = 'ok'
+            rows.append((name, metric, np.median(base), np.median(values),
+                         change, tolerance, status))
+    for name in scenarios:
+        if name not in current['scenarios']:
+            rows.append((name, '-', np.nan, np.nan, np.nan, np.nan,
+                         'missing'))
+    return rows, regressed
+
+
+def printdiff(rows):
+    """Print diff table of compare."""
+    print('scenario\tmetric\tbaseline\tcurrent\tchange_%\ttolerance_%\t'
+          'status')
+    for name, metric, base, value, change, tolerance, status in rows:
+        print('%s\t%s\t%.1f\t%.1f\t%+.1f\t%.1f\t%s' %
+              (name, metric, base, value, change * 100, tolerance * 100,
+               status))
@@ -0,0 +1,192 @@
+# coding:utf-8
+"""File catalog, index coor and corr files of input directories.
+
+Compressed files (.gz, .xz, .bz2) and members of tar or zip bundles are
+indexed as well, bundle member path is 'bundle::member', open files by
+archive.openfile.
+"""
+
+import os
+import re
+import json
+import datetime
+from collections import defaultdict
+import archive
+
+REFCOOR = re.compile(r'^(\w+)(\d{3})\.(\d{2})coor$')
+REFCORR = re.compile(r'^Corr(BDS|GPS)(\d{4})(\d{2})(\d{2})\.txt$')
+
+_catalog = None
+
+
+class Catalog(object):
+    """File catalog.
+
+    Every input directory and bundle is listed once, and listed again only
+    when its mtime changed. Listings are cached in a json file, so a new run
+    does not list unchanged directories. Files are indexed by
+    (kind, station, system, date) of every directory, if a file is found
+    more than once, e.g. X001.19coor, X001.19coor.gz and bundle member, one
+    is indexed by preference plain file, compressed file, bundle member.
+
+    Attributes:
+        cachepath:json cache file path, None is not cached.
+        listings:directory listings, type:dict, key:directory,
+            value:dict include mtime and names.
+        files:index of files, type:dict, key:(directory, kind, station,
+            system, date), value:file path.
+        bydate:index of files, type:dict, key:(directory, kind, date),
+            value:list of file path.
+        scanned:mtime of indexed directories, type:dict, key:directory.
+    """
+
+    def __init__(self, cachepath=None):
+        """Initialize Catalog."""
+        self.cachepath = cachepath
+        self.listings = dict()
+        self.files = dict()
+        self.bydate = defaultdict(list)
+        self.scanned = dict()
+        if cachepath and os.path.isfile(cachepath):
+            try:
+                with open(cachepath) as f:
+                    self.listings = json.load(f)
+            except ValueError:
+                self.listings = dict()
+
+    def scan(self, root):
+        """Scan directory and index its files.
+
+        Directory is indexed again if its mtime changed since it is indexed,
+        so a long running process finds files arriving later.
+
+        Arg:
+            root:input directory.
+        """
+        root = os.path.abspath(root)
+        try:
+            mtime = os.stat(root).st_mtime
+        except OSError:
+            return
+        if self.scanned.get(root) == mtime:
+            return
+        if root in self.scanned:
+            self.drop(root)
+        self.scanned[root] = mtime
+        listing = self.listings.get(root)
+        if not listing or listing['mtime'] != mtime:
+            listing = {'mtime': mtime, 'names': sorted(os.listdir(root))}
+            self.listings[root] = listing
+        for name in listing['names']:
+            filepath = os.path.join(root, name)
+            if archive.isbundle(name):
+                for member in self.members(filepath):
+                    self.add(root, os.path.basename(member),
+                             archive.memberpath(filepath, member))
+            else:
+                self.add(root, name, filepath)
+
+    def drop(self, root):
+        """Remove index of directory."""
+        for key in [key for key in self.files if key[0] == root]:
+            del self.files[key]
+        for key in [key for key in self.bydate if key[0] == root]:
+            del self.bydate[key]
+
+    def members(self, filepath):
+        """Return member names of bundle, cached by bundle mtime."""
+        try:
+            mtime = os.stat(filepath).st_mtime
+        except OSError:
+            return list()
+        listing = self.listings.get(filepath)
+        if not listing or listing['mtime'] != mtime:
+            listing = {'mtime': mtime, 'names': archive.members(filepath)}
+            self.listings[filepath] = listing
+        return listing['names']
+
+    def add(self, root, name, filepath):
+        """Index file of directory if it is coor or corr file."""
+        key = parse(archive.stripsuffix(name))
+        if key is None:
+            return
+        kind, station, gsystem, date = key
+        key = (root, kind, station, gsystem, date)
+        indexed = self.files.get(key)
+        files = self.bydate[(root, kind, date)]
+        if indexed is None:
+            files.append(filepath)
+        elif preference(filepath) < preference(indexed):
+            files[files.index(indexed)] = filepath
+        else:
+            return
+        self.files[key] = filepath
+
+    def find(self, root, kind, date, station=None, gsystem=None):
+        """Return file path of (kind, station, system, date) in directory.
+
+        If not find, return None.
+        """
+        root = os.path.abspath(root)
+        self.scan(root)
+        return self.files.get((root, kind, station, gsystem, date))
+
+    def coorfiles(self, root, date):
+        """Return coor file paths of date in directory."""
+        root = os.path.abspath(root)
+        self.scan(root)
+        return list(self.bydate.get((root, 'coor', date), list()))
+
+    def corrfile(self, root, gsystem, date):
+        """Return corr file path of system and date, if not find, None."""
+        return self.find(root, 'corr', date, gsystem=gsystem)
+
+    def save(self):
+        """Save directory listings to cache file."""
+        if not self.cachepath:
+            return
+        with open(self.cachepath + '.tmp', 'w') as f:
+            json.dump(self.listings, f)
+        os.replace(self.cachepath + '.tmp', self.cachepath)
+
+
+def preference(filepath):
+    """Return preference of file, lower is preferred.
+
+    Plain file is 0, compressed file is 1 and bundle member is 2.
+    """
+    if archive.SEPARATOR in filepath:
+        return 2
+    return 0 if archive.stripsuffix(filepath) == filepath else 1
+
+
+def parse(name):
+    """Parse file name to (kind, station, system, date).
+
+    If file name is not coor or corr file, return None.
+    """
+    match = REFCOOR.match(name)
+    if match:
+        station, doy, year = match.groups()
+        date = datetime.date(2000 + int(year), 1, 1) + datetime.timedelta(
+            int(doy) - 1)
+        return 'coor', station, None, date
+    match = REFCORR.match(name)
+    if match:
+        gsystem, year, month, day = match.groups()
+        try:
+            date = datetime.date(int(year), int(month), int(day))
+        except ValueError:
+            return None
+        return 'corr', None, gsystem, date
+    return None
+
+
+def getcatalog():
+    """Return catalog shared by the process."""
+    global _catalog
+    if _catalog is None:
+        _catalog = Catalog(
+            os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'catalog.json'))
+    return _catalog
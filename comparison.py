@@ -0,0 +1,137 @@
+# coding:utf-8
+"""Cross system and type comparison of station series."""
+
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+import resultwriter
+
+COLUMNS = [
+    'name', 'epochs_a', 'epochs_b', 'common', 'avail_gain', 'dU_mean',
+    'dN_mean', 'dE_mean', 'dU_rms', 'dN_rms', 'dE_rms', 'H_rms_a', 'H_rms_b',
+    'U_rms_a', 'U_rms_b', 'H_improve', 'U_improve'
+]
+DAY = 86400
+
+
+def sortkeys(store, names):
+    """Return sorted (station, time) keys of series and their row order.
+
+    Args:
+        store:U, N, E series, type:series.SeriesStore.
+        names:station names, index of name is station id, type:list.
+
+    Return:
+        keys:station id * DAY + seconds of day, sorted.
+        order:row index of keys.
+    """
+    index = dict((name, i) for i, name in enumerate(names))
+    lookup = np.array([index[key] for key in store.keys()], dtype=np.int64)
+    ids = lookup[store.index()] if len(lookup) else np.zeros(0, np.int64)
+    keys = ids * DAY + store.arrays().time
+    order = np.argsort(keys, kind='mergesort')
+    return keys[order], order
+
+
+def align(store_a, store_b):
+    """Align epochs of the same station of two series by sorted merge.
+
+    Return:
+        names:station names of both series, type:list.
+        ids:station id of common epochs.
+        index_a:row index of common epochs in store_a.
+        index_b:row index of common epochs in store_b.
+    """
+    names = sorted(set(store_a.keys()) | set(store_b.keys()))
+    keys_a, order_a = sortkeys(store_a, names)
+    keys_b, order_b = sortkeys(store_b, names)
+    pos = np.searchsorted(keys_b, keys_a)
+    pos[pos == len(keys_b)] = 0
+    matched = (keys_b[pos] == keys_a) if len(keys_b) else np.zeros(
+        len(keys_a), dtype=bool)
+    ids = keys_a[matched] // DAY
+    return names, ids, order_a[matched], order_b[pos[matched]]
+
+
+def compare(store_a, store_b):
+    """Compare series of the same station of two systems or types.
+
+    Differences are b - a of common epochs. Availability gain is relative
+    epochs gain of b, improvement is relative rms reduction of b.
+
+    Args:
+        store_a:U, N, E series of a, type:series.SeriesStore.
+        store_b:U, N, E series of b, type:series.SeriesStore.
+
+    Return:
+        summary:per station comparison and network row ALL,
+            type:pandas.DataFrame.
+        epochs:per epoch differences, type:dict, key:names, id, time, dU,
+            dN, dE.
+    """
+    names, ids, index_a, index_b = align(store_a, store_b)
+    a = store_a.arrays()
+    b = store_b.arrays()
+    nstation = len(names)
+    diff = dict()
+    for col in ['U', 'N', 'E']:
+        diff[col] = (getattr(b, col)[index_b].astype(np.float64) -
+                     getattr(a, col)[index_a])
+    h_a = np.hypot(a.N[index_a], a.E[index_a]).astype(np.float64)
+    h_b = np.hypot(b.N[index_b], b.E[index_b]).astype(np.float64)
+    u_a = a.U[index_a].astype(np.float64)
+    u_b = b.U[index_b].astype(np.float64)
+
+    def stationsum(weights):
+        """Return per station and network sums."""
+        sums = np.bincount(ids, weights=weights, minlength=nstation)
+        return np.append(sums, sums.sum())
+
+    epochs_a = _epochs(store_a, names)
+    epochs_b = _epochs(store_b, names)
+    common = np.append(
+        np.bincount(ids, minlength=nstation), len(ids)).astype(np.float64)
+
+    summary = OrderedDict()
+    summary['name'] = names + ['ALL']
+    summary['epochs_a'] = epochs_a
+    summary['epochs_b'] = epochs_b
+    summary['common'] = common.astype(np.int64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        summary['avail_gain'] = (epochs_b - epochs_a) / epochs_a.astype(
+            np.float64)
+        for col in ['U', 'N', 'E']:
+            summary['d%s_mean' % col] = stationsum(diff[col]) / common
+        for col in ['U', 'N', 'E']:
+            summary['d%s_rms' % col] = np.sqrt(
+                stationsum(diff[col]**2) / common)
+        for name, data in [('H_rms_a', h_a), ('H_rms_b', h_b),
+                           ('U_rms_a', u_a), ('U_rms_b', u_b)]:
+            summary[name] = np.sqrt(stationsum(data**2) / common)
+        summary['H_improve'] = 1 - summary['H_rms_b'] / summary['H_rms_a']
+        summary['U_improve'] = 1 - summary['U_rms_b'] / summary['U_rms_a']
+    summary = pd.DataFrame(summary, columns=COLUMNS)
+
+    epochs = {
+        'names': np.array(names, dtype=str),
+        'id': ids.astype(np.int32),
+        'time': a.time[index_a],
+        'dU': diff['U'].astype(np.float32),
+        'dN': diff['N'].astype(np.float32),
+        'dE': diff['E'].astype(np.float32)
+    }
+    return summary, epochs
+
+
+def _epochs(store, names):
+    """Return epochs of stations and network."""
+    index = dict((name, i) for i, name in enumerate(names))
+    epochs = np.zeros(len(names), dtype=np.int64)
+    for key, (start, end) in store.slices.items():
+        epochs[index[key]] = end - start
+    return np.append(epochs, epochs.sum())
+
+
+def saveepochs(epochs, filepath):
+    """Save per epoch differences as compressed npz file."""
+    resultwriter.getwriter().savez(filepath, **epochs)
@@ -0,0 +1,162 @@
+# coding:utf-8
+"""PPP convergence analysis of all stations."""
+
+import numpy as np
+from collections import OrderedDict
+from series import SeriesStore
+
+# horizontal and vertical convergence threshold(m) of calculate type
+THRESHOLD = {
+    'DFPPP': (0.1, 0.2),
+    'SFPPP': (0.5, 1.0),
+    'SFSPP': (2.0, 5.0)
+}
+HOLD = 600  # seconds of errors should stay below threshold
+GAP = 60  # seconds of data gap which start a re-convergence
+COLUMNS = ['H_conv', 'V_conv', 'reconv', 'reconv_time', 'conv_rate']
+
+
+class Collector(object):
+    """Collect ws, H, U series of stations.
+
+    Attributes:
+        store:week seconds, horizontal and vertical errors of stations,
+            type:series.SeriesStore.
+    """
+
+    def __init__(self):
+        """Initialize Collector."""
+        self.store = SeriesStore(columns=('H', 'U'), period=None)
+
+    def update(self, station, data):
+        """Add a chunk of coor data.
+
+        Args:
+            station:station name.
+            data:coor data include ws, U, N, E columns,
+                type:pandas.DataFrame.
+        """
+        ws = np.asarray(data.ws, dtype=np.float64)
+        valid = np.isfinite(ws)
+        n = np.asarray(data.N, dtype=np.float64)[valid]
+        e = np.asarray(data.E, dtype=np.float64)[valid]
+        self.store.append(station, ws[valid].astype(np.int64), {
+            'H': np.sqrt(n**2 + e**2),
+            'U': np.abs(np.asarray(data.U, dtype=np.float64)[valid])
+        })
+
+    def discard(self, station):
+        """Remove series of station, e.g. its coor file read failed."""
+        self.store.discard(station)
+
+    def analyse(self, ctype):
+        """Analyse convergence of all stations.
+
+        Arg:
+            ctype:calculate type.
+
+        Return:
+            result:convergence of stations, type:dict, key:station name,
+                value:OrderedDict, key:COLUMNS.
+        """
+        if not len(self.store):
+            return dict()
+        h_threshold, v_threshold = THRESHOLD[ctype]
+        arrays = self.store.arrays()
+        return analyse(self.store.index(), arrays.time, arrays.H, arrays.U,
+                       self.store.keys(), h_threshold, v_threshold)
+
+
+def analyse(ids, ws, h, u, names, h_threshold, v_threshold, hold=HOLD,
+            gap=GAP):
+    """Analyse convergence of all stations by array operations.
+
+    Series is split into arcs by station and data gap. The convergence
+    time of an arc is time from arc start to the first epoch after which
+    errors stay below threshold for hold seconds. Arcs after the first arc
+    of station are re-convergence events.
+
+    Args:
+        ids:station index of epochs, type:numpy.ndarray.
+        ws:week seconds of epochs, type:numpy.ndarray.
+        h:horizontal errors, type:numpy.ndarray.
+        u:vertical errors, type:numpy.ndarray.
+        names:station names, type:list.
+        h_threshold:horizontal threshold.
+        v_threshold:vertical threshold.
+        hold:seconds of errors should stay below threshold.
+        gap:seconds of data gap which start a re-convergence.
+
+    Return:
+        result:convergence of stations, type:dict, key:station name,
+            value:OrderedDict, key:COLUMNS, time unit is minute.
+    """
+    order = np.lexsort((ws, ids))
+    ids, ws, h, u = ids[order], ws[order], h[order], u[order]
+    num = len(ws)
+    # split arcs
+    arc_start = np.ones(num, dtype=bool)
+    arc_start[1:] = (ids[1:] != ids[:-1]) | (np.diff(ws) > gap)
+    arc_id = np.cumsum(arc_start) - 1
+    arc_first = np.flatnonzero(arc_start)
+    arc_station = ids[arc_first]
+
+    h_conv, h_converged = _converge(ws, h < h_threshold, arc_start, arc_id,
+                                    arc_first, hold)
+    v_conv, v_converged = _converge(ws, u < v_threshold, arc_start, arc_id,
+                                    arc_first, hold)
+    arc_conv = np.fmax(h_conv, v_conv)
+    arc_conv[np.isnan(h_conv) | np.isnan(v_conv)] = np.nan
+
+    # station statistics
+    nstation = len(names)
+    station_first = np.searchsorted(arc_station, np.arange(nstation))
+    has_arc = np.bincount(arc_station, minlength=nstation) > 0
+    station_first = np.minimum(station_first, len(arc_first) - 1)
+    reconv = np.bincount(arc_station, minlength=nstation) - 1
+    later = np.ones(len(arc_first), dtype=bool)
+    later[station_first[has_arc]] = False
+    later &= ~np.isnan(arc_conv)
+    reconv_sum = np.bincount(
+        arc_station[later], weights=arc_conv[later], minlength=nstation)
+    reconv_num = np.bincount(arc_station[later], minlength=nstation)
+    epochs = np.bincount(ids, minlength=nstation)
+    converged = np.bincount(
+        ids, weights=h_converged & v_converged, minlength=nstation)
+
+    result = dict()
+    for i, name in enumerate(names):
+        if not has_arc[i]:
+            continue
+        station = OrderedDict()
+        station['H_conv'] = h_conv[station_first[i]] / 60.0
+        station['V_conv'] = v_conv[station_first[i]] / 60.0
+        station['reconv'] = reconv[i]
+        station['reconv_time'] = (reconv_sum[i] / reconv_num[i] / 60.0
+                                  if reconv_num[i] else np.nan)
+        station['conv_rate'] = converged[i] / float(epochs[i])
+        result[name] = station
+    return result
+
+
+def _converge(ws, ok, arc_start, arc_id, arc_first, hold):
+    """Return convergence seconds of arcs and converged epochs mask."""
+    num = len(ws)
+    run_start = arc_start.copy()
+    run_start[1:] |= ok[1:] != ok[:-1]
+    run_first = np.flatnonzero(run_start)
+    run_last = np.append(run_first[1:], num) - 1
+    run_arc = arc_id[run_first]
+    candidate = ok[run_first] & (ws[run_last] - ws[run_first] >= hold)
+    conv_index = np.full(len(arc_first), num, dtype=np.int64)
+    arcs, first = np.unique(run_arc[candidate], return_index=True)
+    conv_index[arcs] = run_first[candidate][first]
+    conv = np.full(len(arc_first), np.nan)
+    conv[arcs] = ws[conv_index[arcs]] - ws[arc_first[arcs]]
+    converged = ok & (np.arange(num) >= conv_index[arc_id])
+    return conv, converged
+
+
+def empty():
+    """Return convergence of station without valid data."""
+    return OrderedDict((col, 0) for col in COLUMNS)
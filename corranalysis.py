@@ -0,0 +1,159 @@
+# coding:utf-8
+"""Correct file analysis of all satellites, include orbit, clock and iode."""
+
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+
+IODE_COLUMNS = [
+    'prn', 'epochs', 'updates', 'interval_mean', 'interval_max', 'missed',
+    'duplicated', 'stale', 'max_age'
+]
+# expected seconds between iode updates
+CADENCE = {'BDS': 3600, 'GPS': 7200}
+ORBITC_COLUMNS = [
+    'prn', 'epochs', 'R_rms', 'C_rms', 'A_rms', 'orbit_rms', 'clock_rms',
+    'clock_std'
+]
+
+
+def orbitclock(corr):
+    """Calculate orbit and clock errors of all satellites.
+
+    Clock errors are removed per epoch datum which is the mean clock error
+    of all satellites at the epoch, so common clock bias is not counted.
+
+    Arg:
+        corr:correct data, type:readdata.CorrData.
+
+    Return:
+        summary:per PRN and constellation errors, the last row is
+            constellation, type:pandas.DataFrame.
+        orbit:3D orbit errors, PRN x epoch, type:numpy.ndarray.
+        clock:datum removed clock errors, PRN x epoch, type:numpy.ndarray.
+    """
+    orbit = np.sqrt(corr.do_r**2 + corr.do_c**2 + corr.do_a**2)
+    with np.errstate(invalid='ignore'):
+        datum = np.nanmean(corr.clock, axis=0)
+    clock = corr.clock - datum
+
+    summary = OrderedDict()
+    summary['prn'] = corr.prns + [corr.system]
+    summary['epochs'] = np.append(
+        np.sum(~np.isnan(orbit), axis=1), np.sum(~np.isnan(orbit)))
+    for col, data in zip(['R_rms', 'C_rms', 'A_rms', 'orbit_rms', 'clock_rms'],
+                         [corr.do_r, corr.do_c, corr.do_a, orbit, clock]):
+        summary[col] = np.append(_rms(data, axis=1), _rms(data))
+    with np.errstate(invalid='ignore'):
+        summary['clock_std'] = np.append(
+            np.nanstd(clock, axis=1), np.nanstd(clock))
+    summary = pd.DataFrame(summary, columns=ORBITC_COLUMNS)
+    return summary, orbit, clock
+
+
+def _rms(data, axis=None):
+    """Return rms ignoring nan."""
+    with np.errstate(invalid='ignore'):
+        return np.sqrt(np.nanmean(data**2, axis=axis))
+
+
+def iode(corr, cadence=None):
+    """Analyse iode updates of all satellites.
+
+    An update is an iode change between two epochs of the same satellite.
+    Interval longer than 1.5 cadence counts missed updates, update to an
+    iode already used in the day counts duplicated update, ephemeris held
+    longer than cadence counts stale duration.
+
+    Args:
+        corr:correct data, type:readdata.CorrData.
+        cadence:expected seconds between updates, default CADENCE of system.
+
+    Return:
+        summary:per PRN iode statistics, time unit is minute,
+            type:pandas.DataFrame.
+        events:missed, duplicated and stale events, include prn, event,
+            start and end hour, iode, type:pandas.DataFrame.
+    """
+    cadence = cadence or CADENCE[corr.system]
+    nprn = len(corr.prns)
+    prn, epoch = np.nonzero(~np.isnan(corr.iode))
+    value = corr.iode[prn, epoch].astype(np.int64)
+    seconds = corr.hours[epoch] * 3600.0
+    num = len(value)
+
+    same_prn = np.zeros(num, dtype=bool)
+    same_prn[1:] = prn[1:] == prn[:-1]
+    change = np.zeros(num, dtype=bool)
+    change[1:] = same_prn[1:] & (value[1:] != value[:-1])
+    # update to an iode already used by the satellite
+    key = prn * 100000 + value
+    _, first, inverse = np.unique(
+        key, return_index=True, return_inverse=True)
+    duplicated = change & (first[inverse] < np.arange(num))
+    # intervals between updates
+    update = np.flatnonzero(change)
+    interval = np.diff(seconds[update])
+    interval_prn = prn[update[1:]]
+    valid = prn[update[:-1]] == interval_prn
+    interval, interval_prn = interval[valid], interval_prn[valid]
+    interval_start = seconds[update[:-1]][valid]
+    missed = np.where(interval > 1.5 * cadence,
+                      np.round(interval / cadence) - 1, 0)
+    # runs of same iode
+    run_first = np.flatnonzero(~same_prn | change)
+    run_last = np.append(run_first[1:], num) - 1
+    age = seconds[run_last] - seconds[run_first]
+    stale = np.maximum(age - cadence, 0)
+    run_prn = prn[run_first]
+
+    summary = OrderedDict()
+    summary['prn'] = corr.prns
+    summary['epochs'] = np.bincount(prn, minlength=nprn)
+    summary['updates'] = np.bincount(prn[change], minlength=nprn)
+    interval_num = np.bincount(interval_prn, minlength=nprn)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        summary['interval_mean'] = np.bincount(
+            interval_prn, weights=interval,
+            minlength=nprn) / interval_num / 60.0
+    interval_max = np.zeros(nprn)
+    np.maximum.at(interval_max, interval_prn, interval)
+    summary['interval_max'] = interval_max / 60.0
+    summary['missed'] = np.bincount(
+        interval_prn, weights=missed, minlength=nprn).astype(np.int64)
+    summary['duplicated'] = np.bincount(prn[duplicated], minlength=nprn)
+    summary['stale'] = np.bincount(
+        run_prn, weights=stale, minlength=nprn) / 60.0
+    max_age = np.zeros(nprn)
+    np.maximum.at(max_age, run_prn, age)
+    summary['max_age'] = max_age / 60.0
+    summary = pd.DataFrame(summary, columns=IODE_COLUMNS)
+
+    # events
+    names = np.array(corr.prns, dtype=object)
+    stale_run = stale > 0
+    missed_event = missed > 0
+    events = pd.DataFrame(
+        OrderedDict([
+            ('prn', np.concatenate([
+                names[interval_prn[missed_event]], names[prn[duplicated]],
+                names[run_prn[stale_run]]
+            ])),
+            ('event', ['missed'] * int(missed_event.sum()) +
+             ['duplicated'] * int(duplicated.sum()) +
+             ['stale'] * int(stale_run.sum())),
+            ('start', np.concatenate([
+                interval_start[missed_event], seconds[duplicated],
+                seconds[run_first[stale_run]]
+            ]) / 3600.0),
+            ('end', np.concatenate([
+                (interval_start + interval)[missed_event], seconds[duplicated],
+                seconds[run_last[stale_run]]
+            ]) / 3600.0),
+            ('iode', np.concatenate([
+                value[update[1:]][valid][missed_event], value[duplicated],
+                value[run_first[stale_run]]
+            ])),
+        ]))
+    events = events.sort_values(['prn', 'start'])
+    return summary, events
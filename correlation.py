@@ -0,0 +1,114 @@
+# coding:utf-8
+"""Correlation of position errors and satellite number of all stations."""
+
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+import convergence
+
+COLUMNS = [
+    'name', 'epochs', 'H_corr', 'U_corr', 'bad', 'bad_lowsat', 'explained',
+    'lowsat_rate'
+]
+# satellite number below which an epoch is low satellite number epoch
+LOWSAT = {'BDS': 6, 'GPS': 6, 'GBS': 10, 'MIX': 12}
+MAXAGE = 300  # seconds a satellite number epoch is valid
+
+
+def satseries(sat_num, gsystem):
+    """Return satellite number series of system.
+
+    GBS and MIX satellite number is sum of BDS and GPS at the same epoch.
+
+    Args:
+        sat_num:satellite number produced by readdata.Read.readsatnum.
+        gsystem:GNSS system.
+
+    Return:
+        time:seconds of day, sorted.
+        satnum:satellite number, if not find, both are None.
+    """
+    systems = [gsystem] if gsystem in ['BDS', 'GPS'] else ['BDS', 'GPS']
+    if any(system not in sat_num for system in systems):
+        return None, None
+    series = list()
+    for system in systems:
+        hours = np.array(list(sat_num[system].keys()), dtype=np.float64)
+        time = np.round(hours * 3600).astype(np.int64)
+        satnum = np.array(list(sat_num[system].values()), dtype=np.float64)
+        order = np.argsort(time, kind='mergesort')
+        series.append((time[order], satnum[order]))
+    time, satnum = series[0]
+    for other_time, other_satnum in series[1:]:
+        pos = np.searchsorted(other_time, time)
+        pos[pos == len(other_time)] = 0
+        matched = other_time[pos] == time if len(other_time) else np.zeros(
+            len(time), dtype=bool)
+        time = time[matched]
+        satnum = satnum[matched] + other_satnum[pos[matched]]
+    return time, satnum
+
+
+def correlate(store, sat_time, sat_num, ctype, gsystem, maxage=MAXAGE):
+    """Correlate position errors of all stations with satellite number.
+
+    Every coor epoch takes satellite number of the latest correct epoch not
+    later than it, found by one searchsorted over sorted epochs. A bad
+    epoch has horizontal or vertical error over convergence threshold of
+    calculate type.
+
+    Args:
+        store:U, N, E series of stations, type:series.SeriesStore.
+        sat_time:seconds of day of satellite number, sorted.
+        sat_num:satellite number.
+        ctype:calculate type.
+        gsystem:GNSS system.
+        maxage:seconds a satellite number epoch is valid.
+
+    Return:
+        report:per station correlation and network row ALL,
+            type:pandas.DataFrame.
+    """
+    names = store.keys()
+    data = store.arrays()
+    ids = store.index()
+    pos = np.searchsorted(sat_time, data.time, side='right') - 1
+    valid = pos >= 0
+    valid[valid] = data.time[valid] - sat_time[pos[valid]] <= maxage
+    ids = ids[valid]
+    satnum = sat_num[pos[valid]]
+    h = np.hypot(data.N[valid], data.E[valid]).astype(np.float64)
+    u = np.abs(data.U[valid]).astype(np.float64)
+    h_threshold, v_threshold = convergence.THRESHOLD[ctype]
+    bad = (h > h_threshold) | (u > v_threshold)
+    low = satnum < LOWSAT[gsystem]
+
+    nstation = len(names)
+
+    def stationsum(weights=None):
+        """Return per station and network sums."""
+        sums = np.bincount(ids, weights=weights, minlength=nstation)
+        return np.append(sums, sums.sum()).astype(np.float64)
+
+    epochs = stationsum()
+    report = OrderedDict()
+    report['name'] = names + ['ALL']
+    report['epochs'] = epochs.astype(np.int64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for col, error in [('H_corr', h), ('U_corr', u)]:
+            report[col] = _pearson(epochs, stationsum(satnum),
+                                   stationsum(error), stationsum(satnum**2),
+                                   stationsum(error**2),
+                                   stationsum(satnum * error))
+        report['bad'] = stationsum(bad).astype(np.int64)
+        report['bad_lowsat'] = stationsum(bad & low).astype(np.int64)
+        report['explained'] = report['bad_lowsat'] / report['bad'].astype(
+            np.float64)
+        report['lowsat_rate'] = stationsum(low) / epochs
+    return pd.DataFrame(report, columns=COLUMNS)
+
+
+def _pearson(n, sx, sy, sxx, syy, sxy):
+    """Return pearson correlation from sums."""
+    cov = sxy - sx * sy / n
+    return cov / np.sqrt((sxx - sx**2 / n) * (syy - sy**2 / n))
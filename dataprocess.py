@@ -1,7 +1,13 @@
 # coding:utf-8
 """Dataprocess include manual and auto run."""
 
+import sys
 import multiprocessing
+import copy
+import shutil
+import tempfile
+import itertools
+import threading
 import os
 import datetime
 import time
@@ -10,9 +16,26 @@ import numpy as np
 from collections import defaultdict
 import preprocess
 import readdata
-import plotdata
-import sciutilities
-from GNSSWarn import check
+import statistic
+import resultwriter
+import convergence
+import corranalysis
+import comparison
+import correlation
+import queryserver
+import catalog
+import epochindex
+import memory
+import workqueue
+import profiles
+import profiling
+import benchmark
+from series import SeriesStore
+
+# modules executed by workers, modules of system and type are in front
+WORKMODULES = ['report', 'enu', 'uh', 'satnum', 'satiode', 'satorbitc',
+               'orbitcall', 'iodeall', 'compare', 'satcorr', 'heatmap']
+SYSTEMMODULES = ['report', 'enu', 'uh', 'satcorr', 'heatmap']
 
 
 class Dataprocess(object):
@@ -28,6 +51,18 @@ class Dataprocess(object):
         ctype:calculate type, type:list, elemnt type:str.
         duration:duration include start time and end time, type:list,
             element type:datetime.
+        memory:memory budget(bytes) of run, 0 is unlimited.
+        budget:memory budget(bytes) of a process.
+        runid:run id of run summary.
+        summarydir:run summary directory, default respath.
+        queue:work queue database path.
+        lease:seconds of work queue lease.
+        binsize:seconds of heatmap time bin.
+        dataonly:export data of plots instead of plotting.
+        port:port of query server.
+        window:(start, end) seconds of day of evaluation, None is whole day.
+        profile:configure file of run.
+        profiling:profiling mode, None is disabled.
     """
 
     def __init__(self):
@@ -39,15 +74,56 @@ class Dataprocess(object):
         self.ctype = list()
         self.duration = list()
         self.prn = list()
+        self.memory = 0
+        self.budget = 0
+        self.runid = memory.runid()
+        self.summarydir = None
+        self.queue = None
+        self.lease = workqueue.LEASE
+        self.binsize = 3600
+        self.dataonly = False
+        self.port = 8086
+        self.window = None
+        self.profile = None
+        self.profiling = None
 
     def readarg(self, args):
         """Read command arguments."""
-        if len(args) == 1:
-            self.autorun()
+        args = list(args)
+        if '--data-only' in args[1:]:
+            self.dataonly = True
+            args.remove('--data-only')
+        for arg in args[1:]:
+            if arg.split('=')[0] == '--profile':
+                self.profiling = arg.split('=')[1] if '=' in arg \
+                    else 'cprofile'
+                args.remove(arg)
+                break
+        if self.profiling:
+            if self.profiling not in profiling.MODES:
+                print('Profiling mode wrong! Mode is %s' %
+                      ' or '.join(profiling.MODES))
+                return
+            outdir = os.path.join(os.getcwd(), 'profile-' + self.runid)
+            profiling.enable(self.profiling, outdir)
+        regressed = False
+        # the command is a stage of main process
+        if len(args) == 1 or all(arg.endswith('.ini') for arg in args[1:]):
+            with profiling.stage('autorun'):
+                self.autorun(args[1:])
+        elif len(args) == 2 and args[1].upper() in ['--BENCH', '--BENCHSAVE']:
+            # benchmark runs on synthetic data, manual.ini is not read
+            with profiling.stage('bench'):
+                regressed = self.bench(args[1].upper() == '--BENCHSAVE')
         elif len(args) == 2:
-            self.manual(args)
+            with profiling.stage(args[1].lstrip('-').lower()):
+                self.manual(args)
         else:
             print('Arguments wrong! You can use --help to see commands!')
+        if self.profiling:
+            print(profiling.report(outdir))
+        if regressed:
+            sys.exit(1)
 
     def manual(self, args):
         """Manual execute."""
@@ -61,20 +137,41 @@ class Dataprocess(object):
         self.ctype = pre_process.ctype
         self.duration = pre_process.duration
         self.prn = pre_process.prn
+        self.memory = self.budget = pre_process.memory * memory.MB
+        self.queue = pre_process.queue
+        self.lease = pre_process.lease
+        self.binsize = pre_process.binsize * 60
+        self.port = pre_process.port
+        self.window = pre_process.window
+        if self.window:
+            # results of time window are kept apart from whole day results
+            self.respath = os.path.join(
+                self.respath, 'window-' + readdata.windowname(self.window))
+        self.loadcatalog()
         # choose moduel
         if args[1].upper() == '-A':
-            # start process
-            process = list()
-            process.append(multiprocessing.Process(target=self.enu))
-            process.append(multiprocessing.Process(target=self.uh))
-            process.append(multiprocessing.Process(target=self.satnum))
-            process.append(multiprocessing.Process(target=self.satiode))
-            process.append(multiprocessing.Process(target=self.satorbitc))
-            [p.start() for p in process]
-            [p.join() for p in process]
+            # start process, memory budget is shared by processes
+            modules = [
+                self.enu, self.uh, self.heatmap, self.satnum, self.satiode,
+                self.satorbitc, self.orbitcall, self.iodeall, self.compare,
+                self.satcorr
+            ]
+            # every module is a profiling stage of its process
+            process = [
+                multiprocessing.Process(target=profiling.wrap(module))
+                for module in modules
+            ]
+            # processes run at once get the budget of the largest date
+            dates = list(self.getdaterange())
+            need = memory.PROCESSBYTES + max(self.datecosts(dates) or [0])
+            count = memory.slots(self.memory, need, len(process))
+            self.budget = self.memory // count
+            memory.runprocesses(process, count)
+            self.printsummary()
             print('All Done!')
         elif args[1].upper() == '-R':
             self.report()
+            self.printsummary()
             print('Done!')
         elif args[1].upper() == '--ENU':
             self.enu()
@@ -84,6 +181,16 @@ class Dataprocess(object):
             print('Done!')
         elif args[1].upper() == '--HVM':
             self.uhmean()
+            self.printsummary()
+            print('Done!')
+        elif args[1].upper() == '--HVW':
+            self.uhperiod(list(self.getperiods('week')))
+            print('Done!')
+        elif args[1].upper() == '--HVMON':
+            self.uhperiod(list(self.getperiods('month')))
+            print('Done!')
+        elif args[1].upper() == '--HVY':
+            self.uhperiod(list(self.getperiods('year')))
             print('Done!')
         elif args[1].upper() == '--SAT':
             self.satnum()
@@ -94,6 +201,31 @@ class Dataprocess(object):
         elif args[1].upper() == '--ORBITC':
             self.satorbitc()
             print('Done!')
+        elif args[1].upper() == '--IODEALL':
+            self.iodeall()
+            print('Done!')
+        elif args[1].upper() == '--ORBITCALL':
+            self.orbitcall()
+            print('Done!')
+        elif args[1].upper() == '--COMPARE':
+            self.compare()
+            print('Done!')
+        elif args[1].upper() == '--HEATMAP':
+            self.heatmap()
+            print('Done!')
+        elif args[1].upper() == '--SATCORR':
+            self.satcorr()
+            print('Done!')
+        elif args[1].upper() == '--SERVE':
+            self.serve()
+        elif args[1].upper() == '--SERVEBENCH':
+            self.servebench()
+        elif args[1].upper() == '--QUEUE':
+            self.enqueue()
+        elif args[1].upper() == '--WORKER':
+            self.worker()
+            self.printsummary()
+            print('Done!')
         elif args[1].upper() == '--HELP' or args[1]:
             print('Arg:')
             print('\t-a -A:execute all module.')
@@ -101,141 +233,668 @@ class Dataprocess(object):
             print('\t--ENU:plot ENU')
             print('\t--HV:plot horizontal and vertical errors')
             print('\t--HVM:plor mean of horizontal and vertical errors')
+            print('\t--HVW:plot weekly horizontal and vertical errors')
+            print('\t--HVMON:plot monthly horizontal and vertical errors')
+            print('\t--HVY:plot yearly horizontal and vertical errors')
             print('\t--SAT:plot satellite number')
             print('\t--IODE:plot satellite iode')
+            print('\t--IODEALL:analyse iode updates of all satellites')
             print('\t--ORBITC:plot orbit and clock errors')
+            print('\t--ORBITCALL:evaluate orbit and clock errors of all satellites')
+            print('\t--COMPARE:compare stations across systems and types')
+            print('\t--HEATMAP:plot station x hour errors heatmap')
+            print('\t--SATCORR:correlate position errors and satellite number')
+            print('\t--SERVE:start local query server of results')
+            print('\t--SERVEBENCH:benchmark query server under parallel load')
+            print('\t--QUEUE:enqueue tasks of duration into work queue')
+            print('\t--WORKER:execute tasks of work queue')
+            print('\t--BENCH:benchmark on synthetic data, exit 1 if slower')
+            print('\t        or larger than baseline')
+            print('\t--BENCHSAVE:benchmark on synthetic data as baseline')
+            print('\tprofile.ini ...:autorun profiles, inputs are shared')
+            print('\t--data-only:export data of plots instead of plotting,')
+            print('\t            e.g. --ENU --data-only')
+            print('\t--profile[=sample]:profile stages of run and processes,')
+            print('\t            e.g. -A --profile, sample writes stacks of')
+            print('\t            flame graph')
 
-    def autorun(self):
-        """Auto run."""
-        # read autorun configure file
-        pre_process = preprocess.Preprocess()
-        pre_process.readconfig('autorun.ini')
-        self.endoutput = pre_process.endoutput
-        self.midoutput = pre_process.midoutput
-        self.respath = pre_process.respath
-        self.gsystem = pre_process.gsystem
-        self.ctype = pre_process.ctype
+    def autorun(self, configs=None):
+        """Auto run profiles in one process.
+
+        Inputs shared by profiles are evaluated once and results are
+        published to every profile, see profiles.execute.
+
+        Arg:
+            configs:autorun configure files of profiles, default
+                autorun.ini.
+        """
         yesterday = datetime.datetime.now().date() + datetime.timedelta(-1)
-        self.duration = [yesterday, yesterday]
-        # start process
-        process = list()
-        process.append(multiprocessing.Process(target=self.enu))
-        process.append(multiprocessing.Process(target=self.uh))
-        process.append(multiprocessing.Process(target=self.satnum))
-        [p.start() for p in process]
-        [p.join() for p in process]
+        runs = [
+            self.loadprofile(config, yesterday)
+            for config in configs or ['autorun.ini']
+        ]
+        # catalog and epoch index are shared by profiles
+        for run in runs:
+            run.loadcatalog()
+        series, metrics = profiles.execute(runs)
+        for run in runs:
+            print('%s: %s' % (run.profile, run.respath))
+            run.printsummary()
+        if len(runs) > 1:
+            profiles.printmetrics(metrics)
         # check evaluation quality
-        check.check()
+        from GNSSWarn import check
+        artifacts = [
+            filepath for run in runs
+            for filepath in resultwriter.artifacts(run.respath, run.runid)
+        ]
+        with profiling.stage('check'):
+            check.check(series, artifacts)
         now = datetime.datetime.now().replace(second=0, microsecond=0)
         print('%s: The process of %s Done!' % (str(now), str(yesterday)))
+        # wait background notification, unsent emails stay in outbox
+        check.flush(600)
+
+    def loadprofile(self, profile, date):
+        """Return run configured by autorun configure file.
+
+        Args:
+            profile:autorun configure file, absolute, relative to working
+                directory or name in program directory.
+            date:evaluate date.
+        """
+        pre_process = preprocess.Preprocess()
+        pre_process.readconfig(profile)
+        run = copy.copy(self)
+        run.profile = profile
+        run.endoutput = pre_process.endoutput
+        run.midoutput = pre_process.midoutput
+        run.respath = pre_process.respath
+        run.gsystem = pre_process.gsystem
+        run.ctype = pre_process.ctype
+        run.duration = [date, date]
+        run.memory = pre_process.memory * memory.MB
+        run.budget = run.memory // 3
+        run.binsize = pre_process.binsize * 60
+        return run
+
+    def plotter(self):
+        """Return plotdata.Plot, or export.DataPlot in data only mode.
+
+        Modules are imported here, so data only mode never imports
+        matplotlib and Basemap.
+        """
+        chunksize = memory.chunkrows(self.budget, readdata.CHUNKSIZE)
+        if self.dataonly:
+            import export
+            return export.DataPlot(chunksize, memory.valuerows(self.budget))
+        import plotdata
+        return plotdata.Plot(chunksize, memory.valuerows(self.budget))
+
+    def reader(self):
+        """Return readdata.Read whose chunks and values fit in budget."""
+        return readdata.Read(
+            memory.chunkrows(self.budget, readdata.CHUNKSIZE),
+            memory.valuerows(self.budget))
+
+    def loadcatalog(self):
+        """Scan input directories once before processes start."""
+        file_catalog = catalog.getcatalog()
+        for filepath in self.endoutput + self.midoutput:
+            file_catalog.scan(filepath)
+        file_catalog.save()
 
     def report(self):
         """Report zdpos errors."""
-        read_coor = readdata.Read()
-        for date in self.getdaterange():
+        read_coor = self.reader()
+        for date in self.trackdates('report'):
             for filepath, gsystem, ctype in zip(self.endoutput, self.gsystem,
                                                 self.ctype):
-                report = read_coor.readcoor(filepath, date)
+                stats = dict()
+                report = read_coor.readcoor(
+                    filepath, date, stats=stats, ctype=ctype,
+                    window=self.window)
+                if report is None:
+                    continue
 
                 # save report
                 report_fname = '-'.join(
                     [ctype, gsystem, str(date), 'report.csv'])
                 report_path = os.path.join(self.respath, str(date), '-'.join([ctype, gsystem]))
-                if not os.path.exists(report_path):
-                    os.makedirs(report_path)
-                report.to_csv(
-                    os.path.join(report_path, report_fname),
-                    sep='\t',
-                    na_rep=' ',
-                    index=False,
-                    float_format='%.2f')
+                statistic.savereport(report,
+                                     os.path.join(report_path, report_fname))
+                conv = report.set_index('name')[convergence.COLUMNS]
+                statistic.savesketch(
+                    stats,
+                    os.path.join(report_path,
+                                 statistic.sketchname(ctype, gsystem, date)),
+                    conv.to_dict('index'))
 
     def enu(self):
         """Plot ENU."""
-        enu_plot = plotdata.Plot()
-        for date in self.getdaterange():
+        enu_plot = self.plotter()
+        for date in self.trackdates('enu'):
+            for filepath, gsystem, ctype in zip(self.endoutput, self.gsystem,
+                                                self.ctype):
+                enu_plot.plotENU(filepath, date, gsystem, ctype, self.respath,
+                                 window=self.window)
+
+    def enuuh(self, keep=None):
+        """Plot ENU and UH Errors from one parse of coor files.
+
+        Arg:
+            keep:dates whose series are returned, None is all dates.
+
+        Return:
+            series:U, N, E series of stations, type:dict, key:date,
+                value:dict, key:(system, type), value:SeriesStore, key:station
+                name.
+        """
+        enu_plot = self.plotter()
+        series = defaultdict(dict)
+        for date in self.trackdates('enuuh'):
+            for filepath, gsystem, ctype in zip(self.endoutput, self.gsystem,
+                                                self.ctype):
+                stations = SeriesStore()
+                report = enu_plot.plotENU(filepath, date, gsystem, ctype,
+                                          self.respath, stations, self.window)
+                if report is None:
+                    continue
+                enu_plot.plotheatmap(stations, date, gsystem, ctype,
+                                     self.respath, self.binsize)
+                if keep is None or date in keep:
+                    stations.compact()
+                    series[date][(gsystem, ctype)] = stations
+                enu_plot.plotUH(report, date, gsystem, ctype, self.respath)
+        return series
+
+    def heatmap(self):
+        """Plot station x time bin errors heatmap of all stations."""
+        read_coor = self.reader()
+        heatmap_plot = self.plotter()
+        for date in self.trackdates('heatmap'):
             for filepath, gsystem, ctype in zip(self.endoutput, self.gsystem,
                                                 self.ctype):
-                enu_plot.plotENU(filepath, date, gsystem, ctype, self.respath)
+                store = read_coor.readseries(
+                    filepath, date, window=self.window)
+                if store is not None:
+                    heatmap_plot.plotheatmap(store, date, gsystem, ctype,
+                                             self.respath, self.binsize)
 
     def uh(self):
         """Plot UH Errors."""
-        read_coor = readdata.Read()
-        uh_plot = plotdata.Plot()
-        for date in self.getdaterange():
+        read_coor = self.reader()
+        uh_plot = self.plotter()
+        for date in self.trackdates('uh'):
             for filepath, gsystem, ctype in zip(self.endoutput, self.gsystem,
                                                 self.ctype):
-                report = read_coor.readcoor(filepath, date)
+                report = read_coor.readcoor(
+                    filepath, date, window=self.window)
                 if report is not None:
                     uh_plot.plotUH(report, date, gsystem, ctype, self.respath)
 
     def uhmean(self):
-        """Report mean."""
-        read_coor = readdata.Read()
-        station_U = defaultdict(list)
-        station_H = defaultdict(list)
+        """Report 95% errors of duration."""
+        self.uhperiod([(self.duration[0], self.duration[1])])
+
+    def uhperiod(self, periods):
+        """Report 95% errors of periods by merging daily sketches.
+
+        Daily sketches saved with reports are merged, coor files are only
+        read for the date whose sketch not exists.
+
+        Arg:
+            periods:periods include start date and end date, type:list,
+                element type:tuple.
+        """
+        read_coor = self.reader()
+        uh_plot = self.plotter()
+        tracker = memory.Tracker('uhperiod', self.budget)
         for filepath, gsystem, ctype in zip(self.endoutput, self.gsystem,
                                             self.ctype):
-            for date in self.getdaterange():
-                report = read_coor.readcoor(filepath, date)
-                if report is None:
+            for start, end in periods:
+                tracker.start()
+                dates = [
+                    start + datetime.timedelta(i)
+                    for i in range((end - start).days + 1)
+                ]
+                merged = dict()
+                for date in dates:
+                    sketch_path = os.path.join(
+                        self.respath, str(date), '-'.join([ctype, gsystem]),
+                        statistic.sketchname(ctype, gsystem, date))
+                    stats = statistic.loadsketch(sketch_path)
+                    if stats is None:
+                        stats = dict()
+                        if read_coor.readcoor(
+                                filepath, date, exact=False, stats=stats,
+                                window=self.window) is None:
+                            continue
+                    for name in stats:
+                        if name in merged:
+                            merged[name].merge(stats[name])
+                        else:
+                            merged[name] = stats[name]
+                if not merged:
+                    tracker.stop(dates)
                     continue
-                for index in report.index.tolist():
-                    name = report.at[index, 'name']
-                    station_U[name].append(report.at[index, 'U_95'])
-                    station_H[name].append(report.at[index, 'H_95'])
-
-            # remove outlier and mean
-            for name in station_U:
-                station_u = np.array(station_U[name])
-                station_h = np.array(station_H[name])
-                station_U[name] = np.mean(station_u[~sciutilities.is_outlier(
-                    station_u)])
-                station_H[name] = np.mean(station_h[~sciutilities.is_outlier(
-                    station_h)])
-            # convert station_U, station_H to dataframe
-            report_m = pd.DataFrame(
-                index=range(len(station_U)), columns=['name', 'U_95', 'H_95'])
-            report_m.name = station_U.keys()
-            report_m.U_95 = station_U.values()
-            report_m.H_95 = station_H.values()
-            # start plot
-            uh_plot = plotdata.Plot()
-            date = '--'.join([str(self.duration[0]), str(self.duration[1])])
-            uh_plot.plotUH(report, date, gsystem, ctype, self.respath)
+                days = len(dates)
+                report = defaultdict(list)
+                for name in sorted(merged):
+                    report['name'].append(name)
+                    result = merged[name].result(
+                        readdata.windowlength(self.window) * days)
+                    for col in result:
+                        report[col].append(result[col])
+                report = pd.DataFrame(
+                    report, columns=['name'] + statistic.COLUMNS)
+                # save report and plot
+                date = '--'.join([str(start), str(end)])
+                report_path = os.path.join(self.respath, date, '-'.join(
+                    [ctype, gsystem]))
+                statistic.savereport(
+                    report,
+                    os.path.join(report_path, '-'.join(
+                        [ctype, gsystem, date, 'report.csv'])))
+                uh_plot.plotUH(report, date, gsystem, ctype, self.respath)
+                tracker.stop(dates)
+        tracker.save(self.summarypath(), self.runid)
+        epochindex.getindex().save()
+        self.flushresults()
 
     def satnum(self):
         """Plot satellite number."""
-        read_satnum = readdata.Read()
-        plot_satnum = plotdata.Plot()
-        for date in self.getdaterange():
+        read_satnum = self.reader()
+        plot_satnum = self.plotter()
+        for date in self.trackdates('satnum'):
             for filepath in self.midoutput:
-                sat_num = read_satnum.readsatnum(filepath, date)
+                sat_num = read_satnum.readsatnum(filepath, date, self.window)
                 if sat_num is not None:
                     plot_satnum.plotsatnum(sat_num, date, self.respath)
 
     def satiode(self):
         """Plot satellite iode."""
-        read_iode = readdata.Read()
-        plot_iode = plotdata.Plot()
-        for date in self.getdaterange():
+        read_iode = self.reader()
+        plot_iode = self.plotter()
+        for date in self.trackdates('satiode'):
             for filepath in self.midoutput:
                 for prn in self.prn:
-                    sat_iode = read_iode.readsatiode(filepath, date, prn)
+                    sat_iode = read_iode.readsatiode(filepath, date, prn,
+                                                     self.window)
                     if sat_iode is not None:
                         plot_iode.plotsatiode(sat_iode, prn, date, self.respath)
 
     def satorbitc(self):
         """Plot satellite orbit and clock errors."""
-        read_orbitc = readdata.Read()
-        plot_orbitc = plotdata.Plot()
-        for date in self.getdaterange():
+        read_orbitc = self.reader()
+        plot_orbitc = self.plotter()
+        for date in self.trackdates('satorbitc'):
             for filepath in self.midoutput:
                 for prn in self.prn:
-                    sat_orbitc = read_orbitc.readorbitc(filepath, date, prn)
+                    sat_orbitc = read_orbitc.readorbitc(filepath, date, prn,
+                                                        self.window)
                     if sat_orbitc is not None:
                         plot_orbitc.plotorbitc(sat_orbitc, prn, date, self.respath)
 
+    def orbitcall(self):
+        """Evaluate orbit and clock errors of all satellites."""
+        read_corr = self.reader()
+        plot_orbitc = self.plotter()
+        for date in self.trackdates('orbitcall'):
+            for filepath in self.midoutput:
+                for gsystem in ['BDS', 'GPS']:
+                    corr = read_corr.readcorr(filepath, date, gsystem,
+                                              self.window)
+                    if corr is None:
+                        continue
+                    summary, orbit, clock = corranalysis.orbitclock(corr)
+                    # save summary
+                    report_path = os.path.join(self.respath, str(date),
+                                               'Correct')
+                    resultwriter.getwriter().tocsv(
+                        summary,
+                        os.path.join(report_path, '-'.join(
+                            [gsystem, str(date), 'orbit-clock.csv'])),
+                        sep='\t',
+                        na_rep=' ',
+                        index=False,
+                        float_format='%.4f')
+                    plot_orbitc.plotorbitcmatrix(corr, orbit, clock, date,
+                                                 self.respath)
+
+    def iodeall(self):
+        """Analyse iode updates of all satellites."""
+        read_corr = self.reader()
+        for date in self.trackdates('iodeall'):
+            for filepath in self.midoutput:
+                for gsystem in ['BDS', 'GPS']:
+                    corr = read_corr.readcorr(filepath, date, gsystem,
+                                              self.window)
+                    if corr is None:
+                        continue
+                    summary, events = corranalysis.iode(corr)
+                    # save iode table and events
+                    report_path = os.path.join(self.respath, str(date),
+                                               'Correct')
+                    for table, name in zip([summary, events],
+                                           ['iode.csv', 'iode-events.csv']):
+                        resultwriter.getwriter().tocsv(
+                            table,
+                            os.path.join(report_path, '-'.join(
+                                [gsystem, str(date), name])),
+                            sep='\t',
+                            na_rep=' ',
+                            index=False,
+                            float_format='%.2f')
+
+    def compare(self):
+        """Compare series of the same station across systems and types.
+
+        Every two configured (system, type) are compared, per station and
+        network comparison is saved as csv, per epoch differences as npz.
+        """
+        read_coor = self.reader()
+        for date in self.trackdates('compare'):
+            stores = list()
+            for filepath, gsystem, ctype in zip(self.endoutput, self.gsystem,
+                                                self.ctype):
+                store = read_coor.readseries(
+                    filepath, date, window=self.window)
+                if store is not None:
+                    stores.append(('-'.join([ctype, gsystem]), store))
+            report_path = os.path.join(self.respath, str(date), 'Compare')
+            for (name_a, store_a), (name_b, store_b) in itertools.combinations(
+                    stores, 2):
+                summary, epochs = comparison.compare(store_a, store_b)
+                fname = '-'.join(['--'.join([name_a, name_b]), str(date)])
+                resultwriter.getwriter().tocsv(
+                    summary,
+                    os.path.join(report_path, fname + '-compare.csv'),
+                    sep='\t',
+                    na_rep=' ',
+                    index=False,
+                    float_format='%.4f')
+                comparison.saveepochs(
+                    epochs, os.path.join(report_path, fname + '-epochs.npz'))
+
+    def satcorr(self):
+        """Correlate position errors and satellite number of stations."""
+        read_data = self.reader()
+        for date in self.trackdates('satcorr'):
+            sat_num = dict()
+            for filepath in self.midoutput:
+                for gsystem, data in read_data.readsatnum(
+                        filepath, date, self.window).items():
+                    sat_num.setdefault(gsystem, data)
+            for filepath, gsystem, ctype in zip(self.endoutput, self.gsystem,
+                                                self.ctype):
+                sat_time, sat_count = correlation.satseries(sat_num, gsystem)
+                if sat_time is None:
+                    print('Not find %s satellite number of %s' %
+                          (gsystem, str(date)))
+                    continue
+                store = read_data.readseries(
+                    filepath, date, window=self.window)
+                if store is None:
+                    continue
+                report = correlation.correlate(store, sat_time, sat_count,
+                                               ctype, gsystem)
+                report_path = os.path.join(self.respath, str(date),
+                                           '-'.join([ctype, gsystem]))
+                resultwriter.getwriter().tocsv(
+                    report,
+                    os.path.join(report_path, '-'.join(
+                        [ctype, gsystem, str(date), 'satcorr.csv'])),
+                    sep='\t',
+                    na_rep=' ',
+                    index=False,
+                    float_format='%.4f')
+
+    def serve(self):
+        """Start local read-only query server of results."""
+        query = queryserver.Query(self.respath, self.endoutput, self.gsystem,
+                                  self.ctype, self.window)
+        server = queryserver.makeserver(query, port=self.port)
+        print('Query server on http://127.0.0.1:%d' % server.server_port)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+
+    def servebench(self, threads=8, requests=400):
+        """Benchmark query server by parallel queries of duration.
+
+        Queries are made from stations of the first report of duration, the
+        benchmark runs without and with response cache.
+        """
+        query = queryserver.Query(self.respath, self.endoutput, self.gsystem,
+                                  self.ctype, self.window)
+        paths = list()
+        for date in self.getdaterange():
+            for gsystem, ctype in zip(self.gsystem, self.ctype):
+                report = query.report(gsystem, ctype, date)
+                if report is None:
+                    continue
+                valid = report[report.effective_rate > 0]
+                for station in valid.index[:10]:
+                    base = 'station=%s&system=%s&type=%s' % (station, gsystem,
+                                                             ctype)
+                    paths.append('/metrics?%s&start=%s&end=%s' %
+                                 (base, self.duration[0], self.duration[1]))
+                    paths.append('/summary?%s&start=%s&end=%s' %
+                                 (base, self.duration[0], self.duration[1]))
+                    paths.append('/outages?%s&date=%s' % (base, date))
+                    paths.append('/series?%s&date=%s&start=0&end=3600' %
+                                  (base, date))
+        if not paths:
+            print('Not find report of duration in %s' % self.respath)
+            return
+        server = queryserver.makeserver(query, port=0)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        baseurl = 'http://127.0.0.1:%d' % server.server_port
+        for name, cachesize in [('uncached', 0),
+                                ('cached', queryserver.CACHESIZE)]:
+            server.responses = queryserver.LRUCache(cachesize,
+                                                    queryserver.TTL)
+            result = queryserver.benchmark(baseurl, paths, threads, requests)
+            print('%s: %s' % (name, ', '.join(
+                '%s=%.1f' % (key, value) for key, value in result.items())))
+        server.shutdown()
+        server.server_close()
+
+    def openqueue(self):
+        """Open work queue, if not configured, return None."""
+        if not self.queue:
+            print('Work queue is not configured in manual.ini!')
+            return None
+        return workqueue.WorkQueue(self.queue, self.lease)
+
+    def bench(self, save=False):
+        """Run benchmark scenarios and compare with baseline.
+
+        Configure is read from benchmark.ini, results are saved in
+        benchmark-<runid>.json of working directory. If throughput or peak
+        memory of a scenario regresses, diff table is printed and True is
+        returned, the command exits with status 1. Synthetic stations are
+        stored in station database of work directory.
+
+        Arg:
+            save:save results as baseline instead of comparing.
+
+        Return:
+            regressed:True if performance regressed.
+        """
+        config = benchmark.readconfig()
+        workdir = tempfile.mkdtemp(prefix='benchmark-')
+        stationdb = preprocess.STATIONDB
+        preprocess.STATIONDB = os.path.join(workdir, 'station.sqlite')
+        try:
+            profile, rows = benchmark.synthesize(workdir, config.stations,
+                                                 config.interval)
+            run = self.loadprofile(profile, benchmark.DATE)
+            run.prn = benchmark.PRN
+            result = benchmark.execute(run, rows, config.repeat,
+                                       config.scenarios)
+        finally:
+            preprocess.STATIONDB = stationdb
+            shutil.rmtree(workdir, ignore_errors=True)
+        benchmark.save(result,
+                       os.path.join(os.getcwd(),
+                                    'benchmark-%s.json' % self.runid))
+        if save:
+            benchmark.save(result, config.baseline)
+            print('Save baseline in %s' % config.baseline)
+            return False
+        baseline = benchmark.load(config.baseline)
+        if baseline is None:
+            print('Not find baseline in %s, save it by --BENCHSAVE' %
+                  config.baseline)
+            return False
+        if baseline['machine'] != result['machine']:
+            print('Baseline is of other machine, results may differ:')
+            for key, value in baseline['machine'].items():
+                if result['machine'].get(key) != value:
+                    print('\t%s: %s -> %s' %
+                          (key, value, result['machine'].get(key)))
+        diff, regressed = benchmark.compare(baseline, result,
+                                            config.threshold,
+                                            config.memory_threshold)
+        benchmark.printdiff(diff)
+        if regressed:
+            print('Performance regressed!')
+        return regressed
+
+    def enqueue(self):
+        """Enqueue tasks of duration, every module, date, system, type."""
+        queue = self.openqueue()
+        if queue is None:
+            return
+        tasks = list()
+        for date in self.getdaterange():
+            for module in WORKMODULES:
+                if module in SYSTEMMODULES:
+                    tasks.extend((module, date, gsystem, ctype)
+                                 for gsystem, ctype in zip(
+                                     self.gsystem, self.ctype))
+                else:
+                    tasks.append((module, date, None, None))
+        num = queue.enqueue(tasks)
+        print('Enqueue %d tasks, queue status: %s' % (num, queue.status()))
+        queue.close()
+
+    def worker(self):
+        """Execute tasks of work queue until all tasks are done."""
+        queue = self.openqueue()
+        if queue is None:
+            return
+        done = workqueue.work(queue, self.runtask, self.respath)
+        print('%s done %d tasks, queue status: %s' %
+              (workqueue.workerid(), done, queue.status()))
+        queue.close()
+
+    def runtask(self, task, staging):
+        """Execute task of work queue.
+
+        Args:
+            task:task, type:workqueue.Task.
+            staging:result path of task.
+        """
+        if task.module not in WORKMODULES:
+            raise ValueError('Unknown module %s' % task.module)
+        process = copy.copy(self)
+        date = workqueue.parsedate(task.date)
+        process.duration = [date, date]
+        process.respath = staging
+        process.summarydir = self.respath
+        if task.module in SYSTEMMODULES:
+            pairs = [(filepath, gsystem, ctype)
+                     for filepath, gsystem, ctype in zip(
+                         self.endoutput, self.gsystem, self.ctype)
+                     if gsystem == task.system and ctype == task.type]
+            if not pairs:
+                raise ValueError('%s-%s is not configured' %
+                                 (task.system, task.type))
+            process.endoutput, process.gsystem, process.ctype = map(
+                list, zip(*pairs))
+        with profiling.stage(task.module):
+            getattr(process, task.module)()
+
+    def getperiods(self, period):
+        """Get weekly, monthly or yearly periods of duration.
+
+        Arg:
+            period:'week', 'month' or 'year'.
+        """
+        start = self.duration[0]
+        while start <= self.duration[1]:
+            if period == 'week':
+                end = start + datetime.timedelta(6 - start.weekday())
+            elif period == 'month':
+                end = (start.replace(day=28) + datetime.timedelta(4))
+                end = end - datetime.timedelta(end.day)
+            else:
+                end = start.replace(month=12, day=31)
+            end = min(end, self.duration[1])
+            yield start, end
+            start = end + datetime.timedelta(1)
+
+    def trackdates(self, module):
+        """Get dates by chunks fit in memory budget and track peak RSS.
+
+        Dates are split by estimated memory of their coor files, peak RSS
+        of every chunk is saved in run summary. Buffered results are
+        written after every chunk, and when dates are not all consumed,
+        e.g. module fails.
+
+        Arg:
+            module:module name.
+        """
+        dates = list(self.getdaterange())
+        tracker = memory.Tracker(module, self.budget)
+        try:
+            for chunk in memory.chunkdates(dates, self.datecosts(dates),
+                                           self.budget):
+                tracker.start()
+                for date in chunk:
+                    yield date
+                tracker.stop(chunk)
+                self.flushresults()
+        finally:
+            tracker.save(self.summarypath(), self.runid)
+            epochindex.getindex().save()
+            self.flushresults()
+
+    def datecosts(self, dates):
+        """Return estimated memory of coor files of dates in bytes."""
+        file_catalog = catalog.getcatalog()
+        return [
+            memory.cost([
+                path for filepath in self.endoutput
+                for path in file_catalog.coorfiles(filepath, date)
+            ]) for date in dates
+        ]
+
+    def flushresults(self):
+        """Write buffered results and list artifacts of run in manifest."""
+        resultwriter.getwriter().flush(self.respath, self.runid,
+                                       self.summarydir)
+
+    def summarypath(self):
+        """Return run summary file path."""
+        return os.path.join(self.summarydir or self.respath,
+                            'run-summary.csv')
+
+    def printsummary(self):
+        """Print peak RSS of chunks of this run."""
+        lines = memory.summary(self.summarypath(), self.runid)
+        if not lines:
+            return
+        print('module\tstart\tend\tdays\tpeak_MB\tbudget_MB\tseconds')
+        for line in lines:
+            print(line.split('\t', 1)[1])
+
     def getdaterange(self):
         """Get date range."""
         for i in range((self.duration[1] - self.duration[0]).days + 1):
@@ -0,0 +1,283 @@
+# coding:utf-8
+"""Epoch index of coor and corr files, read only rows of a time window.
+
+An index holds a marker every STEP rows, a marker is (week seconds, byte
+offset, row) of an epoch line. Coor epoch lines are data rows, corr epoch
+lines are system header lines. A time window is read from the last marker
+before its start to the first marker after its end, plain files are read
+by seek, compressed files and bundle members skip rows without parsing.
+Rows of the window are streamed, they are not read into memory at once.
+
+Indexes are built by one scan of the file and cached in a json file by
+path, size and mtime.
+"""
+
+import io
+import os
+import math
+import bisect
+import json
+import itertools
+import archive
+
+STEP = 2048  # rows between markers
+
+_index = None
+
+
+class EpochIndex(object):
+    """Epoch index of files.
+
+    Attributes:
+        cachepath:json cache file path, None is not cached.
+        entries:indexes of files, type:dict, key:file path, value:dict
+            include size, mtime, sorted, header and markers.
+        changed:entries are changed after load, type:bool.
+    """
+
+    def __init__(self, cachepath=None):
+        """Initialize EpochIndex."""
+        self.cachepath = cachepath
+        self.entries = _load(cachepath)
+        self.changed = False
+
+    def lookup(self, filepath, gsystem=None):
+        """Return index of file, build it if not cached or file changed.
+
+        Args:
+            filepath:coor or corr file path.
+            gsystem:system of corr file, None is coor file.
+        """
+        stamp = _stamp(filepath)
+        entry = self.entries.get(filepath)
+        # entries without epoch column are built by older versions
+        if entry and [entry['size'], entry['mtime']] == stamp and \
+                'column' in entry:
+            return entry
+        entry = build(filepath, gsystem)
+        entry['size'], entry['mtime'] = stamp
+        self.entries[filepath] = entry
+        self.changed = True
+        return entry
+
+    def locate(self, filepath, start, end, gsystem=None):
+        """Return rows range covering epochs in [start, end).
+
+        Return:
+            first:(offset, row) of the first row to read.
+            last:(offset, row) of the first row not to read, None is end of
+                file, if index is not sorted, whole file is returned.
+        """
+        entry = self.lookup(filepath, gsystem)
+        markers = entry['markers']
+        first = (entry['header'], 1 if entry['header'] else 0)
+        if not entry['sorted']:
+            return first, None
+        epochs = [marker[0] for marker in markers]
+        i = bisect.bisect_left(epochs, start)
+        if i > 0:
+            first = tuple(markers[i - 1][1:])
+        j = bisect.bisect_left(epochs, end)
+        last = tuple(markers[j][1:]) if j < len(markers) else None
+        return first, last
+
+    def open(self, filepath, start, end, gsystem=None):
+        """Open text stream of rows covering epochs in [start, end).
+
+        Header line of coor file is kept, so the stream is parsed like the
+        whole file. Rows out of window at both ends are in the stream, they
+        should be filtered by reader.
+
+        Args:
+            filepath:coor or corr file path.
+            start:week seconds of window start.
+            end:week seconds of window end.
+            gsystem:system of corr file, None is coor file.
+
+        Return:
+            stream:text stream, type:io.TextIOWrapper.
+        """
+        (offset, row), last = self.locate(filepath, start, end, gsystem)
+        plain = seekable(filepath)
+        f = open(filepath, 'rb') if plain else archive.openfile(filepath)
+        try:
+            if plain:
+                header = f.readline() if gsystem is None else b''
+                f.seek(max(offset, f.tell()))
+                blocks = itertools.chain([header], _blocks(
+                    f, None if last is None else max(last[0] - f.tell(), 0)))
+            else:
+                header = f.readline() if gsystem is None else ''
+                read = 1 if gsystem is None else 0
+                lines = itertools.islice(
+                    f, max(row - read, 0),
+                    None if last is None else max(last[1] - read, 0))
+                blocks = (line.encode()
+                          for line in itertools.chain([header], lines))
+        except BaseException:
+            f.close()
+            raise
+        return io.TextIOWrapper(
+            io.BufferedReader(_Stream(blocks, f)), encoding='utf-8')
+
+    def save(self):
+        """Save indexes to cache file, indexes of other processes are kept."""
+        if not self.cachepath or not self.changed:
+            return
+        entries = _load(self.cachepath)
+        entries.update(self.entries)
+        with open(self.cachepath + '.%d.tmp' % os.getpid(), 'w') as f:
+            json.dump(entries, f)
+        os.replace(self.cachepath + '.%d.tmp' % os.getpid(), self.cachepath)
+        self.changed = False
+
+
+def build(filepath, gsystem=None, step=STEP):
+    """Build epoch index of file by one scan.
+
+    Args:
+        filepath:coor or corr file path.
+        gsystem:system of corr file, None is coor file.
+        step:rows between markers.
+
+    Epoch of coor row is the field of ws column named by header line, if
+    header has no ws column, index is not sorted and whole file is read.
+
+    Return:
+        entry:index, type:dict, include sorted, header, column and markers.
+    """
+    markers = list()
+    header = 0
+    column = 2 if gsystem else None
+    is_sorted = True
+    last = None
+    marker_row = -step
+    offset = 0
+    if seekable(filepath):
+        stream = open(filepath, 'rb')
+        prefix = gsystem.encode() if gsystem else None
+    else:
+        stream = archive.openfile(filepath)
+        prefix = gsystem
+    with stream as f:
+        for row, line in enumerate(f):
+            if row == 0 and gsystem is None:
+                names = line.split()
+                wsname = b'ws' if isinstance(line, bytes) else 'ws'
+                header = len(line)
+                offset += len(line)
+                if wsname not in names:
+                    is_sorted = False
+                    break
+                column = names.index(wsname)
+                continue
+            epoch = _epoch(line, prefix, column)
+            if epoch is not None:
+                if last is not None and epoch < last:
+                    is_sorted = False
+                last = epoch
+                if row - marker_row >= step:
+                    markers.append([epoch, offset, row])
+                    marker_row = row
+            offset += len(line)
+    return {
+        'sorted': is_sorted,
+        'header': header,
+        'column': column,
+        'markers': markers
+    }
+
+
+def seekable(filepath):
+    """Return True if file is plain file, byte offsets can be seeked."""
+    return archive.SEPARATOR not in filepath and archive.stripsuffix(
+        filepath) == filepath
+
+
+def getindex():
+    """Return epoch index shared by the process."""
+    global _index
+    if _index is None:
+        _index = EpochIndex(
+            os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'epochindex.json'))
+    return _index
+
+
+class _Stream(io.RawIOBase):
+    """Raw stream of byte blocks, source file is closed with stream."""
+
+    def __init__(self, blocks, source):
+        io.RawIOBase.__init__(self)
+        self.blocks = blocks
+        self.source = source
+        self.buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.buffer:
+            block = next(self.blocks, None)
+            if block is None:
+                return 0
+            self.buffer = block
+        size = min(len(b), len(self.buffer))
+        b[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.source.close()
+        io.RawIOBase.close(self)
+
+
+def _blocks(f, size, blocksize=archive.BLOCKSIZE):
+    """Yield blocks of binary file, at most size bytes, None is to end."""
+    while size is None or size > 0:
+        block = f.read(blocksize if size is None else min(blocksize, size))
+        if not block:
+            return
+        if size is not None:
+            size -= len(block)
+        yield block
+
+
+def _epoch(line, prefix, column):
+    """Return week seconds of epoch line, if not epoch line, None.
+
+    Args:
+        line:coor row or corr line.
+        prefix:system of corr header line, None is coor row.
+        column:field index of week seconds.
+    """
+    if prefix is not None and not line.startswith(prefix):
+        return None
+    field = line.split()[column:column + 1]
+    if not field:
+        return None
+    try:
+        epoch = float(field[0])
+    except ValueError:
+        return None
+    return epoch if math.isfinite(epoch) else None
+
+
+def _stamp(filepath):
+    """Return [size, mtime] of file, bundle member uses bundle."""
+    try:
+        status = os.stat(filepath.split(archive.SEPARATOR, 1)[0])
+    except OSError:
+        return [None, None]
+    return [status.st_size, status.st_mtime]
+
+
+def _load(cachepath):
+    if not cachepath or not os.path.isfile(cachepath):
+        return dict()
+    try:
+        with open(cachepath) as f:
+            return json.load(f)
+    except ValueError:
+        return dict()
@@ -0,0 +1,334 @@
+# coding:utf-8
+"""Data only export, write data of plots in binary files and json index.
+
+Every dataset of a date is saved in <respath>/<date>/data/<name>.bin and
+described in index.json of the same directory. A series dataset holds
+rows of (id, time, columns), decimated into zoom levels and split into
+time chunks, every chunk stores its columns one after another. A table
+dataset holds one chunk of report columns. Numbers are little-endian, id
+is index of keys of dataset.
+
+Matplotlib and Basemap are not imported, so exporting is much faster than
+plotting.
+"""
+
+import os
+import json
+import sqlite3
+import numpy as np
+from collections import OrderedDict
+import preprocess
+import readdata
+import statistic
+import resultwriter
+import convergence
+from series import SeriesStore
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# zoom levels, (seconds of time bin, seconds of time chunk), bin 0 is
+# original epochs
+ZOOM = [(0, 3600), (30, 21600), (300, 86400), (3600, 86400)]
+
+
+def decimate(ids, time, columns, binsize):
+    """Decimate series by mean of time bins.
+
+    Args:
+        ids:id of rows.
+        time:seconds of day of rows.
+        columns:values of rows, type:OrderedDict.
+        binsize:seconds of time bin, 0 is not decimated.
+
+    Return:
+        ids, time, columns of decimated rows, time is start of bin.
+    """
+    if not binsize:
+        return ids, time, columns
+    nbin = int(np.ceil(86400.0 / binsize))
+    cell = ids.astype(np.int64) * nbin + np.minimum(time // binsize,
+                                                    nbin - 1)
+    cells, inverse, counts = np.unique(
+        cell, return_inverse=True, return_counts=True)
+    decimated = OrderedDict()
+    for name, values in columns.items():
+        values = values.astype(np.float64)
+        valid = np.isfinite(values)
+        sums = np.bincount(
+            inverse[valid], weights=values[valid], minlength=len(cells))
+        num = np.bincount(inverse[valid], minlength=len(cells))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            decimated[name] = sums / num
+    return ((cells // nbin).astype(np.int32),
+            ((cells % nbin) * binsize).astype(np.int32), decimated)
+
+
+class Exporter(object):
+    """Write datasets of a date and update index.
+
+    Attributes:
+        path:data directory of date.
+    """
+
+    def __init__(self, respath, date):
+        """Initialize Exporter."""
+        self.path = os.path.join(respath, str(date), 'data')
+        resultwriter.getwriter().makedirs(self.path)
+
+    def addseries(self, name, keys, ids, time, columns, kind='series'):
+        """Add series dataset.
+
+        Args:
+            name:dataset name.
+            keys:names of ids, e.g. station names or PRNs, type:list.
+            ids:id of rows.
+            time:seconds of day of rows.
+            columns:values of rows, type:OrderedDict, key:column.
+            kind:dataset kind.
+        """
+        ids = np.asarray(ids, dtype=np.int32)
+        time = np.asarray(time, dtype=np.int32)
+        meta = OrderedDict()
+        meta['kind'] = kind
+        meta['keys'] = [str(key) for key in keys]
+        meta['columns'] = [['id', '<i4'], ['time', '<i4']] + [
+            [col, '<f4'] for col in columns
+        ]
+        meta['levels'] = list()
+        with open(self._temp(name), 'wb') as f:
+            for binsize, span in ZOOM:
+                level_ids, level_time, level_columns = decimate(
+                    ids, time, columns, binsize)
+                order = np.lexsort((level_ids, level_time))
+                level_ids = level_ids[order]
+                level_time = level_time[order]
+                level_columns = [
+                    values[order].astype('<f4')
+                    for values in level_columns.values()
+                ]
+                bounds = np.searchsorted(level_time,
+                                         np.arange(0, 86400 + span, span))
+                chunks = list()
+                for i in range(len(bounds) - 1):
+                    start, end = bounds[i], bounds[i + 1]
+                    if start == end:
+                        continue
+                    chunks.append({
+                        'start': i * span,
+                        'end': (i + 1) * span,
+                        'offset': f.tell(),
+                        'rows': int(end - start)
+                    })
+                    f.write(level_ids[start:end].astype('<i4').tobytes())
+                    f.write(level_time[start:end].astype('<i4').tobytes())
+                    for values in level_columns:
+                        f.write(values[start:end].tobytes())
+                meta['levels'].append({'binsize': binsize, 'chunks': chunks})
+        self._commit(name, meta)
+
+    def addtable(self, name, table, kind='table'):
+        """Add table dataset, text columns are saved in index.
+
+        Args:
+            name:dataset name.
+            table:report, type:pandas.DataFrame.
+            kind:dataset kind.
+        """
+        meta = OrderedDict()
+        meta['kind'] = kind
+        meta['rows'] = len(table)
+        meta['text'] = OrderedDict()
+        meta['columns'] = list()
+        with open(self._temp(name), 'wb') as f:
+            for col in table.columns:
+                if table[col].dtype == object:
+                    meta['text'][col] = [str(value) for value in table[col]]
+                    continue
+                meta['columns'].append([col, '<f8'])
+                f.write(
+                    np.asarray(table[col], dtype=np.float64).astype(
+                        '<f8').tobytes())
+        meta['levels'] = [{
+            'binsize': 0,
+            'chunks': [{
+                'offset': 0,
+                'rows': len(table)
+            }]
+        }]
+        self._commit(name, meta)
+
+    def _temp(self, name):
+        return os.path.join(self.path, name + '.bin.tmp')
+
+    def _commit(self, name, meta):
+        """Move dataset in place and add it to index."""
+        meta['file'] = name + '.bin'
+        writer = resultwriter.getwriter()
+        os.replace(self._temp(name), os.path.join(self.path, meta['file']))
+        writer.record(os.path.join(self.path, meta['file']))
+        indexpath = os.path.join(self.path, 'index.json')
+        # datasets of parallel modules are added to the same index
+        with open(indexpath + '.lock', 'w') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            index = OrderedDict()
+            if os.path.isfile(indexpath):
+                with open(indexpath) as f:
+                    index = json.load(f, object_pairs_hook=OrderedDict)
+            index[name] = meta
+            with open(indexpath + '.tmp', 'w') as f:
+                json.dump(index, f)
+            os.replace(indexpath + '.tmp', indexpath)
+        writer.record(indexpath)
+
+
+def readdataset(path, name, level=0):
+    """Read dataset of data directory.
+
+    Args:
+        path:data directory of date.
+        name:dataset name.
+        level:zoom level.
+
+    Return:
+        data:columns, type:OrderedDict, key:column.
+    """
+    with open(os.path.join(path, 'index.json')) as f:
+        meta = json.load(f)[name]
+    columns = OrderedDict((col, list()) for col, _ in meta['columns'])
+    with open(os.path.join(path, meta['file']), 'rb') as f:
+        content = f.read()
+    for chunk in meta['levels'][level]['chunks']:
+        offset = chunk['offset']
+        for col, dtype in meta['columns']:
+            size = np.dtype(dtype).itemsize * chunk['rows']
+            columns[col].append(
+                np.frombuffer(
+                    content, dtype=dtype, count=chunk['rows'],
+                    offset=offset))
+            offset += size
+    return OrderedDict(
+        (col, np.concatenate(values) if values else np.zeros(0))
+        for col, values in columns.items())
+
+
+def hourseries(series):
+    """Return seconds of day and values of hour keyed series."""
+    hours = np.array(list(series.keys()), dtype=np.float64)
+    return (np.round(hours * 3600).astype(np.int32),
+            np.array(list(series.values()), dtype=np.float64))
+
+
+class DataPlot(object):
+    """Data only Plot, methods of plotdata.Plot export data of plots.
+
+    Attributes:
+        chunksize:rows of each read chunk of coor file.
+        maxrows:rows of stored values of exact statistics, 0 is unlimited.
+    """
+
+    def __init__(self, chunksize=readdata.CHUNKSIZE, maxrows=0):
+        """Initialize DataPlot."""
+        self.chunksize = chunksize
+        self.maxrows = maxrows
+
+    def plotENU(self, coorpath, date, gsystem, ctype, respath, series=None,
+                window=None):
+        """Export U, N, E series and save report as plotENU.
+
+        Return:
+            report:UNEH report, type:pandas.DataFrame, if not find coor
+                file, return None.
+        """
+        store = SeriesStore() if series is None else series
+        stats = dict()
+        report = readdata.Read(self.chunksize, self.maxrows).readcoor(
+            coorpath, date, stats=stats, ctype=ctype, series=store,
+            window=window)
+        if report is None:
+            return None
+        report_path = os.path.join(respath, str(date), '-'.join(
+            [ctype, gsystem]))
+        statistic.savereport(
+            report,
+            os.path.join(report_path, '-'.join(
+                [ctype, gsystem, str(date), 'report.csv'])))
+        conv = report.set_index('name')[convergence.COLUMNS]
+        statistic.savesketch(
+            stats,
+            os.path.join(report_path,
+                         statistic.sketchname(ctype, gsystem, date)),
+            conv.to_dict('index'))
+        data = store.arrays()
+        Exporter(respath, date).addseries(
+            '-'.join([ctype, gsystem, 'ENU']), store.keys(), store.index(),
+            data.time,
+            OrderedDict((col, getattr(data, col)) for col in store.columns))
+        return report
+
+    def plotUH(self, report, date, gsystem, ctype, filepath):
+        """Export report with station B, L as plotUH."""
+        connect = sqlite3.connect(preprocess.STATIONDB)
+        cur = connect.cursor()
+        latitude = list()
+        longtitude = list()
+        for name in report.name:
+            cur.execute('SELECT B, L FROM Station WHERE name=?',
+                        (name.lower(), ))
+            row = cur.fetchone()
+            latitude.append(row[0] if row else np.nan)
+            longtitude.append(row[1] if row else np.nan)
+        cur.close()
+        connect.close()
+        table = report.copy()
+        table['B'] = latitude
+        table['L'] = longtitude
+        Exporter(filepath, date).addtable(
+            '-'.join([ctype, gsystem, 'HV']), table, kind='report')
+
+    def plotheatmap(self, store, date, gsystem, ctype, respath, binsize=3600):
+        """Export station x time bin rms as plotheatmap."""
+        names, counts, grid = statistic.gridrms(store, binsize)
+        if not names:
+            return
+        ids, bins = np.nonzero(counts)
+        Exporter(respath, date).addseries(
+            '-'.join([ctype, gsystem, 'heatmap']), names, ids, bins * binsize,
+            OrderedDict((comp, grid[comp][ids, bins]) for comp in grid),
+            kind='heatmap')
+
+    def plotsatnum(self, satnum, date, filepath):
+        """Export satellite number as plotsatnum."""
+        for gsystem in satnum:
+            time, nums = hourseries(satnum[gsystem])
+            Exporter(filepath, date).addseries(
+                '-'.join([gsystem, 'satnum']), [gsystem],
+                np.zeros(len(time)), time, OrderedDict([('satnum', nums)]))
+
+    def plotsatiode(self, satiode, prn, date, filepath):
+        """Export satellite iode as plotsatiode."""
+        time, iodes = hourseries(satiode)
+        Exporter(filepath, date).addseries(
+            '-'.join([prn, 'satiode']), [prn], np.zeros(len(time)), time,
+            OrderedDict([('iode', iodes)]))
+
+    def plotorbitc(self, orbitc, prn, date, filepath):
+        """Export orbit and clock errors as plotorbitc."""
+        time = np.round(orbitc.hour.values * 3600)
+        Exporter(filepath, date).addseries(
+            '-'.join([prn, 'orbit-clock']), [prn], np.zeros(len(time)), time,
+            OrderedDict((col, orbitc[col].values)
+                        for col in ['do_r', 'do_c', 'do_a', 'clock']))
+
+    def plotorbitcmatrix(self, corr, orbit, clock, date, filepath):
+        """Export orbit and clock errors of all satellites."""
+        prn, epoch = np.nonzero(np.isfinite(orbit) | np.isfinite(clock))
+        time = np.round(corr.hours[epoch] * 3600)
+        Exporter(filepath, date).addseries(
+            '-'.join([corr.system, 'orbit-clock-all']), corr.prns, prn, time,
+            OrderedDict([('orbit', orbit[prn, epoch]),
+                         ('clock', clock[prn, epoch])]))
+
@@ -0,0 +1,315 @@
+# coding:utf-8
+"""Memory budget, split date range into chunks and track peak RSS."""
+
+import os
+import time
+import datetime
+import threading
+import multiprocessing.connection
+import archive
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Windows
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+MB = 1024 * 1024
+ROWBYTES = 120  # bytes of a coor file line
+ROWCOST = 400  # bytes of a parsed row include DataFrame, stats and series
+COMPRESSION_RATIO = 5  # size ratio of decompressed and compressed file
+VALUEBYTES = 32  # bytes of U, N, E, H values of a row in exact statistics
+PROCESSBYTES = 100 * MB  # resident memory of a process before reading
+
+
+def rss():
+    """Return resident set size of current process in bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, AttributeError):
+        pass
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    return peakrss() or 0
+
+
+def peakrss():
+    """Return peak resident set size of current process in bytes.
+
+    If it is not supported, return None.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+    if resource is not None:
+        # ru_maxrss is kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        # peak working set on Windows
+        return getattr(info, 'peak_wset', info.rss)
+    return None
+
+
+def childrenpeakrss():
+    """Return peak RSS of the largest waited child process in bytes.
+
+    If it is not supported, return 0.
+    """
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+
+
+def resetpeak():
+    """Reset peak RSS of current process, return False if not supported."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def filesize(filepath):
+    """Return estimated decompressed size of input file in bytes."""
+    path = filepath.split(archive.SEPARATOR, 1)[0]
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return 0
+    if archive.SEPARATOR in filepath:
+        # member size of bundle is unknown before decompression
+        return size * COMPRESSION_RATIO
+    if archive.stripsuffix(path) != path:
+        return size * COMPRESSION_RATIO
+    return size
+
+
+def cost(filepaths):
+    """Return estimated memory of parsing files in bytes."""
+    return sum(filesize(path) for path in filepaths) // ROWBYTES * ROWCOST
+
+
+def chunkrows(budget, chunksize):
+    """Return rows of read chunk fit in budget.
+
+    Args:
+        budget:memory budget in bytes, 0 is unlimited.
+        chunksize:default rows of read chunk.
+    """
+    if not budget:
+        return chunksize
+    return int(max(1000, min(chunksize, budget // 4 // ROWCOST)))
+
+
+def valuerows(budget):
+    """Return rows of exact statistics values fit in budget, 0 is unlimited.
+
+    Statistics of more rows fall back to sketch mode.
+    """
+    if not budget:
+        return 0
+    return int(max(1000, budget // 4 // VALUEBYTES))
+
+
+def slots(budget, need, workers):
+    """Return number of processes run at once fit in budget.
+
+    Args:
+        budget:memory budget in bytes, 0 is unlimited.
+        need:memory of a process in bytes.
+        workers:number of processes.
+    """
+    if not budget:
+        return workers
+    return int(max(1, min(workers, budget // max(need, 1))))
+
+
+class Slots(object):
+    """Start processes, at most count processes run at once.
+
+    Attributes:
+        pending:processes not started, type:list.
+        running:started processes may be alive, type:list.
+        count:number of processes run at once.
+    """
+
+    def __init__(self, processes, count):
+        """Initialize Slots."""
+        self.pending = list(processes)
+        self.running = list()
+        self.count = count
+
+    def start(self):
+        """Start pending processes in free slots without waiting."""
+        self.running = [p for p in self.running if p.is_alive()]
+        while self.pending and len(self.running) < self.count:
+            process = self.pending.pop(0)
+            process.start()
+            self.running.append(process)
+
+    def join(self):
+        """Run pending processes and wait all processes."""
+        self.start()
+        while self.pending:
+            multiprocessing.connection.wait(
+                [p.sentinel for p in self.running])
+            self.start()
+        for process in self.running:
+            process.join()
+        self.running = list()
+
+
+def runprocesses(processes, count):
+    """Run processes and wait them, at most count processes run at once.
+
+    Args:
+        processes:processes not started, type:list, element
+            type:multiprocessing.Process.
+        count:number of processes run at once.
+    """
+    Slots(processes, count).join()
+
+
+def chunkdates(dates, costs, budget):
+    """Split dates into chunks whose estimated memory fit in budget.
+
+    A date whose cost is larger than budget is a chunk alone.
+
+    Args:
+        dates:dates, type:list.
+        costs:estimated memory of dates in bytes, type:list.
+        budget:memory budget in bytes, 0 is unlimited.
+
+    Return:
+        chunks:date chunks, type:list, element type:list.
+    """
+    if not budget:
+        return [list(dates)] if dates else list()
+    chunks = list()
+    chunk = list()
+    used = 0
+    for date, date_cost in zip(dates, costs):
+        if chunk and used + date_cost > budget:
+            chunks.append(chunk)
+            chunk = list()
+            used = 0
+        chunk.append(date)
+        used += date_cost
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+class Tracker(object):
+    """Track peak RSS of chunks and save them in run summary.
+
+    Peak RSS is sampled by a background thread, and on Linux also read
+    from VmHWM which is reset at chunk start.
+
+    Attributes:
+        module:module name, e.g. enu, report.
+        budget:memory budget in bytes, 0 is unlimited.
+        interval:sampling interval seconds.
+        records:chunk records, type:list, element type:tuple.
+    """
+
+    def __init__(self, module, budget=0, interval=0.05):
+        """Initialize Tracker."""
+        self.module = module
+        self.budget = budget
+        self.interval = interval
+        self.records = list()
+        self._peak = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._peak = max(self._peak, rss())
+
+    def start(self):
+        """Start tracking a chunk."""
+        self._hwm = resetpeak()
+        self._peak = rss()
+        self._start = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, dates):
+        """Stop tracking chunk and record its peak RSS.
+
+        Arg:
+            dates:dates of chunk, type:list.
+
+        Return:
+            peak:peak RSS of chunk in bytes.
+        """
+        self._stop.set()
+        self._thread.join()
+        peak = max(self._peak, rss())
+        if self._hwm:
+            peak = max(peak, peakrss() or 0)
+        self.records.append((self.module, str(dates[0]), str(dates[-1]),
+                             len(dates), peak, self.budget,
+                             time.time() - self._start))
+        if self.budget and peak > self.budget:
+            print('%s %s--%s peak RSS %.0fMB exceeds budget %.0fMB' %
+                  (self.module, dates[0], dates[-1], peak / float(MB),
+                   self.budget / float(MB)))
+        return peak
+
+    def save(self, filepath, runid):
+        """Append chunk records to run summary file.
+
+        Args:
+            filepath:run summary file path.
+            runid:run id, records of one run share it.
+        """
+        if not self.records:
+            return
+        lines = [
+            '%s\t%s\t%s\t%s\t%d\t%.1f\t%.1f\t%.1f\n' %
+            (runid, module, start, end, days, peak / float(MB),
+             budget / float(MB), seconds)
+            for module, start, end, days, peak, budget, seconds in self.records
+        ]
+        appendsummary(filepath, lines)
+        self.records = list()
+
+
+def appendsummary(filepath, lines):
+    """Append record lines to run summary file, header is written once."""
+    if not lines:
+        return
+    dirname = os.path.dirname(filepath)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname)
+    header = not os.path.isfile(filepath)
+    # one write in append mode, lines of parallel processes do not mix
+    with open(filepath, 'a') as f:
+        f.write(('run\tmodule\tstart\tend\tdays\tpeak_MB\tbudget_MB\t'
+                 'seconds\n' if header else '') + ''.join(lines))
+
+
+def summary(filepath, runid):
+    """Return run summary lines of run id."""
+    if not os.path.isfile(filepath):
+        return list()
+    with open(filepath) as f:
+        return [line.rstrip('\n') for line in f if line.startswith(runid)]
+
+
+def runid():
+    """Return run id made from current time."""
+    return datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')
@@ -2,8 +2,8 @@
 """Plot include ENU plot, HVError plot, Satellite plot, Orbit plot."""
 
 import os
+import math
 import sqlite3
-import glob
 import re
 import pandas as pd
 import numpy as np
@@ -17,12 +17,29 @@ from mpl_toolkits.basemap import Basemap
 from mpl_toolkits.axes_grid1 import ImageGrid
 import itertools
 from collections import defaultdict
+import preprocess
+import readdata
+import catalog
+import statistic
+import convergence
+import resultwriter
 
 
 class Plot(object):
-    """Plot."""
+    """Plot.
 
-    def plotENU(self, coorpath, date, gsystem, ctype, respath):
+    Attributes:
+        chunksize:rows of each read chunk of coor file.
+        maxrows:rows of stored values of exact statistics, 0 is unlimited.
+    """
+
+    def __init__(self, chunksize=readdata.CHUNKSIZE, maxrows=0):
+        """Initialize Plot."""
+        self.chunksize = chunksize
+        self.maxrows = maxrows
+
+    def plotENU(self, coorpath, date, gsystem, ctype, respath, series=None,
+                window=None):
         """plotenu and report.
 
         Arg:
@@ -31,14 +48,18 @@ class Plot(object):
             gsystem:GNSS system.
             ctype:calculate type.
             respath:result path.
+            series:if not None, store U, N, E series of stations in it,
+                type:series.SeriesStore, key:station name.
+            window:(start, end) seconds of day, None is whole day.
+
+        Return:
+            report:UNEH report, type:pandas.DataFrame, if not find coor
+                file, return None.
         """
-        doy = date.timetuple().tm_yday
-        filelist = glob.glob(
-            os.path.join(coorpath, ''.join(
-                ['*', '{:0>3d}.{:0>2d}'.format(doy, date.year % 100), 'coor'])))
+        filelist = catalog.getcatalog().coorfiles(coorpath, date)
         if not filelist:
             print("Can't find %s's coor file in %s" % (str(date), coorpath))
-            return 0
+            return None
         filesnum = len(filelist)
         # start plot
         fig, axes = plt.subplots(4, sharex=True)
@@ -54,69 +75,50 @@ class Plot(object):
             yrange = np.arange(-10, 10.5, 5)
 
         report = defaultdict(list)
+        sketches = dict()
+        collector = convergence.Collector()
         counter = 0  # if counte is multiple of 7 create a new figure
         for path in filelist:
             station = refname.findall(path)[0]
             report['name'].append(station)
+            stats = statistic.UNEHStats(maxrows=self.maxrows)
+            color = next(colors)
             try:
-                data = pd.read_table(
-                    path, delim_whitespace=True).apply(
-                        pd.to_numeric, errors='coerce')
-                if 'U' not in data or 'N' not in data or 'E' not in data:
-                    raise ValueError
+                with readdata.opencoor(path, date, window) as f:
+                    for data in pd.read_table(
+                            f, delim_whitespace=True,
+                            chunksize=self.chunksize):
+                        data = data.apply(pd.to_numeric, errors='coerce')
+                        if 'U' not in data or 'N' not in data or \
+                                'E' not in data:
+                            raise ValueError
+                        data = readdata.selectwindow(data, window)
+                        stats.update(data)
+                        collector.update(station, data)
+                        if series is not None:
+                            series.appendframe(station, data)
+                        x_axis = (data.ws % 86400) / 3600.0
+                        axes[0].scatter(x_axis, data.U, s=1, color=color)
+                        axes[1].scatter(x_axis, data.N, s=1, color=color)
+                        axes[2].scatter(x_axis, data.E, s=1, color=color)
+                        axes[3].scatter(x_axis, data.trop, s=1, color=color)
             except:
-                report['U_rms'].append(0)
-                report['N_rms'].append(0)
-                report['E_rms'].append(0)
-                report['H_rms'].append(0)
-                report['U_95'].append(0)
-                report['N_95'].append(0)
-                report['E_95'].append(0)
-                report['H_95'].append(0)
-                report['effective_rate'].append(0)
-                counter += 1
-                continue
-            num = data.shape[0]
-            if num == 0:
-                report['U_rms'].append(0)
-                report['N_rms'].append(0)
-                report['E_rms'].append(0)
-                report['H_rms'].append(0)
-                report['U_95'].append(0)
-                report['N_95'].append(0)
-                report['E_95'].append(0)
-                report['H_95'].append(0)
-                report['effective_rate'].append(0)
-                counter += 1
-                continue
-
-            threshold_index = int(num * 0.95)
-            u_rms = np.sqrt(data.U.pow(2).sum() / num)
-            n_rms = np.sqrt(data.N.pow(2).sum() / num)
-            e_rms = np.sqrt(data.E.pow(2).sum() / num)
-            report['U_rms'].append(u_rms)
-            report['N_rms'].append(n_rms)
-            report['E_rms'].append(e_rms)
-            data_H = np.sqrt((data.N.pow(2) + data.E.pow(2)))
-            report['H_rms'].append(np.sqrt(data_H.pow(2).sum() / num))
-            report['U_95'].append(data.U.abs().sort_values().iloc[
-                threshold_index])
-            report['N_95'].append(data.N.abs().sort_values().iloc[
-                threshold_index])
-            report['E_95'].append(data.E.abs().sort_values().iloc[
-                threshold_index])
-            report['H_95'].append(data_H.abs().sort_values().iloc[
-                threshold_index])
-            report['effective_rate'].append(num / 86400.0)
-
-            color = next(colors)
-            label = '%s U:%.2fm N:%.2fm E:%.2fm' % (station, u_rms, n_rms,
-                                                    e_rms)
-            x_axis = (data.ws % 86400) / 3600.0
-            axes[0].scatter(x_axis, data.U, s=1, color=color)
-            axes[1].scatter(x_axis, data.N, s=1, color=color, label=label)
-            axes[2].scatter(x_axis, data.E, s=1, color=color)
-            axes[3].scatter(x_axis, data.trop, s=1, color=color)
+                stats = None
+                collector.discard(station)
+                if series is not None:
+                    series.discard(station)
+            result = stats.result(
+                readdata.windowlength(window)) if stats else statistic.empty()
+            for col in result:
+                report[col].append(result[col])
+            if stats:
+                stats.compact()
+                sketches[station] = stats
+            if stats and stats.count:
+                label = '%s U:%.2fm N:%.2fm E:%.2fm' % (
+                    station, result['U_rms'], result['N_rms'],
+                    result['E_rms'])
+                axes[1].scatter([], [], s=1, color=color, label=label)
 
             counter += 1
             if counter % 7 == 0 or counter == filesnum:
@@ -155,9 +157,8 @@ class Plot(object):
                 fig_name = '%s-%s-%s-ENU%d' % (ctype, gsystem, str(date),
                                                fig_number)
                 fig_path = os.path.join(respath, str(date), '-'.join([ctype, gsystem]))
-                if not os.path.exists(fig_path):
-                    os.makedirs(fig_path)
-                plt.savefig(
+                resultwriter.getwriter().savefig(
+                    plt.gcf(),
                     os.path.join(fig_path, fig_name), bbox_inches='tight')
                 plt.clf()
                 plt.close()
@@ -168,18 +169,86 @@ class Plot(object):
         plt.close()
 
         # save report
-        cols = [
-            'name', 'U_rms', 'N_rms', 'E_rms', 'H_rms', 'U_95', 'N_95', 'E_95',
-            'H_95', 'effective_rate'
-        ]
+        conv = collector.analyse(ctype)
+        readdata.addconvergence(report, conv)
+        cols = ['name'] + statistic.COLUMNS + convergence.COLUMNS
         report = pd.DataFrame(report, columns=cols).sort_values('name')
         report_name = '-'.join([ctype, gsystem, str(date), 'report.csv'])
-        report.to_csv(
-            os.path.join(fig_path, report_name),
-            sep='\t',
-            na_rep=' ',
-            index=False,
-            float_format='%.2f')
+        statistic.savereport(report, os.path.join(fig_path, report_name))
+        statistic.savesketch(
+            sketches,
+            os.path.join(fig_path, statistic.sketchname(ctype, gsystem, date)),
+            conv)
+        return report
+
+    def plotheatmap(self, store, date, gsystem, ctype, respath, binsize=3600):
+        """Plot station x time bin rms of all stations as one heatmap.
+
+        U, N, E, H blocks are put side by side in one image, so the whole
+        network is rendered by one imshow.
+
+        Arg:
+            store:U, N, E series of stations, type:series.SeriesStore.
+            date:date, type:datetime.
+            gsystem:GNSS system.
+            ctype:calculate type.
+            respath:result path.
+            binsize:seconds of time bin.
+        """
+        names, counts, grid = statistic.gridrms(store, binsize)
+        if not names:
+            return
+        nbin = counts.shape[1]
+        gap = np.full((len(names), 1), np.nan)
+        image = np.hstack(
+            sum([[grid[comp], gap] for comp in statistic.COMPONENTS], [])[:-1])
+        finite = image[np.isfinite(image)]
+        vmax = np.percentile(finite, 95) if len(finite) else 1
+
+        f, ax = plt.subplots(figsize=(20, max(4, 0.15 * len(names) + 2)))
+        im = ax.imshow(
+            np.ma.masked_invalid(image),
+            aspect='auto',
+            interpolation='nearest',
+            cmap=cm.get_cmap('jet'),
+            vmin=0,
+            vmax=vmax)
+        # station labels, at most 100 labels
+        step = int(math.ceil(len(names) / 100.0))
+        ax.set_yticks(range(0, len(names), step))
+        ax.set_yticklabels(names[::step], size=8, weight='bold')
+        # hour labels of every block
+        hours = np.arange(0, 24, 6)
+        ticks = list()
+        labels = list()
+        for i, comp in enumerate(statistic.COMPONENTS):
+            start = i * (nbin + 1)
+            ticks.extend(start + hours * 3600.0 / binsize - 0.5)
+            labels.extend(hours)
+            ax.text(
+                start + nbin / 2.0,
+                1.01,
+                comp,
+                transform=ax.get_xaxis_transform(),
+                ha='center',
+                va='bottom',
+                size=16,
+                weight='bold')
+        ax.set_xticks(ticks)
+        ax.set_xticklabels(labels, size=10, weight='bold')
+        ax.set_xlabel('TIME[h]', size=16, weight='bold')
+        cbar = f.colorbar(im, ax=ax, pad=0.01)
+        cbar.ax.set_title('rms[m]', size=12, weight='bold')
+        title = '%s-%s %d min RMS At %s' % (ctype, gsystem, binsize // 60,
+                                           str(date))
+        ax.set_title(title, size=20, weight='bold', y=1.08)
+        # save figure
+        fig_name = '-'.join([ctype, gsystem, str(date), 'heatmap.png'])
+        fig_path = os.path.join(respath, str(date), '-'.join([ctype, gsystem]))
+        resultwriter.getwriter().savefig(
+            plt.gcf(), os.path.join(fig_path, fig_name), bbox_inches='tight')
+        plt.clf()
+        plt.close()
 
     def plotUH(self, report, date, gsystem, ctype, filepath):
         """Plot horenzital and vertical errors.
@@ -192,8 +261,7 @@ class Plot(object):
             filepath:result path.
         """
         # connect to station database, returieve station b, l
-        connect = sqlite3.connect(
-            os.path.join(os.path.dirname(__file__), 'station.sqlite'))
+        connect = sqlite3.connect(preprocess.STATIONDB)
         cur = connect.cursor()
 
         latitude = list()
@@ -288,9 +356,8 @@ class Plot(object):
             weight='bold')
         fig_name = '-'.join([ctype, gsystem, str(date), 'HV'])
         fig_path = os.path.join(filepath, str(date), '-'.join([ctype, gsystem]))
-        if not os.path.exists(fig_path):
-            os.makedirs(fig_path)
-        plt.savefig(
+        resultwriter.getwriter().savefig(
+            plt.gcf(),
             os.path.join(fig_path, ''.join([fig_name, '.png'])),
             bbox_inches='tight')
 
@@ -301,7 +368,8 @@ class Plot(object):
                 x, y = m(lon, lat)
                 ax.text(x, y, name, size=12, weight='bold')
 
-        plt.savefig(
+        resultwriter.getwriter().savefig(
+            plt.gcf(),
             os.path.join(fig_path, ''.join([fig_name, '_name.png'])),
             bbox_inches='tight')
         plt.clf()
@@ -341,9 +409,9 @@ class Plot(object):
             plt.legend(markerscale=0, prop={'size': 12, 'weight': 'bold'})
             fig_name = '-'.join([gsystem, str(date), 'satnum.png'])
             fig_path = os.path.join(filepath, str(date), 'Correct')
-            if not os.path.exists(fig_path):
-                os.makedirs(fig_path)
-            plt.savefig(os.path.join(fig_path, fig_name), bbox_inches='tight')
+            resultwriter.getwriter().savefig(
+                plt.gcf(), os.path.join(fig_path, fig_name),
+                bbox_inches='tight')
             plt.clf()
             plt.close()
 
@@ -377,9 +445,8 @@ class Plot(object):
             weight='bold')
         fig_name = '-'.join([prn, str(date), 'satiode.png'])
         fig_path = os.path.join(filepath, str(date), 'Correct')
-        if not os.path.exists(fig_path):
-            os.makedirs(fig_path)
-        plt.savefig(os.path.join(fig_path, fig_name), bbox_inches='tight')
+        resultwriter.getwriter().savefig(
+            plt.gcf(), os.path.join(fig_path, fig_name), bbox_inches='tight')
         plt.clf()
         plt.close()
 
@@ -422,8 +489,53 @@ class Plot(object):
         # save figure
         fig_name = '-'.join([prn, str(date), 'orbit-clock.png'])
         fig_path = os.path.join(filepath, str(date), 'Correct')
-        if not os.path.exists(fig_path):
-            os.makedirs(fig_path)
-        plt.savefig(os.path.join(fig_path, fig_name), bbox_inches='tight')
+        resultwriter.getwriter().savefig(
+            plt.gcf(), os.path.join(fig_path, fig_name), bbox_inches='tight')
+        plt.clf()
+        plt.close()
+
+    def plotorbitcmatrix(self, corr, orbit, clock, date, filepath):
+        """Plot orbit and clock errors of all satellites as heatmap.
+
+        Args:
+            corr:correct data, type:readdata.CorrData.
+            orbit:3D orbit errors, PRN x epoch, type:numpy.ndarray.
+            clock:datum removed clock errors, PRN x epoch,
+                type:numpy.ndarray.
+            date:date, type:datetime.
+            filepath:result file path.
+        """
+        if not corr.prns or not len(corr.hours):
+            return
+        f, axes = plt.subplots(2, sharex=True, figsize=(20, 10))
+        extent = [corr.hours[0], corr.hours[-1], len(corr.prns) - 0.5, -0.5]
+        for ax, data, label in zip(axes, [orbit, np.abs(clock)],
+                                   ['Orbit[m]', 'Clock[m]']):
+            image = ax.imshow(
+                np.ma.masked_invalid(data),
+                aspect='auto',
+                interpolation='nearest',
+                extent=extent,
+                cmap=cm.get_cmap('jet'),
+                vmin=0,
+                vmax=np.nanpercentile(data, 95) if np.isfinite(data).any()
+                else 1)
+            ax.set_yticks(range(len(corr.prns)))
+            ax.set_yticklabels(corr.prns, size=8, weight='bold')
+            ax.set_ylabel(label, size=20, weight='bold')
+            cbar = f.colorbar(image, ax=ax, pad=0.01)
+            cbar.ax.set_title('m', size=14, weight='bold')
+        axes[1].set_xlim([0, 24.5])
+        axes[1].set_xticks(range(0, 25))
+        axes[1].set_xticklabels(range(0, 25), size=18, weight='bold')
+        axes[1].set_xlabel('TIME[h]', size=20, weight='bold')
+        title = ' '.join(
+            [corr.system, 'Orbit And Clock Errors', 'At', str(date)])
+        f.suptitle(title, size=25, weight='bold')
+        # save figure
+        fig_name = '-'.join([corr.system, str(date), 'orbit-clock-all.png'])
+        fig_path = os.path.join(filepath, str(date), 'Correct')
+        resultwriter.getwriter().savefig(
+            plt.gcf(), os.path.join(fig_path, fig_name), bbox_inches='tight')
         plt.clf()
         plt.close()
@@ -7,6 +7,9 @@ import re
 import sqlite3
 import datetime
 
+# station database read by plots, benchmark points it to its work directory
+STATIONDB = os.path.join(os.path.dirname(__file__), 'station.sqlite')
+
 
 class Preprocess(object):
     """Preprocess.
@@ -21,6 +24,12 @@ class Preprocess(object):
         ctype:calculate type, type:list, elemnt type:str.
         duration:duration include start time and end time, type:list,
             element type:datetime.
+        memory:memory budget(MB), 0 is unlimited.
+        queue:work queue database path shared by hosts.
+        lease:seconds of work queue lease.
+        binsize:minutes of heatmap time bin.
+        port:port of query server.
+        window:(start, end) seconds of day of evaluation, None is whole day.
     """
 
     def __init__(self):
@@ -32,14 +41,24 @@ class Preprocess(object):
         self.ctype = list()
         self.duration = list()
         self.prn = list()
+        self.memory = 0
+        self.queue = None
+        self.lease = 600
+        self.binsize = 60
+        self.port = 8086
+        self.window = None
 
     def readconfig(self, fname):
         """Read configure file.
 
         Arg:
-            fname: configure file name, manual.ini or auto.ini.
+            fname: configure file name, manual.ini or auto.ini in program
+                directory, or path of configure file.
         """
-        configure_path = os.path.join(os.path.dirname(__file__), fname)
+        if os.path.dirname(fname):
+            configure_path = os.path.abspath(os.path.expanduser(fname))
+        else:
+            configure_path = os.path.join(os.path.dirname(__file__), fname)
         if not os.path.exists(configure_path):
             print('Not find configure file in %s' % configure_path)
             sys.exit()
@@ -59,12 +78,30 @@ class Preprocess(object):
                         self.gsystem.append(line.split('=')[1].strip().upper())
                     if line.startswith('type'):
                         self.ctype.append(line.split('=')[1].strip().upper())
+                    if line.startswith('memory'):
+                        memory = line.split('=')[1].strip()
+                        self.memory = int(memory) if memory else 0
+                    if line.startswith('queue'):
+                        self.queue = line.split('=')[1].strip() or None
+                    if line.startswith('lease'):
+                        lease = line.split('=')[1].strip()
+                        self.lease = int(lease) if lease else 600
+                    if line.startswith('binsize'):
+                        binsize = line.split('=')[1].strip()
+                        self.binsize = int(binsize) if binsize else 60
+                    if line.startswith('port'):
+                        port = line.split('=')[1].strip()
+                        self.port = int(port) if port else 8086
 
                     if fname == 'manual.ini':
                         if line.startswith('starttime'):
                             self.duration.append(line.split('=')[1].strip())
                         if line.startswith('endtime'):
                             self.duration.append(line.split('=')[1].strip())
+                        if line.startswith('window'):
+                            window = line.split('=')[1].strip()
+                            if window:
+                                self.window = window
                         if line.startswith('prn'):
                             prn = line.split('=')[1].strip()
                             if prn:
@@ -77,6 +114,9 @@ class Preprocess(object):
             self.__checktype(self.ctype)
             if fname == 'manual.ini':
                 self.__checkdatetime(self.duration)
+                if self.window:
+                    self.__checkwindow(self.window)
+            self.__checkbinsize(self.binsize)
 
             # read station list and store in database
             self.__readstation(station)
@@ -127,14 +167,34 @@ class Preprocess(object):
         self.duration[0] = starttime
         self.duration[1] = endtime
 
+    def __checkwindow(self, window):
+        """check time window, end 24:00 is end of day."""
+        clock = r"\d{2}:\d{2}(:\d{2})?"
+        if not re.match(r"^%s %s$" % (clock, clock), window):
+            print('%s not match HH:MM HH:MM' % window)
+            sys.exit()
+        seconds = list()
+        for clock in window.split():
+            fields = list(map(int, clock.split(':'))) + [0]
+            seconds.append(fields[0] * 3600 + fields[1] * 60 + fields[2])
+        if not 0 <= seconds[0] < seconds[1] <= 86400:
+            print('Time window %s is invalid!' % window)
+            sys.exit()
+        self.window = tuple(seconds)
+
+    def __checkbinsize(self, binsize):
+        """check minutes of heatmap time bin."""
+        if binsize <= 0:
+            print('Binsize %s is invalid!' % binsize)
+            sys.exit()
+
     def __readstation(self, filepath):
         """Read station list and store in database.
 
         Arg:
             filepath:station list filepath.
         """
-        connection = sqlite3.connect(
-            os.path.join(os.path.dirname(__file__), 'station.sqlite'))
+        connection = sqlite3.connect(STATIONDB)
         cur = connection.cursor()
         cur.execute(
             '''CREATE TABLE IF NOT EXISTS Station(name TEXT NOT NULL UNIQUE
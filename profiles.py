@@ -0,0 +1,209 @@
+# coding:utf-8
+"""Multi profile autorun, evaluate many autorun configure files at once.
+
+Every profile has its own inputs and result path. Modules of autorun are
+split into jobs by input, a corr directory for satnum and iodeall, a coor
+directory of system and type for enuuh. Profiles sharing an input share
+its job, so the input is read once, the job runs in a staging directory
+of its first profile and results are published to every profile of it.
+File catalog and epoch index of the process are shared by all jobs.
+"""
+
+import os
+import copy
+import time
+import shutil
+import multiprocessing
+from collections import OrderedDict, namedtuple
+import memory
+import workqueue
+import profiling
+import resultwriter
+
+CORRMODULES = ['satnum', 'iodeall']
+SUMMARY = 'run-summary.csv'
+
+Job = namedtuple('Job', ('kind', 'key', 'runs'))
+
+
+def plan(runs):
+    """Group inputs of profiles into jobs.
+
+    Arg:
+        runs:configured runs of profiles, type:list, element
+            type:dataprocess.Dataprocess.
+
+    Return:
+        jobs:jobs in order of profiles, runs of a job are profiles using
+            its input, the first is owner, type:list, element type:Job.
+    """
+    jobs = OrderedDict()
+    for run in runs:
+        for filepath in run.midoutput:
+            key = ('corr', os.path.abspath(filepath))
+            jobs.setdefault(key, list()).append(run)
+        for filepath, gsystem, ctype in zip(run.endoutput, run.gsystem,
+                                            run.ctype):
+            key = ('coor', os.path.abspath(filepath), gsystem, ctype)
+            jobs.setdefault(key, list()).append(run)
+    result = list()
+    for key, users in jobs.items():
+        # a profile listing the same input twice runs it once
+        unique = list()
+        for run in users:
+            if all(run is not other for other in unique):
+                unique.append(run)
+        result.append(Job(key[0], key[1:], unique))
+    return result
+
+
+def jobrun(job, index):
+    """Return run of job, a copy of owner profile run on its input only.
+
+    Results are written in staging directory of owner result path, memory
+    summary of job is written there too.
+    """
+    owner = job.runs[0]
+    run = copy.copy(owner)
+    run.respath = os.path.join(owner.respath, workqueue.STAGING,
+                               'autorun-%d-%d' % (os.getpid(), index))
+    run.summarydir = None
+    if job.kind == 'corr':
+        run.midoutput = [job.key[0]]
+        run.endoutput, run.gsystem, run.ctype = list(), list(), list()
+    else:
+        run.midoutput = list()
+        filepath, gsystem, ctype = job.key
+        run.endoutput, run.gsystem, run.ctype = [filepath], [gsystem], [ctype]
+    shutil.rmtree(run.respath, ignore_errors=True)
+    os.makedirs(run.respath)
+    return run
+
+
+def execute(runs):
+    """Run jobs of profiles, shared inputs are evaluated once.
+
+    Corr jobs run in parallel processes while coor jobs run in this
+    process, so series parsed by enuuh are returned for check. A third of
+    memory budget is left to this process, corr processes run at once
+    share the rest. Seconds of a corr job are seconds of its modules in
+    its run summary.
+
+    Arg:
+        runs:configured runs of profiles, all runs share duration.
+
+    Return:
+        series:U, N, E series of the first date, the first profile of
+            (system, type) is kept, type:dict, key:(system, type),
+            value:series.SeriesStore.
+        metrics:jobs, shared jobs, published files and seconds of
+            profiles, type:OrderedDict, key:profile.
+    """
+    jobs = plan(runs)
+    metrics = OrderedDict()
+    for run in runs:
+        metrics[run.profile] = OrderedDict([('jobs', 0), ('shared', 0),
+                                            ('files', 0), ('seconds', 0.0)])
+    jobruns = [jobrun(job, i) for i, job in enumerate(jobs)]
+    total = max(run.memory for run in runs)
+    corrmemory = total - total // 3
+    corrruns = [run for job, run in zip(jobs, jobruns) if job.kind == 'corr']
+    count = memory.slots(corrmemory, memory.PROCESSBYTES,
+                         len(corrruns) * len(CORRMODULES))
+    process = list()
+    for run in corrruns:
+        run.budget = corrmemory // count
+        for module in CORRMODULES:
+            process.append(
+                multiprocessing.Process(
+                    target=profiling.wrap(getattr(run, module))))
+    slots = memory.Slots(process, count)
+    slots.start()
+    series = dict()
+    seconds = dict()
+    for i, (job, run) in enumerate(zip(jobs, jobruns)):
+        if job.kind != 'coor':
+            continue
+        run.budget = run.memory // 3
+        jobstart = time.time()
+        with profiling.stage('enuuh'):
+            parsed = run.enuuh(keep=run.duration[:1])
+        seconds[i] = time.time() - jobstart
+        for stores in parsed.values():
+            for key, store in stores.items():
+                series.setdefault(key, store)
+        # corr processes finished meanwhile free their slots
+        slots.start()
+    slots.join()
+    for i, (job, run) in enumerate(zip(jobs, jobruns)):
+        if job.kind == 'corr':
+            seconds[i] = sum(
+                float(line.split('\t')[7])
+                for line in memory.summary(run.summarypath(), run.runid))
+        files = publish(run.respath, [user.respath for user in job.runs])
+        for user in job.runs:
+            metric = metrics[user.profile]
+            metric['jobs'] += 1
+            metric['shared'] += int(len(job.runs) > 1)
+            metric['files'] += files
+            metric['seconds'] += seconds[i]
+    return series, metrics
+
+
+def publish(staging, respaths):
+    """Publish results of staging directory to result paths of profiles.
+
+    Memory summary and artifact manifest are appended to those of every
+    result path. Other files are copied to every result path but the
+    first, then moved into the first, every file is replaced atomically.
+
+    Return:
+        files:number of published result files.
+    """
+    for name in [SUMMARY, resultwriter.MANIFEST]:
+        filepath = os.path.join(staging, name)
+        if not os.path.isfile(filepath):
+            continue
+        with open(filepath) as f:
+            lines = f.readlines()
+        for respath in respaths:
+            appendlines(os.path.join(respath, name), lines)
+        os.remove(filepath)
+    files = 0
+    for root, dirs, names in os.walk(staging):
+        files += len(names)
+        for respath in respaths[1:]:
+            target = os.path.join(respath, os.path.relpath(root, staging))
+            if not os.path.exists(target):
+                os.makedirs(target)
+            for name in names:
+                # copies, result files of profiles are written separately
+                temp = os.path.join(target, '.%s.tmp' % name)
+                shutil.copy2(os.path.join(root, name), temp)
+                os.replace(temp, os.path.join(target, name))
+    workqueue.publish(staging, respaths[0])
+    try:
+        os.rmdir(os.path.dirname(staging))
+    except OSError:
+        pass  # staging directories of other runs
+    return files
+
+
+def appendlines(filepath, lines):
+    """Append lines of a file with header line, header is written once."""
+    if not os.path.isdir(os.path.dirname(filepath)):
+        os.makedirs(os.path.dirname(filepath))
+    if os.path.isfile(filepath):
+        lines = lines[1:]
+    # one write in append mode, lines of parallel processes do not mix
+    with open(filepath, 'a') as f:
+        f.write(''.join(lines))
+
+
+def printmetrics(metrics):
+    """Print metrics of profiles."""
+    print('profile\tjobs\tshared\tfiles\tseconds')
+    for profile, metric in metrics.items():
+        print('%s\t%d\t%d\t%d\t%.1f' % (profile, metric['jobs'],
+                                        metric['shared'], metric['files'],
+                                        metric['seconds']))
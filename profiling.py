@@ -0,0 +1,369 @@
+# coding:utf-8
+"""Profiling of stages on demand, hot functions and modules of a run.
+
+A stage is a block of work, e.g. a module of evaluation run in a process
+or sending of notification. Every stage invocation is profiled apart and
+saved in profile directory, stages of child processes are saved by the
+children, so the report of a run merges stages of all its processes.
+
+Two modes:
+    cprofile:deterministic profiling by cProfile, a .prof file of stage.
+    sample:stacks of stage threads are sampled every INTERVAL seconds by
+        a thread, a .stacks file of collapsed stacks of stage, merged
+        into stacks.collapsed for flame graphs.
+
+A stage nested in a stage of the same thread pauses the outer one, so
+times of stages are not counted twice.
+"""
+
+import os
+import sys
+import time
+import glob
+import pstats
+import cProfile
+import threading
+import contextlib
+import functools
+from collections import Counter, OrderedDict, defaultdict
+
+MODES = ['cprofile', 'sample']
+INTERVAL = 0.005  # seconds between samples
+TOP = 25  # functions in report
+REPORT = 'profile-report.txt'
+STACKS = 'stacks.collapsed'
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+_mode = None
+_outdir = None
+_pid = None
+_seq = 0
+_stacks = dict()  # thread ident: active stages of thread
+_sampler = None
+_lock = threading.Lock()
+
+
+class Stage(object):
+    """Profiled invocation of a stage.
+
+    Attributes:
+        name:stage name.
+        filepath:profile file path without extension.
+        profiler:profiler of cprofile mode, type:cProfile.Profile.
+        samples:collapsed stacks of sample mode, type:Counter.
+        start:start time of stage.
+    """
+
+    def __init__(self, name, filepath):
+        """Initialize Stage."""
+        self.name = name
+        self.filepath = filepath
+        self.profiler = cProfile.Profile() if _mode == 'cprofile' else None
+        self.samples = Counter()
+        self.start = time.time()
+
+    def save(self):
+        """Save profile of stage."""
+        if self.profiler is not None:
+            self.profiler.dump_stats(self.filepath + '.prof')
+            return
+        # sampler may still count the stage, items are copied at once
+        samples = list(self.samples.items())
+        with open(self.filepath + '.stacks', 'w') as f:
+            f.write('# seconds %.3f\n' % (time.time() - self.start))
+            f.write(''.join('%s %d\n' % (stack, count)
+                            for stack, count in samples))
+
+
+class Sampler(threading.Thread):
+    """Sample stacks of threads in a stage every interval."""
+
+    def __init__(self, interval=INTERVAL):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interval = interval
+
+    def run(self):
+        me = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            for ident, frame in sys._current_frames().items():
+                # stages of thread may change while sampled
+                stage = _stacks.get(ident, [])[-1:]
+                if ident == me or not stage:
+                    continue
+                stage[0].samples[collapse(frame)] += 1
+
+
+def enable(mode, outdir):
+    """Enable profiling of stages in this process and its children.
+
+    Args:
+        mode:profiling mode, 'cprofile' or 'sample'.
+        outdir:profile directory.
+    """
+    global _mode, _outdir
+    _mode = mode
+    _outdir = outdir
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+
+def enabled():
+    """Return True if profiling is enabled."""
+    return _mode is not None
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Profile block as a stage, do nothing if profiling is disabled.
+
+    Arg:
+        name:stage name, e.g. module name.
+    """
+    if _mode is None:
+        yield
+        return
+    _forked()
+    global _seq, _sampler
+    with _lock:
+        _seq += 1
+        filepath = os.path.join(_outdir,
+                                '%s-%d-%d' % (name, os.getpid(), _seq))
+        if _mode == 'sample' and _sampler is None:
+            _sampler = Sampler()
+            _sampler.start()
+    current = Stage(name, filepath)
+    stack = _stacks.setdefault(threading.get_ident(), list())
+    if stack and stack[-1].profiler is not None:
+        stack[-1].profiler.disable()
+    stack.append(current)
+    if current.profiler is not None:
+        current.profiler.enable()
+    try:
+        yield
+    finally:
+        if current.profiler is not None:
+            current.profiler.disable()
+        stack.pop()
+        if stack and stack[-1].profiler is not None:
+            stack[-1].profiler.enable()
+        current.save()
+
+
+def wrap(target, name=None):
+    """Return target run as a stage, e.g. target of child process.
+
+    Args:
+        target:callable.
+        name:stage name, default name of target.
+    """
+    name = name or target.__name__
+
+    @functools.wraps(target)
+    def run(*args, **kwargs):
+        with stage(name):
+            return target(*args, **kwargs)
+
+    return run
+
+
+def _forked():
+    """Drop stages inherited from parent process after fork."""
+    global _pid, _sampler, _lock
+    if _pid == os.getpid():
+        return
+    # lock may be held by other thread of parent at fork
+    _lock = threading.Lock()
+    for stack in _stacks.values():
+        for current in stack:
+            if current.profiler is not None:
+                current.profiler.disable()
+    _stacks.clear()
+    # sampler thread of parent not exists in child
+    _sampler = None
+    _pid = os.getpid()
+
+
+@functools.lru_cache(maxsize=None)
+def modulename(filename):
+    """Return module of code file, package of installed packages."""
+    if filename == '~' or filename.startswith('<'):
+        return 'builtins'
+    path = os.path.abspath(filename)
+    parts = path.split(os.sep)
+    if not path.startswith(ROOT + os.sep):
+        for packages in ['site-packages', 'dist-packages']:
+            if packages in parts[:-1]:
+                return os.path.splitext(parts[parts.index(packages) +
+                                              1])[0]
+    name = os.path.splitext(parts[-1])[0]
+    # module of package is named by package
+    return parts[-2] if name == '__init__' else name
+
+
+def _isprogram(filename):
+    """Return True if code file is a module of this program."""
+    if modulename(filename) == 'builtins':
+        return False
+    return os.path.abspath(filename).startswith(ROOT + os.sep)
+
+
+def collapse(frame):
+    """Return collapsed stack of frame, frames from root separated by ;."""
+    frames = list()
+    while frame is not None:
+        code = frame.f_code
+        frames.append('%s:%s' % (modulename(code.co_filename), code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(frames))
+
+
+def report(outdir, top=TOP):
+    """Merge stage profiles of a run and write report.
+
+    Args:
+        outdir:profile directory.
+        top:number of top functions.
+
+    Return:
+        text:report of stages, top functions and time by module.
+    """
+    profs = sorted(glob.glob(os.path.join(outdir, '*.prof')))
+    stacks = sorted(glob.glob(os.path.join(outdir, '*.stacks')))
+    lines = ['Profile of %s' % outdir, '']
+    if profs:
+        lines.extend(_reportprofs(profs, top))
+    if stacks:
+        lines.extend(_reportstacks(stacks, top, outdir))
+    if not profs and not stacks:
+        lines.append('No stage profiled.')
+    text = '\n'.join(lines) + '\n'
+    with open(os.path.join(outdir, REPORT), 'w') as f:
+        f.write(text)
+    return text
+
+
+def _stagename(filepath):
+    """Return stage name and pid of stage profile file."""
+    name, pid, _ = os.path.splitext(
+        os.path.basename(filepath))[0].rsplit('-', 2)
+    return name, pid
+
+
+def _stagetable(rows, unit):
+    lines = ['stage\tprocesses\tcalls\t%s' % unit]
+    for name, (pids, calls, value) in rows.items():
+        lines.append('%s\t%d\t%d\t%.2f' % (name, len(pids), calls, value))
+    return lines + ['']
+
+
+def _reportprofs(profs, top):
+    """Report lines of cProfile stage profiles."""
+    stages = OrderedDict()
+    merged = None
+    for filepath in profs:
+        stats = pstats.Stats(filepath)
+        name, pid = _stagename(filepath)
+        pids, calls, seconds = stages.get(name, (set(), 0, 0.0))
+        pids.add(pid)
+        stages[name] = (pids, calls + 1, seconds + stats.total_tt)
+        if merged is None:
+            merged = stats
+        else:
+            merged.add(stats)
+    lines = ['Stages, seconds of stage code:'] + _stagetable(stages, 'seconds')
+    # time of module: time of calls from other modules include callees,
+    # only of modules of this program. cProfile keeps caller edges, not
+    # stacks, so a module reentered by its callee, e.g. dataprocess ->
+    # plotdata -> dataprocess, counts the nested call again, the times are
+    # upper bounds and not additive, exact module times are in sample mode
+    owns = defaultdict(float)
+    totals = defaultdict(float)
+    functions = list()
+    for func, (cc, nc, tt, ct, callers) in merged.stats.items():
+        module = modulename(func[0])
+        owns[module] += tt
+        functions.append((tt, ct, nc, '%s:%s:%d' % (module, func[2], func[1])))
+        if not _isprogram(func[0]):
+            continue
+        totals[module] += 0.0
+        if not callers:
+            totals[module] += ct
+        for caller, edge in callers.items():
+            if modulename(caller[0]) != module:
+                totals[module] += edge[3]
+    lines.append('Top functions by own time:')
+    lines.append('own_s\tcum_s\tcalls\tfunction')
+    for tt, ct, nc, label in sorted(functions, reverse=True)[:top]:
+        lines.append('%.3f\t%.3f\t%d\t%s' % (tt, ct, nc, label))
+    lines.append('')
+    lines.append('Modules of program by time of calls from other modules, '
+                 'reentered calls are counted again, not additive:')
+    lines.append('calls_s\town_s\tmodule')
+    for module in sorted(totals, key=totals.get, reverse=True)[:top]:
+        lines.append('%.3f\t%.3f\t%s' %
+                     (totals[module], owns[module], module))
+    lines.append('')
+    lines.append('Modules by own time:')
+    lines.append('own_s\tmodule')
+    for module in sorted(owns, key=owns.get, reverse=True)[:top]:
+        lines.append('%.3f\t%s' % (owns[module], module))
+    return lines + ['']
+
+
+def _reportstacks(stacks, top, outdir):
+    """Report lines of sampled stages, collapsed stacks are merged.
+
+    Samples of a stage are weighted by its wall seconds, interval of
+    samples is longer than INTERVAL under load.
+    """
+    stages = OrderedDict()
+    merged = Counter()
+    owns = defaultdict(float)
+    totals = defaultdict(float)
+    functions = defaultdict(float)
+    cumulative = defaultdict(float)
+    for filepath in stacks:
+        name, pid = _stagename(filepath)
+        seconds = 0.0
+        samples = Counter()
+        with open(filepath) as f:
+            for line in f:
+                if line.startswith('#'):
+                    seconds = float(line.split()[-1])
+                    continue
+                stack, count = line.rstrip('\n').rsplit(' ', 1)
+                samples[stack] += int(count)
+        weight = seconds / max(sum(samples.values()), 1)
+        for stack, count in samples.items():
+            # stage is the root frame of flame graph
+            merged['%s;%s' % (name, stack)] += count
+            frames = stack.split(';')
+            functions[frames[-1]] += count * weight
+            owns[frames[-1].split(':', 1)[0]] += count * weight
+            for frame in set(frames):
+                cumulative[frame] += count * weight
+            for module in set(frame.split(':', 1)[0] for frame in frames):
+                totals[module] += count * weight
+        pids, calls, total = stages.get(name, (set(), 0, 0.0))
+        pids.add(pid)
+        stages[name] = (pids, calls + 1, total + seconds)
+    with open(os.path.join(outdir, STACKS), 'w') as f:
+        f.write(''.join('%s %d\n' % (stack, count)
+                        for stack, count in merged.most_common()))
+    lines = ['Sampled stages, wall seconds:']
+    lines.extend(_stagetable(stages, 'seconds'))
+    lines.append('Top functions by own time:')
+    lines.append('own_s\tcum_s\tfunction')
+    for label in sorted(functions, key=functions.get, reverse=True)[:top]:
+        lines.append('%.3f\t%.3f\t%s' %
+                     (functions[label], cumulative[label], label))
+    lines.append('')
+    lines.append('Modules by cumulative time:')
+    lines.append('cum_s\town_s\tmodule')
+    for module in sorted(totals, key=totals.get, reverse=True)[:top]:
+        lines.append('%.3f\t%.3f\t%s' % (totals[module], owns[module], module))
+    lines.append('')
+    lines.append('Collapsed stacks: %s' % os.path.join(outdir, STACKS))
+    return lines + ['']
@@ -0,0 +1,393 @@
+# coding:utf-8
+"""Read-only HTTP query service over evaluation results.
+
+Endpoints, all parameters are query string, dates are YYYY-MM-DD:
+    /stations?system=&type=&date=
+    /metrics?station=&system=&type=&start=&end=
+        per day report rows of station.
+    /summary?station=&system=&type=&start=&end=
+        statistics of duration merged from daily sketches.
+    /outages?station=&system=&type=&date=[&gap=60]
+        windows without epochs, seconds of day.
+    /series?station=&system=&type=&date=[&start=0&end=86400&step=1]
+        U, N, E series slice.
+"""
+
+import os
+import json
+import time
+import datetime
+import threading
+import numpy as np
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from urllib.request import urlopen
+from urllib.error import HTTPError
+import readdata
+import statistic
+import convergence
+
+PORT = 8086
+CACHESIZE = 256  # cached query responses
+DATASIZE = 64  # cached reports, sketches and series
+TTL = 60  # seconds a cached response is valid
+
+
+class QueryError(Exception):
+    """Query error with HTTP status."""
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class LRUCache(object):
+    """Thread safe least recently used cache.
+
+    Attributes:
+        maxsize:max number of items.
+        ttl:seconds an item is valid, 0 is always valid.
+        hits:number of hits.
+        misses:number of misses.
+    """
+
+    def __init__(self, maxsize, ttl=0):
+        """Initialize LRUCache."""
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return cached value of key, if not find, return None."""
+        with self.lock:
+            item = self.items.get(key)
+            if item is None or (self.ttl and
+                                time.time() - item[1] > self.ttl):
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value):
+        """Cache value of key."""
+        with self.lock:
+            self.items[key] = (value, time.time())
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+
+class Query(object):
+    """Query evaluation results.
+
+    Reports and sketches are cached by file path and mtime, so updated
+    results are read again. Parsed station series are cached by station,
+    system, type and date.
+
+    Attributes:
+        respath:result path.
+        endoutput:coor file path of (system, type), type:dict.
+        window:(start, end) seconds of day of results, None is whole day.
+    """
+
+    def __init__(self, respath, endoutput, gsystem, ctype, window=None):
+        """Initialize Query."""
+        self.respath = respath
+        self.window = window
+        self.endoutput = dict(
+            ((system, type_), path)
+            for path, system, type_ in zip(endoutput, gsystem, ctype))
+        self.data = LRUCache(DATASIZE)
+        self.read_coor = readdata.Read()
+
+    def _cached(self, filepath, reader):
+        """Return file content read by reader, cached by path and mtime."""
+        try:
+            mtime = os.path.getmtime(filepath)
+        except OSError:
+            return None
+        key = ('file', filepath, mtime)
+        content = self.data.get(key)
+        if content is None:
+            content = reader(filepath)
+            self.data.put(key, content)
+        return content
+
+    def report(self, gsystem, ctype, date):
+        """Return report of date, if not find, return None."""
+        filepath = os.path.join(
+            self.respath, str(date), '-'.join([ctype, gsystem]), '-'.join(
+                [ctype, gsystem, str(date), 'report.csv']))
+        # cached by the npz columns or csv which is actually read
+        path = statistic.reportsource(filepath)
+        if path is None:
+            return None
+        return self._cached(
+            path, lambda path: statistic.readreport(path).set_index('name'))
+
+    def sketch(self, gsystem, ctype, date):
+        """Return statistics sketches of date, if not find, return None."""
+        filepath = os.path.join(self.respath, str(date), '-'.join(
+            [ctype, gsystem]), statistic.sketchname(ctype, gsystem, date))
+        return self._cached(filepath, statistic.loadsketch)
+
+    def series(self, station, gsystem, ctype, date):
+        """Return U, N, E series of station, if not find, return None."""
+        key = ('series', station, gsystem, ctype, str(date))
+        data = self.data.get(key)
+        if data is False:
+            return None
+        if data is None:
+            filepath = self.endoutput.get((gsystem, ctype))
+            if filepath is None:
+                raise QueryError(404, '%s-%s is not configured' %
+                                 (ctype, gsystem))
+            store = self.read_coor.readseries(
+                filepath, date, stations=[station], window=self.window)
+            if store is None or station not in store:
+                # missing series is cached too
+                self.data.put(key, False)
+                return None
+            data = store.get(station)
+            order = np.argsort(data.time, kind='mergesort')
+            data = data._replace(
+                **dict((field, getattr(data, field)[order])
+                       for field in data._fields))
+            self.data.put(key, data)
+        return data
+
+    def stations(self, params):
+        gsystem, ctype = _system(params)
+        report = self.report(gsystem, ctype, _date(params, 'date'))
+        if report is None:
+            raise QueryError(404, 'report not found')
+        return {'stations': report.index.tolist()}
+
+    def metrics(self, params):
+        station = _param(params, 'station')
+        gsystem, ctype = _system(params)
+        rows = list()
+        for date in _dates(params):
+            report = self.report(gsystem, ctype, date)
+            if report is None or station not in report.index:
+                continue
+            row = OrderedDict([('date', str(date))])
+            row.update(_jsonable(report.loc[station].to_dict()))
+            rows.append(row)
+        return {'station': station, 'metrics': rows}
+
+    def summary(self, params):
+        station = _param(params, 'station')
+        gsystem, ctype = _system(params)
+        dates = list(_dates(params))
+        merged = None
+        days = 0
+        for date in dates:
+            sketches = self.sketch(gsystem, ctype, date)
+            if not sketches or station not in sketches:
+                continue
+            # cached sketch is not changed by merge
+            stats = statistic.UNEHStats.fromdict(sketches[station].todict())
+            if merged is None:
+                merged = stats
+            else:
+                merged.merge(stats)
+            days += 1
+        if merged is None:
+            raise QueryError(404, 'sketch not found')
+        result = merged.result(
+            readdata.windowlength(self.window) * len(dates))
+        return {
+            'station': station,
+            'start': str(dates[0]),
+            'end': str(dates[-1]),
+            'days': days,
+            'summary': _jsonable(result)
+        }
+
+    def outages(self, params):
+        station = _param(params, 'station')
+        gsystem, ctype = _system(params)
+        date = _date(params, 'date')
+        gap = int(params.get('gap', [convergence.GAP])[0])
+        data = self.series(station, gsystem, ctype, date)
+        if data is None:
+            raise QueryError(404, 'series not found')
+        epochs = np.concatenate([[-1], data.time.astype(np.int64), [86400]])
+        index = np.flatnonzero(np.diff(epochs) > gap)
+        windows = [[int(epochs[i] + 1), int(epochs[i + 1])] for i in index]
+        return {
+            'station': station,
+            'date': str(date),
+            'gap': gap,
+            'outages': windows,
+            'seconds': int(sum(end - start for start, end in windows))
+        }
+
+    def slice(self, params):
+        station = _param(params, 'station')
+        gsystem, ctype = _system(params)
+        date = _date(params, 'date')
+        start = int(params.get('start', [0])[0])
+        end = int(params.get('end', [86400])[0])
+        step = max(1, int(params.get('step', [1])[0]))
+        data = self.series(station, gsystem, ctype, date)
+        if data is None:
+            raise QueryError(404, 'series not found')
+        first, last = np.searchsorted(data.time, [start, end])
+        result = OrderedDict([('station', station), ('date', str(date))])
+        for field in data._fields:
+            values = getattr(data, field)[first:last:step]
+            result[field] = [
+                None if not np.isfinite(value) else round(float(value), 4)
+                for value in values
+            ] if field != 'time' else values.tolist()
+        return result
+
+
+def _param(params, name):
+    if name not in params:
+        raise QueryError(400, 'missing parameter %s' % name)
+    return params[name][0]
+
+
+def _system(params):
+    return _param(params, 'system').upper(), _param(params, 'type').upper()
+
+
+def _date(params, name):
+    try:
+        return datetime.datetime.strptime(_param(params, name),
+                                          '%Y-%m-%d').date()
+    except ValueError:
+        raise QueryError(400, 'invalid %s' % name)
+
+
+def _dates(params):
+    start = _date(params, 'start')
+    end = _date(params, 'end') if 'end' in params else start
+    if end < start or (end - start).days > 3660:
+        raise QueryError(400, 'invalid duration')
+    for i in range((end - start).days + 1):
+        yield start + datetime.timedelta(i)
+
+
+def _jsonable(row):
+    """Convert numpy values and nan of row to json values."""
+    result = OrderedDict()
+    for key, value in row.items():
+        if isinstance(value, (np.integer, )):
+            value = int(value)
+        elif isinstance(value, (float, np.floating)):
+            value = None if not np.isfinite(value) else float(value)
+        result[key] = value
+    return result
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Handle GET request of query server."""
+
+    routes = {
+        '/stations': 'stations',
+        '/metrics': 'metrics',
+        '/summary': 'summary',
+        '/outages': 'outages',
+        '/series': 'slice'
+    }
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        key = (url.path, url.query)
+        body = self.server.responses.get(key)
+        status = 200
+        if body is None:
+            try:
+                if url.path not in self.routes:
+                    raise QueryError(404, 'unknown path %s' % url.path)
+                method = getattr(self.server.query, self.routes[url.path])
+                body = json.dumps(method(parse_qs(url.query))).encode('utf-8')
+                self.server.responses.put(key, body)
+            except QueryError as e:
+                status = e.status
+                body = json.dumps({'error': str(e)}).encode('utf-8')
+            except Exception as e:
+                status = 500
+                body = json.dumps({'error': str(e)}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def makeserver(query, host='127.0.0.1', port=PORT):
+    """Return threading HTTP server of query.
+
+    Args:
+        query:query of results, type:Query.
+        host:listen host.
+        port:listen port, 0 is any free port.
+    """
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.query = query
+    server.responses = LRUCache(CACHESIZE, TTL)
+    return server
+
+
+def benchmark(baseurl, paths, threads=8, requests=400):
+    """Measure latency of query paths under parallel load.
+
+    Args:
+        baseurl:server url, e.g. http://127.0.0.1:8086.
+        paths:query paths with query string, requested in turn.
+        threads:parallel clients.
+        requests:total requests.
+
+    Return:
+        result:requests, errors, seconds, throughput and latency
+            percentiles in ms, type:OrderedDict.
+    """
+    latencies = list()
+    errors = [0]
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def client():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.time()
+            try:
+                urlopen(baseurl + paths[i % len(paths)]).read()
+            except (HTTPError, IOError):
+                with lock:
+                    errors[0] += 1
+            with lock:
+                latencies.append(time.time() - start)
+
+    start = time.time()
+    workers = [threading.Thread(target=client) for _ in range(threads)]
+    [worker.start() for worker in workers]
+    [worker.join() for worker in workers]
+    seconds = time.time() - start
+    latencies = np.array(latencies) * 1000
+    result = OrderedDict()
+    result['requests'] = requests
+    result['errors'] = errors[0]
+    result['seconds'] = seconds
+    result['throughput'] = requests / seconds
+    for q in [50, 95, 99]:
+        result['p%d_ms' % q] = np.percentile(latencies, q)
+    result['max_ms'] = latencies.max()
+    return result
@@ -3,105 +3,154 @@
 
 import sys
 import os
-import glob
 import re
 import datetime
 import pandas as pd
 import numpy as np
-from collections import defaultdict, OrderedDict
+from collections import defaultdict, OrderedDict, namedtuple
+import functools
+import catalog
+import archive
+import epochindex
+import statistic
+import convergence
+from series import SeriesStore
+
+CHUNKSIZE = 100000
+
+CorrData = namedtuple('CorrData', ('system', 'hours', 'satnum', 'prns',
+                                   'iode', 'do_r', 'do_c', 'do_a', 'clock'))
 
 
 class Read(object):
-    """Read data."""
+    """Read data.
+
+    Attributes:
+        chunksize:rows of each read chunk of coor file.
+        maxrows:rows of stored values of exact statistics, 0 is unlimited.
+    """
+
+    def __init__(self, chunksize=CHUNKSIZE, maxrows=0):
+        """Initialize Read."""
+        self.chunksize = chunksize
+        self.maxrows = maxrows
 
-    def readcoor(self, filepath, date):
+    def readcoor(self, filepath, date, exact=True, stats=None, ctype=None,
+                 series=None, window=None):
         """Read coor file and produce report.
 
         Read coor file and calculate 'U_rms', 'N_rms', 'E_rms', 'H_rms',
-        'U_95', 'N_95', 'E_95', 'H_95', 'effective_rate'.
+        'U_95', 'N_95', 'E_95', 'H_95', 'effective_rate', if ctype is given,
+        also calculate convergence 'H_conv', 'V_conv', 'reconv',
+        'reconv_time', 'conv_rate' in the same pass.
 
         Args:
             filepath:coor files store path.
             date:coor file's date, type:datetime
+            exact:exact 95% value or sketch 95% value, type:bool.
+            stats:if not None, store sketch statistics of stations in it,
+                type:dict, key:station name, value:statistic.UNEHStats.
+            ctype:calculate type for convergence threshold.
+            series:if not None, store U, N, E series of stations in it,
+                type:series.SeriesStore, key:station name.
+            window:(start, end) seconds of day, only epochs in window are
+                evaluated and effective rate is normalized to window length,
+                None is whole day.
 
         Returns:
             report:UNETH report, type:pandas.Dataframe.
         """
-        doy = date.timetuple().tm_yday
-        filelist = glob.glob(
-            os.path.join(filepath, ''.join(
-                ['*', '{:0>3d}.{:0>2d}'.format(doy, date.year % 100), 'coor'])))
+        filelist = catalog.getcatalog().coorfiles(filepath, date)
         if not filelist:
             print("Can't find %s's coor file in %s" % (str(date), filepath))
             return None
 
         report = defaultdict(list)
+        collector = convergence.Collector()
         refname = re.compile(r'(\w+)\d{3}\.\d{2}coor')
         for path in filelist:
             station = refname.findall(path)[0]
             report['name'].append(station)
-            try:
-                data = pd.read_table(
-                    path, delim_whitespace=True).apply(
-                        pd.to_numeric, errors='coerce')
-                if 'U' not in data or 'N' not in data or 'E' not in data:
-                    raise ValueError
-            except:
-                report['U_rms'].append(0)
-                report['N_rms'].append(0)
-                report['E_rms'].append(0)
-                report['H_rms'].append(0)
-                report['U_95'].append(0)
-                report['N_95'].append(0)
-                report['E_95'].append(0)
-                report['H_95'].append(0)
-                report['effective_rate'].append(0)
-                continue
-            num = data.shape[0]
-            if num == 0:
-                report['U_rms'].append(0)
-                report['N_rms'].append(0)
-                report['E_rms'].append(0)
-                report['H_rms'].append(0)
-                report['U_95'].append(0)
-                report['N_95'].append(0)
-                report['E_95'].append(0)
-                report['H_95'].append(0)
-                report['effective_rate'].append(0)
-                continue
+            collects = list()
+            if ctype:
+                collects.append(functools.partial(collector.update, station))
+            if series is not None:
+                collects.append(functools.partial(series.appendframe, station))
+            station_stats = readcoorstats(
+                path, exact, self.chunksize,
+                collect=lambda data: [c(data) for c in collects],
+                date=date, window=window, maxrows=self.maxrows)
+            if not station_stats:
+                # chunks collected before the read failed are dropped
+                collector.discard(station)
+                if series is not None:
+                    series.discard(station)
+                result = statistic.empty()
+            else:
+                result = station_stats.result(windowlength(window))
+                if stats is not None:
+                    station_stats.compact()
+                    stats[station] = station_stats
+            for col in result:
+                report[col].append(result[col])
 
-            threshold_index = int(num * 0.95)
-            u_rms = np.sqrt(data.U.pow(2).sum() / num)
-            n_rms = np.sqrt(data.N.pow(2).sum() / num)
-            e_rms = np.sqrt(data.E.pow(2).sum() / num)
-            report['U_rms'].append(u_rms)
-            report['N_rms'].append(n_rms)
-            report['E_rms'].append(e_rms)
-            data_H = np.sqrt((data.N.pow(2) + data.E.pow(2)))
-            report['H_rms'].append(np.sqrt(data_H.pow(2).sum() / num))
-            report['U_95'].append(data.U.abs().sort_values().iloc[
-                threshold_index])
-            report['N_95'].append(data.N.abs().sort_values().iloc[
-                threshold_index])
-            report['E_95'].append(data.E.abs().sort_values().iloc[
-                threshold_index])
-            report['H_95'].append(data_H.abs().sort_values().iloc[
-                threshold_index])
-            report['effective_rate'].append(num / 86400.0)
-
-        cols = [
-            'name', 'U_rms', 'N_rms', 'E_rms', 'H_rms', 'U_95', 'N_95', 'E_95',
-            'H_95', 'effective_rate'
-        ]
+        cols = ['name'] + statistic.COLUMNS
+        if ctype:
+            addconvergence(report, collector.analyse(ctype))
+            cols += convergence.COLUMNS
         report = pd.DataFrame(report, columns=cols).sort_values('name')
         return report
 
-    def readsatnum(self, filepath, date):
+    def readseries(self, filepath, date, columns=('U', 'N', 'E'),
+                   stations=None, window=None):
+        """Read series of all stations, only ws and columns are parsed.
+
+        Args:
+            filepath:coor files store path.
+            date:coor file's date, type:datetime.
+            columns:stored columns.
+            stations:if not None, only read these stations.
+            window:(start, end) seconds of day, None is whole day.
+
+        Return:
+            series:series of stations, epochs with invalid value are not
+                stored, type:series.SeriesStore, if not find coor file,
+                return None.
+        """
+        filelist = catalog.getcatalog().coorfiles(filepath, date)
+        if not filelist:
+            print("Can't find %s's coor file in %s" % (str(date), filepath))
+            return None
+        series = SeriesStore(columns)
+        names = ['ws'] + list(columns)
+        refname = re.compile(r'(\w+)\d{3}\.\d{2}coor')
+        for path in filelist:
+            station = refname.findall(path)[0]
+            if stations is not None and station not in stations:
+                continue
+            try:
+                with opencoor(path, date, window) as f:
+                    for data in pd.read_table(
+                            f,
+                            delim_whitespace=True,
+                            usecols=lambda col: col in names,
+                            chunksize=self.chunksize):
+                        data = data.apply(
+                            pd.to_numeric, errors='coerce').dropna()
+                        series.appendframe(station,
+                                           selectwindow(data, window))
+            except:
+                series.discard(station)
+                print('Read %s failed!' % path)
+        return series
+
+    def readsatnum(self, filepath, date, window=None):
         """Read satellite number of corr file.
 
         Args:
             filepath:correct file store path.
             date:correct file date, type:datetime.
+            window:(start, end) seconds of day, None is whole day.
 
         Return:
             sat_num:correct file satellite number data, type:dict.
@@ -110,28 +159,29 @@ class Read(object):
         # retrieve coorect files
         bds_corr = ''.join(['CorrBDS', date_s, '.txt'])
         gps_corr = ''.join(['CorrGPS', date_s, '.txt'])
-        bds_files = glob.glob(os.path.join(filepath, bds_corr))
-        gps_files = glob.glob(os.path.join(filepath, gps_corr))
-        if not bds_files:
+        bds_file = catalog.getcatalog().corrfile(filepath, 'BDS', date)
+        gps_file = catalog.getcatalog().corrfile(filepath, 'GPS', date)
+        if not bds_file:
             print('Not find %s in %s' % (bds_corr, filepath))
-        if not gps_files:
+        if not gps_file:
             print('Not find %s in %s' % (gps_corr, filepath))
         # start read
         sat_num = dict()
-        for path in bds_files:
-            sat_num['BDS'] = readSatNum(path, date, 'BDS')
-        for path in gps_files:
-            sat_num['GPS'] = readSatNum(path, date, 'GPS')
+        if bds_file:
+            sat_num['BDS'] = readSatNum(bds_file, date, 'BDS', window)
+        if gps_file:
+            sat_num['GPS'] = readSatNum(gps_file, date, 'GPS', window)
 
         return sat_num
 
-    def readsatiode(self, filepath, date, prn):
+    def readsatiode(self, filepath, date, prn, window=None):
         """Read satellite iode.
 
         Args:
             filepath:correct file store path.
             date:correct file date, type:datetime.
             prn:satellite prn.
+            window:(start, end) seconds of day, None is whole day.
         Return:
             satiode:satellite iode, type:OrderedDict.
         """
@@ -139,22 +189,22 @@ class Read(object):
         gsystem = 'GPS' if prn[0] == 'G' else 'BDS'
         correct_fname = ''.join(
             ['Corr', gsystem, ''.join(str(date).split('-')), '.txt'])
-        correct_file = os.path.join(filepath, correct_fname)
+        correct_file = catalog.getcatalog().corrfile(filepath, gsystem, date)
         # start read
-        if not os.path.exists(correct_file):
+        if not correct_file:
             print('Not find %s in %s' % (correct_fname, filepath))
             return None
         satiode = OrderedDict()
         day_flag = (date.timetuple().tm_wday + 1) % 7
         hour = 0
         readiode = False
-        with open(correct_file) as f:
+        with opencorr(correct_file, date, gsystem, window) as f:
             for line in f:
                 if line.startswith(gsystem):
                     time = int(line.split()[2])
                     day = datetime.timedelta(seconds=time).days
                     # convert week seconds to hour
-                    if day_flag == day:
+                    if day_flag == day and inwindow(time % 86400, window):
                         hour = datetime.timedelta(seconds=time).seconds / 3600.
                         readiode = True
                     else:
@@ -163,13 +213,14 @@ class Read(object):
                     satiode[hour] = int(line.split()[1])
         return satiode
 
-    def readorbitc(self, filepath, date, prn):
+    def readorbitc(self, filepath, date, prn, window=None):
         """Read orbit and clock errors.
 
         Args:
             filepath:correct file store path.
             date:correct file date.
             prn:satellite prn.
+            window:(start, end) seconds of day, None is whole day.
 
         Return:
             orbitc:orbit errors and clock errors, type:pd.DataFrame.
@@ -178,9 +229,9 @@ class Read(object):
         gsystem = 'GPS' if prn[0] == 'G' else 'BDS'
         correct_fname = ''.join(
             ['Corr', gsystem, ''.join(str(date).split('-')), '.txt'])
-        correct_file = os.path.join(filepath, correct_fname)
+        correct_file = catalog.getcatalog().corrfile(filepath, gsystem, date)
         # start read
-        if not os.path.exists(correct_file):
+        if not correct_file:
             print('Not find %s in %s' % (correct_fname, filepath))
             return None
 
@@ -188,12 +239,12 @@ class Read(object):
         day_flag = (date.timetuple().tm_wday + 1) % 7
         hour = 0
         readorbit = False
-        with open(correct_file) as f:
+        with opencorr(correct_file, date, gsystem, window) as f:
             for line in f:
                 if line.startswith(gsystem):
                     time = int(line.split()[2])
                     day = datetime.timedelta(seconds=time).days
-                    if day_flag == day:
+                    if day_flag == day and inwindow(time % 86400, window):
                         hour = datetime.timedelta(seconds=time).seconds / 3600.
                         readorbit = True
                     else:
@@ -209,28 +260,190 @@ class Read(object):
         orbitc = pd.DataFrame(orbitc, columns=cols)
         return orbitc
 
+    def readcorr(self, filepath, date, gsystem, window=None):
+        """Read all satellites of correct file in one pass.
+
+        Args:
+            filepath:correct file store path.
+            date:correct file date.
+            gsystem:GNSS system, BDS or GPS.
+            window:(start, end) seconds of day, None is whole day.
+
+        Return:
+            corr:correct data, iode, do_r, do_c, do_a and clock are PRN x
+                epoch arrays, missing value is nan, type:CorrData.
+        """
+        correct_fname = ''.join(
+            ['Corr', gsystem, ''.join(str(date).split('-')), '.txt'])
+        correct_file = catalog.getcatalog().corrfile(filepath, gsystem, date)
+        if not correct_file:
+            print('Not find %s in %s' % (correct_fname, filepath))
+            return None
+
+        letter = 'G' if gsystem == 'GPS' else 'C'
+        day_flag = (date.timetuple().tm_wday + 1) % 7
+        hours = list()
+        satnum = list()
+        epochs = list()
+        prns = list()
+        values = list()
+        readcorr = False
+        with opencorr(correct_file, date, gsystem, window) as f:
+            for line in f:
+                if line.startswith(gsystem):
+                    line_s = line.split()
+                    time = int(line_s[2])
+                    readcorr = (datetime.timedelta(seconds=time).days ==
+                                day_flag and inwindow(time % 86400, window))
+                    if readcorr:
+                        hours.append(
+                            datetime.timedelta(seconds=time).seconds / 3600.)
+                        satnum.append(int(line_s[1]))
+                elif readcorr and line.startswith(letter) and line[1:3].isdigit():
+                    line_s = line.split()
+                    epochs.append(len(hours) - 1)
+                    prns.append(line_s[0])
+                    values.append(line_s[1:6])
 
-def readSatNum(filepath, date, gsystem):
+        prn_list, prn_index = np.unique(
+            np.array(prns, dtype=str), return_inverse=True)
+        epochs = np.array(epochs, dtype=np.int64)
+        values = np.array(values, dtype=np.float64).reshape(-1, 5)
+        matrix = list()
+        for i in range(5):
+            data = np.full((len(prn_list), len(hours)), np.nan)
+            data[prn_index, epochs] = values[:, i]
+            matrix.append(data)
+        return CorrData(gsystem, np.array(hours), np.array(satnum),
+                        prn_list.tolist(), *matrix)
+
+
+def readSatNum(filepath, date, gsystem, window=None):
     """Read satellite number of correct file.
 
     Args:
         filepath:coorect filepath.
         date:file date.
         gsystem:GNSS system.
+        window:(start, end) seconds of day, None is whole day.
 
     Return:
         sat_num:satellite number, type:OrderedDict.
     """
     sat_num = OrderedDict()
     day_flag = (date.timetuple().tm_wday + 1) % 7
-    with open(filepath) as f:
+    with opencorr(filepath, date, gsystem, window) as f:
         for line in f:
             if line.startswith(gsystem):
                 satnum = int(line.split()[1])
                 sattime = int(line.split()[2])
                 # convert week seconds to hour
                 day = datetime.timedelta(seconds=sattime).days
-                if day == day_flag:
+                if day == day_flag and inwindow(sattime % 86400, window):
                     hour = datetime.timedelta(seconds=sattime).seconds / 3600.0
                     sat_num[hour] = satnum
     return sat_num
+
+
+def readcoorstats(filepath, exact=True, chunksize=None, collect=None,
+                  date=None, window=None, maxrows=0):
+    """Read coor file by chunks and accumulate UNEH statistics.
+
+    Args:
+        filepath:coor filepath.
+        exact:exact 95% value or sketch 95% value, type:bool.
+        chunksize:rows of each chunk, default CHUNKSIZE.
+        collect:if not None, called with every chunk, type:function.
+        date:coor file date, needed by window.
+        window:(start, end) seconds of day, None is whole day.
+        maxrows:rows of stored values of exact statistics, 0 is unlimited.
+
+    Return:
+        stats:UNEH statistics, type:statistic.UNEHStats, if coor file is
+            invalid, return None.
+    """
+    stats = statistic.UNEHStats(exact, maxrows=maxrows)
+    try:
+        with opencoor(filepath, date, window) as f:
+            for data in pd.read_table(
+                    f, delim_whitespace=True,
+                    chunksize=chunksize or CHUNKSIZE):
+                data = data.apply(pd.to_numeric, errors='coerce')
+                if 'U' not in data or 'N' not in data or 'E' not in data:
+                    raise ValueError
+                data = selectwindow(data, window)
+                stats.update(data)
+                if collect:
+                    collect(data)
+    except:
+        return None
+    return stats
+
+
+def addconvergence(report, result):
+    """Add convergence columns to report.
+
+    Args:
+        report:report, type:dict, key:column, value:list.
+        result:convergence of stations produced by
+            convergence.Collector.analyse.
+    """
+    for name in report['name']:
+        station = result.get(name, convergence.empty())
+        for col in convergence.COLUMNS:
+            report[col].append(station[col])
+
+
+def windowname(window):
+    """Return name of time window, e.g. 0800-1200, whole day is None."""
+    if window is None:
+        return None
+    return '-'.join('%02d%02d' % (seconds // 3600, seconds % 3600 // 60)
+                    for seconds in window)
+
+
+def windowlength(window):
+    """Return seconds of time window, whole day is 86400."""
+    return 86400.0 if window is None else float(window[1] - window[0])
+
+
+def inwindow(seconds, window):
+    """Return True if seconds of day is in window, works on arrays."""
+    if window is None:
+        return True
+    return (seconds >= window[0]) & (seconds < window[1])
+
+
+def selectwindow(data, window):
+    """Return rows of coor data whose epoch is in window."""
+    if window is None:
+        return data
+    return data[inwindow(data.ws % 86400, window)]
+
+
+def _weekseconds(date, window):
+    """Return week seconds of window of date."""
+    day = (date.timetuple().tm_wday + 1) % 7 * 86400
+    return day + window[0], day + window[1]
+
+
+def opencoor(filepath, date=None, window=None):
+    """Open coor file, only indexed rows covering window are read.
+
+    Rows out of window may be in stream, use selectwindow.
+    """
+    if window is None:
+        return archive.openfile(filepath)
+    start, end = _weekseconds(date, window)
+    return epochindex.getindex().open(filepath, start, end)
+
+
+def opencorr(filepath, date, gsystem, window=None):
+    """Open corr file, only indexed epochs covering window are read.
+
+    Epochs out of window may be in stream, use inwindow.
+    """
+    if window is None:
+        return archive.openfile(filepath)
+    start, end = _weekseconds(date, window)
+    return epochindex.getindex().open(filepath, start, end, gsystem)
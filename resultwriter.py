@@ -0,0 +1,231 @@
+# coding:utf-8
+"""Result writer, write result files atomically and list them.
+
+Every file is written to a temporary file in its directory and renamed to
+its path, so readers see the old or the new file, never a partial one.
+Created directories are cached, appends are buffered and written by one
+append of every file at flush. Written files are listed in the artifact
+manifest of result path, consumers read files of a run from the manifest
+instead of globbing result path.
+"""
+
+import os
+import threading
+import contextlib
+import numpy as np
+from collections import OrderedDict
+
+MANIFEST = 'artifacts.csv'
+# artifact kind of file extension
+KINDS = {
+    '.csv': 'table',
+    '.png': 'figure',
+    '.json': 'json',
+    '.npz': 'array',
+    '.txt': 'text',
+    '.bin': 'data'
+}
+
+_writer = None
+
+
+class ResultWriter(object):
+    """Atomic result writer.
+
+    Attributes:
+        dirs:created directories, type:set.
+        appends:buffered appends, type:OrderedDict, key:file path,
+            value:[header, texts].
+        artifacts:written files, type:OrderedDict, key:file path,
+            value:kind.
+    """
+
+    def __init__(self):
+        """Initialize ResultWriter."""
+        self.dirs = set()
+        self.appends = OrderedDict()
+        self.artifacts = OrderedDict()
+        self.lock = threading.Lock()
+
+    def makedirs(self, path):
+        """Make directory if it is not made by this writer."""
+        if path in self.dirs:
+            return
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                # made by parallel process
+                if not os.path.isdir(path):
+                    raise
+        self.dirs.add(path)
+
+    @contextlib.contextmanager
+    def open(self, filepath, mode='w', kind=None):
+        """Open temporary file which is renamed to file path at close.
+
+        If writing fails, temporary file is removed and file path is not
+        changed.
+
+        Args:
+            filepath:result file path.
+            mode:'w' or 'wb'.
+            kind:artifact kind, default by file extension.
+        """
+        dirname = os.path.dirname(filepath)
+        self.makedirs(dirname)
+        temp = os.path.join(dirname, '.%s.%d.%d.tmp' % (os.path.basename(
+            filepath), os.getpid(), threading.current_thread().ident))
+        try:
+            try:
+                f = open(temp, mode)
+            except (IOError, OSError):
+                # cached directory is removed, e.g. published staging
+                self.dirs.discard(dirname)
+                self.makedirs(dirname)
+                f = open(temp, mode)
+            with f:
+                yield f
+            os.replace(temp, filepath)
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+        self.record(filepath, kind)
+
+    def tocsv(self, table, filepath, **kwargs):
+        """Write table as csv, kwargs are passed to DataFrame.to_csv."""
+        with self.open(filepath) as f:
+            table.to_csv(f, **kwargs)
+
+    def savefig(self, figure, filepath, **kwargs):
+        """Save matplotlib figure, png is added to path without extension.
+
+        Args:
+            figure:figure, e.g. plt.gcf().
+            filepath:figure path.
+            kwargs:passed to figure.savefig.
+        """
+        extension = os.path.splitext(filepath)[1]
+        if not extension:
+            extension = '.png'
+            filepath += extension
+        with self.open(filepath, 'wb') as f:
+            figure.savefig(f, format=extension[1:], **kwargs)
+        return filepath
+
+    def savetext(self, text, filepath):
+        """Write text file."""
+        with self.open(filepath) as f:
+            f.write(text)
+
+    def savez(self, filepath, **arrays):
+        """Write arrays as compressed npz file."""
+        with self.open(filepath, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+
+    def append(self, filepath, text, header=''):
+        """Buffer text appended to file until flush.
+
+        Args:
+            filepath:file path.
+            text:appended text.
+            header:written before texts if file not exists at flush.
+        """
+        with self.lock:
+            if filepath not in self.appends:
+                self.appends[filepath] = [header, list()]
+            self.appends[filepath][1].append(text)
+
+    def record(self, filepath, kind=None):
+        """Record written file in artifacts."""
+        if kind is None:
+            kind = KINDS.get(os.path.splitext(filepath)[1], 'file')
+        with self.lock:
+            self.artifacts[os.path.abspath(filepath)] = kind
+
+    def flush(self, respath=None, runid=None, manifestdir=None):
+        """Write buffered appends and artifact manifest.
+
+        Every file is written by one append, lines of parallel processes do
+        not mix.
+
+        Args:
+            respath:result path, artifacts under it are listed in its
+                manifest by relative path, None is not listed. Artifacts
+                out of it are kept for flush of their result path.
+            runid:run id of artifacts.
+            manifestdir:directory of manifest, default respath, e.g. result
+                path of a staging result path.
+        """
+        with self.lock:
+            appends = self.appends
+            self.appends = OrderedDict()
+        for filepath, (header, texts) in appends.items():
+            self.makedirs(os.path.dirname(filepath))
+            if not os.path.isfile(filepath):
+                texts.insert(0, header)
+            with open(filepath, 'a') as f:
+                f.write(''.join(texts))
+            self.record(filepath)
+        if respath is None:
+            return
+        root = os.path.abspath(respath)
+        with self.lock:
+            artifacts = self.artifacts
+            self.artifacts = OrderedDict(
+                (filepath, kind) for filepath, kind in artifacts.items()
+                if not filepath.startswith(root + os.sep))
+        lines = [
+            '%s\t%s\t%s\n' % (runid, kind, os.path.relpath(filepath, root))
+            for filepath, kind in artifacts.items()
+            if filepath.startswith(root + os.sep)
+        ]
+        if not lines:
+            return
+        manifestdir = manifestdir or root
+        manifest = os.path.join(manifestdir, MANIFEST)
+        header = not os.path.isfile(manifest)
+        self.makedirs(manifestdir)
+        with open(manifest, 'a') as f:
+            f.write(('run\tkind\tpath\n' if header else '') + ''.join(lines))
+
+
+def artifacts(respath, runid=None, kind=None):
+    """Return artifacts of result path listed in manifest.
+
+    Args:
+        respath:result path.
+        runid:run id, None is all runs.
+        kind:artifact kind, None is all kinds.
+
+    Return:
+        filepaths:artifact paths of existing files, the latest record of a
+            file is kept, type:list.
+    """
+    manifest = os.path.join(respath, MANIFEST)
+    if not os.path.isfile(manifest):
+        return list()
+    filepaths = OrderedDict()
+    with open(manifest) as f:
+        next(f, None)
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) != 3:
+                continue
+            if runid is not None and fields[0] != runid:
+                continue
+            if kind is not None and fields[1] != kind:
+                continue
+            filepath = os.path.join(respath, fields[2])
+            filepaths.pop(filepath, None)
+            filepaths[filepath] = True
+    return [filepath for filepath in filepaths if os.path.isfile(filepath)]
+
+
+def getwriter():
+    """Return result writer shared by the process."""
+    global _writer
+    if _writer is None:
+        _writer = ResultWriter()
+    return _writer
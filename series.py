@@ -0,0 +1,151 @@
+# coding:utf-8
+"""Compact columnar store of station series."""
+
+import numpy as np
+from collections import namedtuple, OrderedDict
+
+
+class SeriesStore(object):
+    """Columnar store of station series.
+
+    Series of all stations share one array per column, a station is a
+    contiguous slice of rows. Only needed columns are stored, values use
+    configurable dtype and time is int32 seconds of day.
+
+    Attributes:
+        columns:stored columns, type:list.
+        dtype:dtype of columns, default float32.
+        time:seconds of day, type:numpy.ndarray, dtype:int32.
+        data:column arrays, type:dict, key:column.
+        slices:rows of series, type:OrderedDict, key:series key, e.g.
+            station name or (date, station), value:(start, end).
+        size:number of rows.
+        period:time is stored modulo period seconds, None is not.
+    """
+
+    def __init__(self, columns=('U', 'N', 'E'), dtype=np.float32,
+                 capacity=86400, period=86400):
+        """Initialize SeriesStore."""
+        self.columns = list(columns)
+        self.dtype = np.dtype(dtype)
+        self.period = period
+        self.time = np.empty(capacity, dtype=np.int32)
+        self.data = dict(
+            (col, np.empty(capacity, dtype=self.dtype))
+            for col in self.columns)
+        self.slices = OrderedDict()
+        self.size = 0
+        self.view = namedtuple('StationSeries', ['time'] + self.columns)
+        self._last = None
+
+    def _reserve(self, num):
+        """Grow arrays to hold num more rows."""
+        capacity = len(self.time)
+        if self.size + num <= capacity:
+            return
+        capacity = max(capacity * 2, self.size + num)
+        self.time = _grow(self.time, capacity)
+        for col in self.columns:
+            self.data[col] = _grow(self.data[col], capacity)
+
+    def append(self, key, time, columns):
+        """Append rows of series.
+
+        Rows of the same key should be appended one after another.
+
+        Args:
+            key:series key.
+            time:seconds of day or week seconds, type:numpy.ndarray.
+            columns:column values, type:dict or pandas.DataFrame.
+        """
+        if key in self.slices and key != self._last:
+            raise ValueError('Series %s is not contiguous' % (key, ))
+        num = len(time)
+        self._reserve(num)
+        start, end = self.size, self.size + num
+        time = np.asarray(time)
+        self.time[start:end] = time % self.period if self.period else time
+        for col in self.columns:
+            self.data[col][start:end] = np.asarray(columns[col])
+        if key in self.slices:
+            self.slices[key] = (self.slices[key][0], end)
+        else:
+            self.slices[key] = (start, end)
+        self.size = end
+        self._last = key
+
+    def appendframe(self, key, data):
+        """Append rows of coor data include ws and stored columns.
+
+        Rows whose ws is not finite, e.g. invalid text coerced to NaN, are
+        dropped.
+
+        Args:
+            key:series key.
+            data:coor data, type:pandas.DataFrame.
+        """
+        ws = np.asarray(data.ws, dtype=np.float64)
+        valid = np.isfinite(ws)
+        if not valid.all():
+            data = data[valid]
+            ws = ws[valid]
+        self.append(key, ws.astype(np.int64), data)
+
+    def discard(self, key):
+        """Remove series of key, only the last appended series."""
+        if key not in self.slices:
+            return
+        if key != self._last:
+            raise ValueError('Series %s is not the last series' % (key, ))
+        self.size = self.slices.pop(key)[0]
+        self._last = None
+
+    def get(self, key):
+        """Return series of key as views, if not find, return None.
+
+        Return:
+            series:time and columns, type:namedtuple.
+        """
+        if key not in self.slices:
+            return None
+        start, end = self.slices[key]
+        return self.view(self.time[start:end],
+                         *[self.data[col][start:end] for col in self.columns])
+
+    def __contains__(self, key):
+        return key in self.slices
+
+    def __len__(self):
+        return len(self.slices)
+
+    def keys(self):
+        return list(self.slices)
+
+    def index(self):
+        """Return series index of every row, type:numpy.ndarray."""
+        lengths = [end - start for start, end in self.slices.values()]
+        return np.repeat(np.arange(len(lengths), dtype=np.int32), lengths)
+
+    def arrays(self):
+        """Return time and columns of all rows as views."""
+        return self.view(self.time[:self.size],
+                         *[self.data[col][:self.size]
+                           for col in self.columns])
+
+    def compact(self):
+        """Release unused capacity."""
+        self.time = self.time[:self.size].copy()
+        for col in self.columns:
+            self.data[col] = self.data[col][:self.size].copy()
+
+    @property
+    def nbytes(self):
+        return self.time.nbytes + sum(
+            self.data[col].nbytes for col in self.columns)
+
+
+def _grow(array, capacity):
+    """Return array copy with new capacity."""
+    grown = np.empty(capacity, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
@@ -0,0 +1,390 @@
+# coding:utf-8
+"""Streaming statistics, include UNEH accumulator and quantile sketch."""
+
+import math
+import json
+import os
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+import resultwriter
+
+COMPONENTS = ['U', 'N', 'E', 'H']
+COLUMNS = [
+    'U_rms', 'N_rms', 'E_rms', 'H_rms', 'U_95', 'N_95', 'E_95', 'H_95',
+    'effective_rate'
+]
+
+
+class QuantileSketch(object):
+    """Quantile sketch of absolute values.
+
+    Values are counted in logarithmic buckets, bucket i holds values in
+    (gamma^(i-1), gamma^i], gamma = (1 + accuracy) / (1 - accuracy). Every
+    quantile is returned within accuracy relative error, and two sketches
+    of the same accuracy merge by adding bucket counts.
+
+    Attributes:
+        accuracy:relative accuracy, type:float.
+        count:number of values include nan, type:int.
+        zero:number of values less than min_value, type:int.
+        nan:number of nan values, type:int.
+        buckets:bucket counts, type:dict, key:bucket index, value:count.
+    """
+
+    min_value = 1e-6
+
+    def __init__(self, accuracy=0.005):
+        """Initialize QuantileSketch."""
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.count = 0
+        self.zero = 0
+        self.nan = 0
+        self.buckets = dict()
+
+    def update(self, values):
+        """Add values to sketch.
+
+        Arg:
+            values:values, type:numpy.ndarray.
+        """
+        values = np.abs(np.asarray(values, dtype=np.float64))
+        nan = np.isnan(values)
+        values = values[~nan]
+        small = values < self.min_value
+        self.count += len(nan)
+        self.nan += int(nan.sum())
+        self.zero += int(small.sum())
+        values = values[~small]
+        if not len(values):
+            return
+        index = np.ceil(np.log(values) / self.log_gamma).astype(np.int64)
+        index, counts = np.unique(index, return_counts=True)
+        for i, c in zip(index.tolist(), counts.tolist()):
+            self.buckets[i] = self.buckets.get(i, 0) + c
+
+    def merge(self, other):
+        """Merge other sketch into this sketch."""
+        if other.accuracy != self.accuracy:
+            raise ValueError('Sketch accuracy %s mismatch %s' %
+                             (other.accuracy, self.accuracy))
+        self.count += other.count
+        self.zero += other.zero
+        self.nan += other.nan
+        for i, c in other.buckets.items():
+            self.buckets[i] = self.buckets.get(i, 0) + c
+
+    def quantile(self, q=0.95):
+        """Return value at index int(count * q) of sorted values.
+
+        Nan values are sorted last like pandas sort_values.
+        """
+        if not self.count:
+            return 0
+        rank = int(self.count * q)
+        if rank < self.zero:
+            return 0.0
+        if rank >= self.count - self.nan:
+            return np.nan
+        cumulative = self.zero
+        for i in sorted(self.buckets):
+            cumulative += self.buckets[i]
+            if cumulative > rank:
+                return 2 * self.gamma**i / (self.gamma + 1)
+        return np.nan
+
+    def todict(self):
+        """Convert sketch to dict which can be dumped by json."""
+        return {
+            'accuracy': self.accuracy,
+            'count': self.count,
+            'zero': self.zero,
+            'nan': self.nan,
+            'buckets': [[i, self.buckets[i]] for i in sorted(self.buckets)]
+        }
+
+    @classmethod
+    def fromdict(cls, content):
+        """Create sketch from dict produced by todict."""
+        sketch = cls(content['accuracy'])
+        sketch.count = content['count']
+        sketch.zero = content['zero']
+        sketch.nan = content['nan']
+        sketch.buckets = dict((i, c) for i, c in content['buckets'])
+        return sketch
+
+
+class UNEHStats(object):
+    """One pass U, N, E, H statistics.
+
+    Rows are consumed by chunks, rms is accumulated by sum of squares and
+    95% value is taken from stored absolute values in exact mode, or from
+    QuantileSketch in sketch mode which use constant memory.
+
+    Attributes:
+        exact:store values for exact 95% value, type:bool.
+        maxrows:rows of stored values, exact mode of more rows falls back to
+            sketch mode, 0 is unlimited.
+        count:number of rows, type:int.
+        sumsq:sum of squares, type:dict, key:component.
+        values:absolute values chunks, type:dict, key:component.
+        sketch:quantile sketches, type:dict, key:component.
+    """
+
+    def __init__(self, exact=True, accuracy=0.005, maxrows=0):
+        """Initialize UNEHStats."""
+        self.exact = exact
+        self.maxrows = maxrows
+        self.count = 0
+        self.sumsq = dict((comp, 0.0) for comp in COMPONENTS)
+        self.values = dict((comp, list()) for comp in COMPONENTS)
+        self.sketch = dict(
+            (comp, QuantileSketch(accuracy)) for comp in COMPONENTS)
+
+    def update(self, data):
+        """Add a chunk of coor data.
+
+        Arg:
+            data:coor data include U, N, E columns, type:pandas.DataFrame.
+        """
+        u = np.asarray(data.U, dtype=np.float64)
+        n = np.asarray(data.N, dtype=np.float64)
+        e = np.asarray(data.E, dtype=np.float64)
+        h = np.sqrt(n**2 + e**2)
+        if self.exact and self.maxrows and \
+                self.count + len(u) > self.maxrows:
+            self.compact()
+        for comp, values in zip(COMPONENTS, [u, n, e, h]):
+            self.sumsq[comp] += np.nansum(values**2)
+            if self.exact:
+                self.values[comp].append(np.abs(values))
+            self.sketch[comp].update(values)
+        self.count += len(u)
+
+    def merge(self, other):
+        """Merge other statistics into this statistics."""
+        self.count += other.count
+        for comp in COMPONENTS:
+            self.sumsq[comp] += other.sumsq[comp]
+            self.sketch[comp].merge(other.sketch[comp])
+            self.values[comp].extend(other.values[comp])
+        self.exact = self.exact and other.exact
+
+    def compact(self):
+        """Drop stored values and keep sketches only."""
+        self.exact = False
+        self.values = dict((comp, list()) for comp in COMPONENTS)
+
+    def todict(self):
+        """Convert statistics without stored values to dict."""
+        content = {'count': self.count, 'sumsq': self.sumsq}
+        for comp in COMPONENTS:
+            content[comp] = self.sketch[comp].todict()
+        return content
+
+    @classmethod
+    def fromdict(cls, content):
+        """Create sketch mode statistics from dict produced by todict."""
+        stats = cls(exact=False)
+        stats.count = content['count']
+        stats.sumsq = dict(content['sumsq'])
+        for comp in COMPONENTS:
+            stats.sketch[comp] = QuantileSketch.fromdict(content[comp])
+        return stats
+
+    def rms(self, comp):
+        """Return rms of component."""
+        if not self.count:
+            return 0
+        return np.sqrt(self.sumsq[comp] / self.count)
+
+    def percentile(self, comp, q=0.95):
+        """Return value at index int(count * q) of sorted absolute values."""
+        if not self.count:
+            return 0
+        if not self.exact:
+            return self.sketch[comp].quantile(q)
+        values = np.concatenate(self.values[comp])
+        index = int(self.count * q)
+        return np.partition(values, index)[index]
+
+    def result(self, duration=86400.0):
+        """Return statistics.
+
+        Arg:
+            duration:evaluate duration seconds for effective rate.
+
+        Return:
+            result:'U_rms', 'N_rms', 'E_rms', 'H_rms', 'U_95', 'N_95',
+                'E_95', 'H_95', 'effective_rate', type:OrderedDict.
+        """
+        if not self.count:
+            return empty()
+        result = OrderedDict()
+        for comp in COMPONENTS:
+            result['%s_rms' % comp] = self.rms(comp)
+        for comp in COMPONENTS:
+            result['%s_95' % comp] = self.percentile(comp)
+        result['effective_rate'] = self.count / float(duration)
+        return result
+
+
+def empty():
+    """Return statistics of station without valid data."""
+    return OrderedDict((col, 0) for col in COLUMNS)
+
+
+def sketchname(ctype, gsystem, date):
+    """Return sketch file name of report."""
+    return '-'.join([ctype, gsystem, str(date), 'sketch.json'])
+
+
+def savesketch(stats, filepath, extra=None):
+    """Save statistics sketches of stations.
+
+    Args:
+        stats:statistics of stations, type:dict, key:station name,
+            value:UNEHStats.
+        filepath:sketch file path.
+        extra:other daily statistics of stations saved under 'extra',
+            type:dict, key:station name, value:dict.
+    """
+    content = dict((name, stats[name].todict()) for name in stats)
+    if extra:
+        for name in content:
+            if name in extra:
+                content[name]['extra'] = dict(
+                    (key, float(value)) for key, value in extra[name].items())
+    with resultwriter.getwriter().open(filepath) as f:
+        json.dump(content, f)
+
+
+def loadsketch(filepath):
+    """Load statistics sketches of stations.
+
+    Arg:
+        filepath:sketch file path.
+
+    Return:
+        stats:statistics of stations, type:dict, key:station name,
+            value:UNEHStats, if sketch file not exists, return None.
+    """
+    if not os.path.isfile(filepath):
+        return None
+    with open(filepath) as f:
+        content = json.load(f)
+    return dict((name, UNEHStats.fromdict(content[name])) for name in content)
+
+
+def reportcolumns(filepath):
+    """Return npz columns file path of csv report."""
+    return os.path.splitext(filepath)[0] + '.npz'
+
+
+def savereport(report, filepath):
+    """Save report as tab separated csv and full precision npz columns.
+
+    Csv rounded to 2 decimals is kept for human, readers prefer npz
+    columns saved next to it, see loadreport.
+
+    Args:
+        report:report of stations, type:DataFrame.
+        filepath:csv report file path.
+    """
+    writer = resultwriter.getwriter()
+    writer.tocsv(report,
+                 filepath,
+                 sep='\t',
+                 na_rep=' ',
+                 index=False,
+                 float_format='%.2f')
+    columns = OrderedDict()
+    for col in report.columns:
+        values = report[col].values
+        # object columns are saved as strings, npz loads without pickle
+        columns[col] = values.astype(str) if values.dtype == object \
+            else values
+    writer.savez(reportcolumns(filepath), **columns)
+
+
+def reportsource(filepath):
+    """Return file of report to load, npz columns are preferred to csv.
+
+    Csv is read if npz columns not exist or csv is changed after them.
+
+    Arg:
+        filepath:csv report file path.
+
+    Return:
+        path:npz columns or csv path, if report not exists, return None.
+    """
+    columns = reportcolumns(filepath)
+    if os.path.isfile(columns) and (
+            not os.path.isfile(filepath) or
+            os.path.getmtime(columns) >= os.path.getmtime(filepath)):
+        return columns
+    if not os.path.isfile(filepath):
+        return None
+    return filepath
+
+
+def readreport(path):
+    """Read report from npz columns or csv path returned by reportsource."""
+    if path.endswith('.npz'):
+        with np.load(path) as data:
+            return pd.DataFrame(
+                OrderedDict((col, data[col]) for col in data.files))
+    # blank cells are written for NaN, station names may be all digits
+    return pd.read_csv(path, sep='\t', na_values=[' '], dtype={'name': str})
+
+
+def loadreport(filepath):
+    """Load report, npz columns are preferred to csv, see reportsource.
+
+    Arg:
+        filepath:csv report file path.
+
+    Return:
+        report:report of stations, type:DataFrame, if report not exists,
+            return None.
+    """
+    path = reportsource(filepath)
+    if path is None:
+        return None
+    return readreport(path)
+
+
+def gridrms(store, binsize=3600):
+    """Calculate rms of U, N, E, H errors in station x time bin cells.
+
+    Args:
+        store:U, N, E series of stations, type:series.SeriesStore.
+        binsize:seconds of time bin.
+
+    Return:
+        names:station names, row of cells, type:list.
+        counts:epochs of cells, station x bin, type:numpy.ndarray.
+        grid:rms of cells, nan is no epoch, type:OrderedDict, key:
+            COMPONENTS, value:station x bin, type:numpy.ndarray.
+    """
+    names = store.keys()
+    data = store.arrays()
+    nbin = int(math.ceil(86400.0 / binsize))
+    size = len(names) * nbin
+    values = OrderedDict()
+    for comp in ['U', 'N', 'E']:
+        values[comp] = getattr(data, comp).astype(np.float64)
+    values['H'] = np.hypot(values['N'], values['E'])
+    valid = np.isfinite(values['U']) & np.isfinite(values['H'])
+    cell = (store.index()[valid].astype(np.int64) * nbin +
+            np.minimum(data.time[valid] // binsize, nbin - 1))
+    counts = np.bincount(cell, minlength=size)
+    grid = OrderedDict()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for comp in COMPONENTS:
+            squares = np.bincount(
+                cell, weights=values[comp][valid]**2, minlength=size)
+            grid[comp] = np.sqrt(squares / counts).reshape(len(names), nbin)
+    return names, counts.reshape(len(names), nbin), grid
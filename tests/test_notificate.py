@@ -0,0 +1,137 @@
+# coding:utf-8
+"""Test notification sender, outbox and retry with local SMTP server."""
+
+import os
+import sys
+import smtplib
+import time
+import tempfile
+import shutil
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from GNSSWarn.alertstate import AlertState, Condition
+from GNSSWarn.notificate import notificate
+from GNSSWarn.notificate.localsmtp import LocalSMTPServer
+
+
+class SenderTest(unittest.TestCase):
+    def setUp(self):
+        self.server = LocalSMTPServer()
+        host, port = self.server.start()
+        self.outbox = tempfile.mkdtemp()
+        self.config = notificate.Config(['to@example.com'], ['to'])
+        self.config.from_addr = 'from@example.com'
+        self.config.email_server = host
+        self.config.email_port = port
+        self.config.outbox = self.outbox
+        self.config.retry = 3
+        self.config.retry_delay = 0
+        self.config.timeout = 5
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.outbox, ignore_errors=True)
+
+    def send(self, messages, alertdb=None, keys=None):
+        sender = notificate.Sender(self.config)
+        for msg in messages:
+            sender.outbox.put(self.config.from_addr, self.config.addr, msg,
+                              alertdb, keys)
+        sender.start()
+        sender.notify()
+        # sender is idle while emails wait for retry, wait for outbox
+        deadline = time.time() + 10
+        while sender.outbox.pending() and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertTrue(sender.idle.wait(10))
+        return sender
+
+    def test_send(self):
+        sender = self.send(['Subject: a\r\n\r\nfirst\r\n',
+                            'Subject: b\r\n\r\nsecond\r\n'])
+        self.assertEqual(len(self.server.messages), 2)
+        self.assertEqual(self.server.messages[0][1], ['to@example.com'])
+        bodies = ''.join(message[2] for message in self.server.messages)
+        self.assertIn('first', bodies)
+        self.assertIn('second', bodies)
+        # one SMTP session is reused by emails
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(sender.outbox.pending(), [])
+
+    def test_retry(self):
+        self.server.fail = 2
+        sender = self.send(['Subject: a\r\n\r\nretried\r\n'])
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertGreater(self.server.connections, 1)
+        self.assertEqual(sender.outbox.pending(), [])
+
+    def test_failed(self):
+        self.server.fail = 100
+        sender = self.send(['Subject: a\r\n\r\nfailed\r\n'])
+        self.assertEqual(self.server.messages, [])
+        self.assertEqual(sender.outbox.pending(), [])
+        self.assertEqual(len(os.listdir(sender.outbox.failedpath)), 1)
+
+    def test_undeliverable_survives_restart(self):
+        self.server.fail = 100
+        self.config.retry_delay = 1
+        first = notificate.Sender(self.config)
+        first.outbox.put(self.config.from_addr, self.config.addr,
+                         'Subject: a\r\n\r\nkept\r\n')
+        self.assertGreater(first.sendpending(), 0)
+        first.mailer.close()
+        names = first.outbox.pending()
+        self.assertEqual(len(names), 1)
+        self.assertEqual(first.outbox.read(names[0])['attempts'], 1)
+        # sender of next run sends email left in outbox
+        self.server.fail = 0
+        sender = self.send([])
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertIn('kept', self.server.messages[0][2])
+        self.assertEqual(sender.outbox.pending(), [])
+
+    def digest(self):
+        alertdb = os.path.join(self.outbox, 'alert.sqlite')
+        state = AlertState(alertdb, suppress=3600)
+        conditions = [Condition(('ratio', 'BDS', 'B1', 'abcd'), 'abcd')]
+        self.assertEqual(state.observe(conditions), conditions)
+        message, _, keys = state.popdigest()
+        self.assertIn('abcd', message)
+        # queued digest is not sent yet, condition is suppressed
+        self.assertEqual(state.observe(conditions), [])
+        return alertdb, state, conditions, keys
+
+    def test_alerts_confirmed_when_sent(self):
+        alertdb, state, conditions, keys = self.digest()
+        self.send(['Subject: a\r\n\r\nabcd\r\n'], alertdb, keys)
+        self.assertEqual(len(self.server.messages), 1)
+        state.release([])
+        self.assertEqual(state.observe(conditions), [])
+        row = state.connection.execute(
+            'SELECT last_sent FROM Alert').fetchone()
+        self.assertIsNotNone(row[0])
+        state.close()
+
+    def test_failed_alerts_released(self):
+        self.server.fail = 100
+        alertdb, state, conditions, keys = self.digest()
+        sender = self.send(['Subject: a\r\n\r\nabcd\r\n'], alertdb, keys)
+        self.assertEqual(sender.outbox.alertkeys(alertdb), [])
+        # failed digest is not confirmed, condition is new again
+        state.release(sender.outbox.alertkeys(alertdb))
+        self.assertEqual(state.observe(conditions), conditions)
+        state.close()
+
+    def test_plain_login_refused(self):
+        self.config.email_user = 'user'
+        self.config.email_password = 'secret'
+        mailer = notificate.Mailer(self.config)
+        with self.assertRaises(smtplib.SMTPNotSupportedError):
+            mailer.connect()
+        self.assertIsNone(mailer.server)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+# coding:utf-8
+"""Test UNEH statistics against sorting the whole coor data."""
+
+import os
+import sys
+import unittest
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import statistic
+
+
+def baseline(data):
+    """Statistics of coor data by sorting every component, include nan."""
+    num = data.shape[0]
+    index = int(num * 0.95)
+    h = np.sqrt(data.N.pow(2) + data.E.pow(2))
+    result = dict()
+    for comp, values in [('U', data.U), ('N', data.N), ('E', data.E),
+                         ('H', h)]:
+        result['%s_rms' % comp] = np.sqrt(values.pow(2).sum() / num)
+        result['%s_95' % comp] = values.abs().sort_values().iloc[index]
+    result['effective_rate'] = num / 86400.0
+    return result
+
+
+def coordata(num, nan=0, seed=0):
+    """Return random coor data, nan rows are coerced from invalid text."""
+    random = np.random.RandomState(seed)
+    data = pd.DataFrame({
+        'ws': np.arange(num) * 5,
+        'U': random.normal(0, 0.3, num),
+        'N': random.normal(0, 0.1, num),
+        'E': random.standard_t(3, num) * 0.1
+    })
+    rows = random.choice(num, nan, replace=False)
+    data.loc[rows[:nan // 2], 'U'] = np.nan
+    data.loc[rows[nan // 2:], 'N'] = np.nan
+    return data
+
+
+def accumulate(data, chunksize, **kwargs):
+    stats = statistic.UNEHStats(**kwargs)
+    for start in range(0, len(data), chunksize):
+        stats.update(data.iloc[start:start + chunksize])
+    return stats
+
+
+class UNEHStatsTest(unittest.TestCase):
+    def assertresult(self, result, expected, rtol=1e-12):
+        self.assertEqual(list(result), statistic.COLUMNS)
+        for col in statistic.COLUMNS:
+            np.testing.assert_allclose(
+                result[col], expected[col], rtol=rtol, err_msg=col)
+
+    def test_exact_matches_baseline(self):
+        for num, nan in [(1, 0), (20, 0), (10007, 0), (10007, 40)]:
+            data = coordata(num, nan)
+            for chunksize in [1000, num]:
+                self.assertresult(
+                    accumulate(data, chunksize).result(), baseline(data))
+
+    def test_exact_nan_sorted_last(self):
+        # more than 5% nan rows, 95% value is nan like sort_values
+        data = coordata(1000, 200)
+        result = accumulate(data, 300).result()
+        expected = baseline(data)
+        self.assertTrue(np.isnan(expected['U_95']))
+        self.assertresult(result, expected)
+
+    def test_sketch_within_accuracy(self):
+        data = coordata(50000, 100, seed=1)
+        expected = baseline(data)
+        for accuracy in [0.005, 0.02]:
+            stats = accumulate(data, 7000, exact=False, accuracy=accuracy)
+            result = stats.result()
+            for comp in statistic.COMPONENTS:
+                col = '%s_95' % comp
+                self.assertLessEqual(
+                    abs(result[col] - expected[col]),
+                    accuracy * expected[col], col)
+                np.testing.assert_allclose(result['%s_rms' % comp],
+                                           expected['%s_rms' % comp])
+
+    def test_sketch_merge_and_dict(self):
+        data = coordata(30000, 60, seed=2)
+        expected = baseline(data)
+        first = accumulate(data.iloc[:12345], 5000, exact=False)
+        second = accumulate(data.iloc[12345:], 5000, exact=False)
+        first.merge(statistic.UNEHStats.fromdict(second.todict()))
+        result = first.result()
+        for comp in statistic.COMPONENTS:
+            col = '%s_95' % comp
+            self.assertLessEqual(
+                abs(result[col] - expected[col]), 0.005 * expected[col], col)
+
+    def test_exact_falls_back_to_sketch(self):
+        data = coordata(5000)
+        stats = accumulate(data, 1000, maxrows=3000)
+        self.assertFalse(stats.exact)
+        self.assertEqual(stats.values['U'], list())
+        expected = baseline(data)
+        self.assertLessEqual(
+            abs(stats.result()['U_95'] - expected['U_95']),
+            0.005 * expected['U_95'])
+
+
+if __name__ == '__main__':
+    unittest.main()
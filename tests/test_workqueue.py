@@ -0,0 +1,146 @@
+# coding:utf-8
+"""Test work queue lease, heartbeat, requeue and complete with workers."""
+
+import os
+import sys
+import time
+import signal
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import workqueue
+
+
+def runtask(task, staging):
+    """Write result file of task and log its execution."""
+    with open(os.path.join(staging, '%d.txt' % task.id), 'w') as f:
+        f.write(task.module)
+    # staging is <workdir>/result/.staging/<worker>-<task>
+    workdir = os.path.dirname(os.path.dirname(os.path.dirname(staging)))
+    # one write in append mode, lines of parallel workers do not mix
+    with open(os.path.join(workdir, 'executed.log'), 'a') as f:
+        f.write('%d\n' % task.id)
+
+
+def hangtask(task, staging):
+    """Task of a worker which is killed while running it."""
+    time.sleep(60)
+
+
+def runworker(path, respath, execute, lease, results):
+    queue = workqueue.WorkQueue(path, lease)
+    results.put(workqueue.work(queue, execute, respath, poll=0.1))
+    queue.close()
+
+
+class WorkQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.workdir, 'queue.sqlite')
+        self.respath = os.path.join(self.workdir, 'result')
+        os.makedirs(self.respath)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def tasks(self, num):
+        return [('report', '2019-01-%02d' % (i % 28 + 1), 'BDS', str(i))
+                for i in range(num)]
+
+    def test_workers_complete_once(self):
+        queue = workqueue.WorkQueue(self.path, lease=5)
+        self.assertEqual(queue.enqueue(self.tasks(40)), 40)
+        # tasks already queued are not added again
+        self.assertEqual(queue.enqueue(self.tasks(40)), 0)
+        results = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(
+                target=runworker,
+                args=(self.path, self.respath, runtask, 5, results))
+            for _ in range(4)
+        ]
+        [worker.start() for worker in workers]
+        done = [results.get(timeout=60) for _ in workers]
+        [worker.join() for worker in workers]
+        self.assertEqual(sum(done), 40)
+        self.assertEqual(queue.status(), {'done': 40})
+        with open(os.path.join(self.workdir, 'executed.log')) as f:
+            executed = sorted(int(line) for line in f)
+        self.assertEqual(executed, list(range(1, 41)))
+        for i in range(1, 41):
+            self.assertTrue(
+                os.path.isfile(os.path.join(self.respath, '%d.txt' % i)))
+        self.assertEqual(
+            os.listdir(os.path.join(self.respath, workqueue.STAGING)), [])
+        queue.close()
+
+    def test_killed_worker_requeued(self):
+        queue = workqueue.WorkQueue(self.path, lease=1)
+        queue.enqueue(self.tasks(1))
+        results = multiprocessing.Queue()
+        worker = multiprocessing.Process(
+            target=runworker,
+            args=(self.path, self.respath, hangtask, 1, results))
+        worker.start()
+        deadline = time.time() + 30
+        while not queue.status().get('leased'):
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.05)
+        # heartbeat keeps lease of running worker
+        time.sleep(2)
+        self.assertEqual(queue.status(), {'leased': 1})
+        os.kill(worker.pid, signal.SIGKILL)
+        worker.join()
+        # lease expires without heartbeat
+        time.sleep(1.5)
+        self.assertEqual(
+            workqueue.work(queue, runtask, self.respath, worker='second',
+                           poll=0.1), 1)
+        self.assertEqual(queue.status(), {'done': 1})
+        row = queue.connection.execute(
+            'SELECT attempts, worker FROM Task').fetchone()
+        self.assertEqual(row, (2, 'second'))
+        self.assertTrue(os.path.isfile(os.path.join(self.respath, '1.txt')))
+        # staging of killed worker is removed
+        self.assertEqual(
+            os.listdir(os.path.join(self.respath, workqueue.STAGING)), [])
+        queue.close()
+
+    def test_lost_lease(self):
+        queue = workqueue.WorkQueue(self.path, lease=10, retry=2)
+        queue.enqueue(self.tasks(1))
+        task = queue.leasetask('first', now=100)
+        self.assertTrue(queue.heartbeat(task, 'first', now=105))
+        self.assertEqual(queue.requeue(now=114), 0)
+        self.assertEqual(queue.requeue(now=116), 1)
+        # expired worker can not renew or complete task
+        self.assertFalse(queue.heartbeat(task, 'first'))
+        self.assertFalse(queue.complete(task, 'first'))
+        task = queue.leasetask('second', now=200)
+        self.assertEqual(task.attempts, 2)
+        # lease of the last attempt expires, task is failed
+        self.assertEqual(queue.requeue(now=300), 0)
+        self.assertEqual(queue.status(), {'failed': 1})
+        queue.close()
+
+    def test_complete_publishes(self):
+        queue = workqueue.WorkQueue(self.path)
+        queue.enqueue(self.tasks(2))
+        task = queue.leasetask('first')
+        published = list()
+        self.assertTrue(
+            queue.complete(task, 'first', lambda: published.append(task.id)))
+        self.assertEqual(published, [task.id])
+        # a done task is not leased and not completed again
+        self.assertFalse(queue.complete(task, 'first'))
+        self.assertNotEqual(queue.leasetask('first').id, task.id)
+        self.assertIsNone(queue.leasetask('first'))
+        queue.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
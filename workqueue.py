@@ -0,0 +1,311 @@
+# coding:utf-8
+"""Work queue shared by evaluation hosts.
+
+The queue is a SQLite database on the shared mount. A coordinator enqueues
+(module, date, system, type) tasks, workers on any host lease tasks, renew
+their lease by heartbeat and publish results atomically. Leases of crashed
+workers expire and their tasks are queued again.
+"""
+
+import os
+import glob
+import time
+import socket
+import shutil
+import sqlite3
+import datetime
+import threading
+from collections import namedtuple
+
+LEASE = 600  # seconds of a lease without heartbeat
+RETRY = 3  # attempts of a task before it is failed
+POLL = 5  # seconds between lease attempts of idle worker
+STAGING = '.staging'
+
+Task = namedtuple('Task', ('id', 'module', 'date', 'system', 'type',
+                           'attempts'))
+
+
+class WorkQueue(object):
+    """SQLite work queue.
+
+    Every state change runs in an immediate transaction, so a task is only
+    leased by one worker. A worker owns a task while its lease is valid,
+    heartbeat and complete of a lost lease fail.
+
+    Attributes:
+        path:sqlite database path.
+        lease:seconds of a lease.
+        retry:attempts of a task before it is failed.
+    """
+
+    def __init__(self, path, lease=LEASE, retry=RETRY):
+        """Initialize WorkQueue."""
+        self.path = path
+        self.lease = lease
+        self.retry = retry
+        self.connection = sqlite3.connect(
+            path, timeout=60, isolation_level=None)
+        self.connection.execute(
+            '''CREATE TABLE IF NOT EXISTS Task(id INTEGER PRIMARY KEY
+            AUTOINCREMENT, module TEXT NOT NULL, date TEXT NOT NULL, system
+            TEXT, type TEXT, status TEXT NOT NULL, worker TEXT, lease_until
+            DOUBLE, attempts INTEGER DEFAULT 0, error TEXT, updated DOUBLE,
+            UNIQUE(module, date, system, type))''')
+
+    def _transaction(self, statements):
+        """Execute statements in an immediate transaction.
+
+        Arg:
+            statements:function called with cursor, its result is returned.
+        """
+        cur = self.connection.cursor()
+        cur.execute('BEGIN IMMEDIATE')
+        try:
+            result = statements(cur)
+            cur.execute('COMMIT')
+        except Exception:
+            cur.execute('ROLLBACK')
+            raise
+        finally:
+            cur.close()
+        return result
+
+    def enqueue(self, tasks):
+        """Enqueue tasks, finished or queued tasks are not added again.
+
+        Arg:
+            tasks:(module, date, system, type) tuples, type:list.
+
+        Return:
+            num:number of new tasks.
+        """
+        now = time.time()
+
+        def statements(cur):
+            num = 0
+            for module, date, gsystem, ctype in tasks:
+                cur.execute(
+                    '''INSERT OR IGNORE INTO Task(module, date, system, type,
+                    status, updated) VALUES(?, ?, ?, ?, 'queued', ?)''',
+                    (module, str(date), gsystem or '', ctype or '', now))
+                num += cur.rowcount
+            return num
+
+        return self._transaction(statements)
+
+    def requeue(self, now=None):
+        """Queue tasks whose lease expired again, return number of them."""
+        now = now or time.time()
+
+        def statements(cur):
+            cur.execute(
+                '''UPDATE Task SET status='queued', worker=NULL,
+                error='lease expired', updated=? WHERE status='leased' AND
+                lease_until<? AND attempts<?''', (now, now, self.retry))
+            num = cur.rowcount
+            cur.execute(
+                '''UPDATE Task SET status='failed', worker=NULL,
+                error='lease expired', updated=? WHERE status='leased' AND
+                lease_until<?''', (now, now))
+            return num
+
+        return self._transaction(statements)
+
+    def leasetask(self, worker, now=None):
+        """Lease a queued task.
+
+        Arg:
+            worker:worker id.
+
+        Return:
+            task:leased task, if no task is queued, return None.
+        """
+        now = now or time.time()
+
+        def statements(cur):
+            cur.execute(
+                '''SELECT id, module, date, system, type, attempts FROM Task
+                WHERE status='queued' ORDER BY date, id LIMIT 1''')
+            row = cur.fetchone()
+            if row is None:
+                return None
+            cur.execute(
+                '''UPDATE Task SET status='leased', worker=?, lease_until=?,
+                attempts=attempts+1, updated=? WHERE id=?''',
+                (worker, now + self.lease, now, row[0]))
+            return Task(*(row[:5] + (row[5] + 1, )))
+
+        return self._transaction(statements)
+
+    def heartbeat(self, task, worker, now=None):
+        """Renew lease of task, return False if lease is lost."""
+        now = now or time.time()
+
+        def statements(cur):
+            cur.execute(
+                '''UPDATE Task SET lease_until=?, updated=? WHERE id=? AND
+                worker=? AND status='leased' ''',
+                (now + self.lease, now, task.id, worker))
+            return cur.rowcount == 1
+
+        return self._transaction(statements)
+
+    def complete(self, task, worker, publish=None):
+        """Mark task done, return False if lease is lost.
+
+        Args:
+            task:leased task.
+            worker:worker id.
+            publish:called in transaction before task is marked done, so
+                results of a lost lease are not published, type:function.
+        """
+        now = time.time()
+
+        def statements(cur):
+            cur.execute(
+                '''SELECT 1 FROM Task WHERE id=? AND worker=? AND
+                status='leased' ''', (task.id, worker))
+            if cur.fetchone() is None:
+                return False
+            if publish:
+                publish()
+            cur.execute(
+                '''UPDATE Task SET status='done', lease_until=NULL, error=NULL,
+                updated=? WHERE id=?''', (now, task.id))
+            return True
+
+        return self._transaction(statements)
+
+    def fail(self, task, worker, error):
+        """Queue failed task again, or mark it failed after retry attempts."""
+        now = time.time()
+
+        def statements(cur):
+            cur.execute(
+                '''UPDATE Task SET status=CASE WHEN attempts<? THEN 'queued'
+                ELSE 'failed' END, worker=NULL, lease_until=NULL, error=?,
+                updated=? WHERE id=? AND worker=? AND status='leased' ''',
+                (self.retry, str(error), now, task.id, worker))
+
+        self._transaction(statements)
+
+    def status(self):
+        """Return number of tasks by status, type:dict."""
+        cur = self.connection.cursor()
+        cur.execute('SELECT status, count(*) FROM Task GROUP BY status')
+        status = dict(cur.fetchall())
+        cur.close()
+        return status
+
+    def close(self):
+        self.connection.close()
+
+
+def workerid():
+    """Return worker id made from host name and process id."""
+    return '%s-%d' % (socket.gethostname(), os.getpid())
+
+
+def publish(staging, respath):
+    """Move result files of staging directory into result directory.
+
+    Every file is moved by os.replace, so readers see old or new file, never
+    a partial one. Staging directory should be on the same file system.
+    """
+    for root, dirs, files in os.walk(staging):
+        target = os.path.join(respath, os.path.relpath(root, staging))
+        if not os.path.exists(target):
+            os.makedirs(target)
+        for name in files:
+            os.replace(os.path.join(root, name), os.path.join(target, name))
+    shutil.rmtree(staging, ignore_errors=True)
+
+
+class Heartbeat(object):
+    """Renew lease of task in background thread until stopped."""
+
+    def __init__(self, queue, task, worker, interval):
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, args=(queue.path, queue.lease, task, worker,
+                                    interval))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, path, lease, task, worker, interval):
+        # sqlite connection can not be shared by threads
+        queue = WorkQueue(path, lease)
+        while not self._stop.wait(interval):
+            try:
+                if not queue.heartbeat(task, worker):
+                    self.lost = True
+                    break
+            except sqlite3.Error as e:
+                print('Heartbeat of task %d failed: %s' % (task.id, e))
+        queue.close()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def work(queue, execute, respath, worker=None, poll=POLL, once=False):
+    """Lease and execute tasks until no task is queued or leased.
+
+    Results of a task are written in a staging directory under respath and
+    published when task is completed.
+
+    Args:
+        queue:work queue, type:WorkQueue.
+        execute:called with task and staging result path, type:function.
+        respath:result path.
+        worker:worker id, default workerid().
+        poll:seconds between lease attempts when tasks are leased by others.
+        once:if True, return after one task.
+
+    Return:
+        done:number of tasks done by worker.
+    """
+    worker = worker or workerid()
+    done = 0
+    while True:
+        queue.requeue()
+        task = queue.leasetask(worker)
+        if task is None:
+            if not queue.status().get('leased'):
+                return done
+            time.sleep(poll)
+            continue
+        staging = os.path.join(respath, STAGING, '%s-%d' % (worker, task.id))
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        heartbeat = Heartbeat(queue, task, worker, max(queue.lease / 3.0, 1))
+        try:
+            execute(task, staging)
+        except Exception as e:
+            heartbeat.stop()
+            print('Task %s %s %s %s failed: %s' %
+                  (task.module, task.date, task.system, task.type, e))
+            queue.fail(task, worker, e)
+            shutil.rmtree(staging, ignore_errors=True)
+            continue
+        heartbeat.stop()
+        if not heartbeat.lost and queue.complete(
+                task, worker, lambda: publish(staging, respath)):
+            done += 1
+            # staging directories of crashed workers leased the task
+            for name in glob.glob(
+                    os.path.join(respath, STAGING, '*-%d' % task.id)):
+                shutil.rmtree(name, ignore_errors=True)
+        else:
+            print('Lease of task %d lost, results are discarded' % task.id)
+            shutil.rmtree(staging, ignore_errors=True)
+        if once:
+            return done
+
+
+def parsedate(date):
+    """Parse date of task, type:datetime.date."""
+    return datetime.datetime.strptime(date, '%Y-%m-%d').date()